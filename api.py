@@ -0,0 +1,256 @@
+"""API HTTP de GeldTrack, en un proceso aparte de la interfaz de Streamlit.
+
+Comparte la capa de datos con la app: mismas tablas, mismas sesiones y los
+mismos roles de usuarios_cuentas (viewer lee; editor y admin también
+escriben). Se autentica con un token de sesión como Bearer, que se obtiene
+con email y contraseña en POST /api/sesiones.
+
+    POST   /api/sesiones                        {email, password} -> {token, usuario}
+    DELETE /api/sesiones                        cierra la sesión del token
+    GET    /api/cuentas                         cuentas del usuario con su rol
+    GET    /api/cuentas/{id}/gastos             ?desde&hasta&limite&despues&inusuales
+    POST   /api/cuentas/{id}/gastos             {gastos: [{fecha, lugar, cantidad, categoria, notas}]}
+    GET    /api/cuentas/{id}/resumen            ?desde=YYYY-MM&hasta=YYYY-MM
+
+Los lotes de gastos entran en una sola transacción, como una importación
+CSV: o se validan todos o no se inserta ninguno, las categorías que falten
+se crean y los gastos que ya estén en la cuenta se descartan por su huella,
+así que reenviar un lote tras un error de red no duplica nada.
+
+Arranque: `uvicorn api:app --port 8000` (o `python api.py`).
+"""
+import json
+import os
+import re
+from contextlib import asynccontextmanager
+from datetime import date
+
+import anyio
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from database import (
+    initialize_db, cerrar_conexiones, get_user_accounts, get_pagina_gastos,
+    get_resumen_mensual, desde_centimos, POOL_MAX_CONEXIONES,
+)
+from utils.autenticacion import (
+    verificar_usuario, crear_sesion, verificar_sesion, revocar_sesion, rol_en_cuenta, ROLES_ESCRITURA,
+)
+from utils.importador import normalizar_registros, importar_registros
+
+# Gastos por petición y tamaño máximo del cuerpo
+MAX_GASTOS_LOTE = 1000
+MAX_BYTES_CUERPO = 1024 * 1024
+
+TAMANO_PAGINA = 50
+MAX_TAMANO_PAGINA = 500
+
+_MES = re.compile(r"\d{4}-(0[1-9]|1[0-2])")
+_FECHA = re.compile(r"\d{4}-\d{2}-\d{2}")
+_CURSOR = re.compile(r"(\d{4}-\d{2}-\d{2}),(\d+)")
+
+# Cada hilo tiene su propia conexión: tantos hilos como conexiones en el pool
+_hilos = anyio.CapacityLimiter(POOL_MAX_CONEXIONES)
+
+def _en_hilo(funcion, *args):
+    """Ejecuta código de la base de datos (bloqueante) fuera del bucle de eventos."""
+    return anyio.to_thread.run_sync(lambda: funcion(*args), limiter=_hilos)
+
+def _token(request):
+    cabecera = request.headers.get('authorization', '')
+    tipo, _, token = cabecera.partition(' ')
+    return token.strip() if tipo.lower() == 'bearer' else None
+
+async def _usuario(request):
+    """(usuario_id, nombre, email) de la sesión del token, o 401."""
+    sesion = await _en_hilo(verificar_sesion, _token(request))
+    if sesion is None:
+        raise HTTPException(401, "Token ausente, inválido o caducado", headers={'WWW-Authenticate': 'Bearer'})
+    return sesion
+
+async def _cuenta(request, escritura=False):
+    """(usuario_id, cuenta_id) si el usuario tiene acceso a la cuenta de la ruta.
+
+    Sin acceso se responde 404, igual que si la cuenta no existiera.
+    """
+    usuario_id = (await _usuario(request))[0]
+    cuenta_id = request.path_params['cuenta_id']
+    rol = await _en_hilo(rol_en_cuenta, usuario_id, cuenta_id)
+    if rol is None:
+        raise HTTPException(404, "Cuenta no encontrada")
+    if escritura and rol not in ROLES_ESCRITURA:
+        raise HTTPException(403, f"El rol {rol} no puede registrar gastos")
+    return usuario_id, cuenta_id
+
+async def _json(request):
+    """Cuerpo JSON de la petición, leído sin pasar de MAX_BYTES_CUERPO.
+
+    content-length sólo permite rechazar antes de leer: un cuerpo por
+    bloques (chunked) no lo trae, así que se cuenta lo que va llegando.
+    """
+    try:
+        longitud = int(request.headers.get('content-length') or 0)
+    except ValueError:
+        raise HTTPException(400, "content-length debe ser un entero")
+    demasiado_grande = HTTPException(413, f"El cuerpo no puede pasar de {MAX_BYTES_CUERPO} bytes")
+    if longitud > MAX_BYTES_CUERPO:
+        raise demasiado_grande
+    cuerpo = bytearray()
+    async for bloque in request.stream():
+        cuerpo += bloque
+        if len(cuerpo) > MAX_BYTES_CUERPO:
+            raise demasiado_grande
+    try:
+        return json.loads(cuerpo)
+    except ValueError:
+        raise HTTPException(400, "El cuerpo no es JSON válido")
+
+def _fecha(valor, parametro):
+    # Entera: fecha_iso() sólo mira los 10 primeros caracteres
+    try:
+        if _FECHA.fullmatch(valor):
+            return date.fromisoformat(valor).isoformat()
+    except ValueError:
+        pass
+    raise HTTPException(400, f"{parametro} debe ser una fecha YYYY-MM-DD")
+
+def _entero(valor, parametro, minimo, maximo):
+    try:
+        numero = int(valor)
+    except ValueError:
+        raise HTTPException(400, f"{parametro} debe ser un entero")
+    if not minimo <= numero <= maximo:
+        raise HTTPException(400, f"{parametro} debe estar entre {minimo} y {maximo}")
+    return numero
+
+def _fila(fila):
+    return dict(zip(fila.keys(), fila))
+
+async def iniciar_sesion(request):
+    datos = await _json(request)
+    if not isinstance(datos, dict) or not isinstance(datos.get('email'), str) or not isinstance(datos.get('password'), str):
+        raise HTTPException(400, "Se esperaba {email, password}")
+    usuario = await _en_hilo(verificar_usuario, datos['email'], datos['password'])
+    if usuario is None:
+        raise HTTPException(401, "Email o contraseña incorrectos")
+    token = await _en_hilo(crear_sesion, usuario[0])
+    return JSONResponse({
+        'token': token,
+        'usuario': {'id': usuario[0], 'nombre': usuario[1], 'email': usuario[2]},
+    }, status_code=201)
+
+async def cerrar_sesion(request):
+    await _usuario(request)
+    await _en_hilo(revocar_sesion, _token(request))
+    return Response(status_code=204)
+
+async def listar_cuentas(request):
+    usuario_id = (await _usuario(request))[0]
+    cuentas = await _en_hilo(get_user_accounts, usuario_id)
+    return JSONResponse({'cuentas': [
+        {'id': cuenta['id'], 'nombre': cuenta['nombre'], 'rol': cuenta['rol']} for cuenta in cuentas
+    ]})
+
+async def listar_gastos(request):
+    """Gastos de más reciente a más antiguo, por páginas.
+
+    `desde` entra y `hasta` no; `despues` es el `siguiente` de la respuesta
+    anterior.
+    """
+    _, cuenta_id = await _cuenta(request)
+    parametros = request.query_params
+    limite = _entero(parametros.get('limite', TAMANO_PAGINA), 'limite', 1, MAX_TAMANO_PAGINA)
+    desde = _fecha(parametros['desde'], 'desde') if 'desde' in parametros else None
+    hasta = _fecha(parametros['hasta'], 'hasta') if 'hasta' in parametros else None
+    despues_de = None
+    if 'despues' in parametros:
+        cursor = _CURSOR.fullmatch(parametros['despues'])
+        if cursor is None:
+            raise HTTPException(400, "despues no es un cursor válido")
+        despues_de = (cursor[1], int(cursor[2]))
+    # get_pagina_gastos sólo filtra con las dos fechas
+    if desde or hasta:
+        desde, hasta = desde or '0001-01-01', hasta or '9999-12-31'
+
+    filas, hay_mas = await _en_hilo(
+        get_pagina_gastos, cuenta_id, limite, desde, hasta, despues_de, parametros.get('inusuales') == '1'
+    )
+    gastos = [_fila(fila) for fila in filas]
+    siguiente = f"{gastos[-1]['fecha']},{gastos[-1]['id']}" if hay_mas else None
+    return JSONResponse({'gastos': gastos, 'siguiente': siguiente})
+
+async def crear_gastos(request):
+    usuario_id, cuenta_id = await _cuenta(request, escritura=True)
+    datos = await _json(request)
+    registros = datos.get('gastos') if isinstance(datos, dict) else None
+    if not isinstance(registros, list) or not registros:
+        raise HTTPException(400, "Se esperaba {gastos: [...]} con al menos un gasto")
+    if len(registros) > MAX_GASTOS_LOTE:
+        raise HTTPException(413, f"Como mucho {MAX_GASTOS_LOTE} gastos por petición")
+
+    validos, errores = await _en_hilo(normalizar_registros, registros)
+    if errores:
+        return JSONResponse({
+            'error': "Hay gastos inválidos; no se ha registrado ninguno",
+            'errores': [{'posicion': posicion, 'mensaje': mensaje} for posicion, mensaje in errores],
+        }, status_code=422)
+    resultado = await _en_hilo(importar_registros, cuenta_id, usuario_id, validos)
+    return JSONResponse(
+        {'importados': resultado.importados, 'duplicados': resultado.duplicados},
+        status_code=201 if resultado.importados else 200
+    )
+
+async def resumen_mensual(request):
+    """Total y número de gastos por mes, con el desglose por categoría."""
+    _, cuenta_id = await _cuenta(request)
+    limites = {}
+    for parametro in ('desde', 'hasta'):
+        valor = request.query_params.get(parametro)
+        if valor is not None and not _MES.fullmatch(valor):
+            raise HTTPException(400, f"{parametro} debe ser un mes YYYY-MM")
+        limites[parametro] = valor
+
+    meses = {}
+    for fila in await _en_hilo(get_resumen_mensual, cuenta_id, limites['desde'], limites['hasta']):
+        mes = meses.setdefault(fila['mes'], {'mes': fila['mes'], 'total': 0.0, 'num_gastos': 0, 'categorias': []})
+        mes['total'] += desde_centimos(fila['total_centimos'])
+        mes['num_gastos'] += fila['num_gastos']
+        mes['categorias'].append({
+            'categoria_id': fila['categoria_id'],
+            'categoria': fila['categoria'],
+            'total': desde_centimos(fila['total_centimos']),
+            'num_gastos': fila['num_gastos'],
+            'minimo': desde_centimos(fila['minimo_centimos']),
+            'maximo': desde_centimos(fila['maximo_centimos']),
+        })
+    for mes in meses.values():
+        mes['total'] = round(mes['total'], 2)
+    return JSONResponse({'meses': list(meses.values())})
+
+async def _error_http(request, error):
+    return JSONResponse({'error': error.detail}, status_code=error.status_code, headers=error.headers)
+
+@asynccontextmanager
+async def _ciclo_vida(app):
+    await _en_hilo(initialize_db)
+    yield
+    cerrar_conexiones()
+
+app = Starlette(
+    routes=[
+        Route('/api/sesiones', iniciar_sesion, methods=['POST']),
+        Route('/api/sesiones', cerrar_sesion, methods=['DELETE']),
+        Route('/api/cuentas', listar_cuentas, methods=['GET']),
+        Route('/api/cuentas/{cuenta_id:int}/gastos', listar_gastos, methods=['GET']),
+        Route('/api/cuentas/{cuenta_id:int}/gastos', crear_gastos, methods=['POST']),
+        Route('/api/cuentas/{cuenta_id:int}/resumen', resumen_mensual, methods=['GET']),
+    ],
+    exception_handlers={HTTPException: _error_http},
+    lifespan=_ciclo_vida,
+)
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host=os.environ.get('API_HOST', '127.0.0.1'), port=int(os.environ.get('API_PORT', 8000)))
@@ -1,41 +1,34 @@
 import streamlit as st
-import sqlite3
-import bcrypt
-import pandas as pd
+from utils.arranque import medir_ejecucion
+import calendar
 from datetime import datetime, date, timedelta
-import extra_streamlit_components as stx
-from database import initialize_db as init_db, get_db_connection
-from components.sidebar import show_sidebar, apply_custom_css
+from database import initialize_db as init_db, transaccion, get_dashboard_snapshot, ErrorIntegridad, desde_centimos, detectar_cambios_externos
+from components.sidebar import show_sidebar, apply_custom_css, get_cuentas_usuario
 from translations import get_text
-from utils.session import get_cookie_manager, clear_session, set_current_account
-import plotly.express as px
+from utils.session import (
+    get_cookie_manager, preparar_cookie_manager, clear_session, set_current_account, COOKIE_SESION,
+)
+from utils.autenticacion import (
+    verificar_usuario, crear_sesion, verificar_sesion, DURACION_SESION, DURACION_SESION_TEMPORAL,
+)
+from utils.cache import invalidar_todo
+from utils import perfilador
 
 def registrar_usuario(nombre, email, password):
+    import bcrypt
     try:
-        conn = get_db_connection()
-        c = conn.cursor()
         hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-        c.execute(
-            "INSERT INTO usuarios (nombre, email, password) VALUES (?, ?, ?)",
-            (nombre, email, hashed)
-        )
-        conn.commit()
-        conn.close()
+        with transaccion() as conn:
+            conn.execute(
+                "INSERT INTO usuarios (nombre, email, password) VALUES (?, ?, ?)",
+                (nombre, email, hashed)
+            )
         return True
-    except sqlite3.IntegrityError:
+    except ErrorIntegridad:
         return False
 
-def verificar_usuario(email, password):
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("SELECT id, password, nombre, email FROM usuarios WHERE email = ?", (email,))
-    resultado = c.fetchone()
-    conn.close()
-    
-    if resultado and bcrypt.checkpw(password.encode('utf-8'), resultado[1]):
-        return resultado[0], resultado[2], resultado[3]
-
 def save_session(user_id, nombre, email, remember=False):
+    cookie_manager = get_cookie_manager()
     st.session_state.clear()  # Limpiar sesión anterior
     st.session_state.user_id = user_id
     st.session_state.user_name = nombre
@@ -43,37 +36,34 @@ def save_session(user_id, nombre, email, remember=False):
     st.session_state.is_authenticated = True
     st.session_state.cuenta_actual = None
     
+    duracion = DURACION_SESION if remember else DURACION_SESION_TEMPORAL
+    st.session_state.sesion_token = crear_sesion(user_id, duracion)
+    
     if remember:
-        cookie_manager = get_cookie_manager()
-        expiry = datetime.now() + timedelta(days=30)
-        
-        cookie_manager.set('user_id', str(user_id), expires_at=expiry)
-        cookie_manager.set('user_name', nombre, expires_at=expiry)
-        cookie_manager.set('user_email', email, expires_at=expiry)
+        expiry = datetime.now() + duracion
+        cookie_manager.set(COOKIE_SESION, st.session_state.sesion_token, key="set_sesion", expires_at=expiry)
 
 def check_saved_session():
-    # Si ya está autenticado, no hacer nada
+    # Si ya está autenticado, sólo comprobar que la sesión no se haya
+    # revocado (normalmente un acierto de caché, sin consultas)
     if st.session_state.get('is_authenticated', False):
+        if verificar_sesion(st.session_state.get('sesion_token')) is None:
+            clear_session()
         return
     
-    # Intentar restaurar desde cookies
+    # Intentar restaurar desde la cookie de sesión
     cookie_manager = get_cookie_manager()
-    user_id = cookie_manager.get('user_id')
+    token = cookie_manager.get(COOKIE_SESION)
     
-    if user_id:
+    if token:
         try:
-            user_id = int(user_id)
-            nombre = cookie_manager.get('user_name')
-            email = cookie_manager.get('user_email')
-            
-            conn = get_db_connection()
-            c = conn.cursor()
-            c.execute("SELECT id FROM usuarios WHERE id = ?", (user_id,))
-            
-            if c.fetchone():
+            sesion = verificar_sesion(token)
+            if sesion:
+                user_id, nombre, email = sesion
                 st.session_state.user_id = user_id
                 st.session_state.user_name = nombre
                 st.session_state.user_email = email
+                st.session_state.sesion_token = token
                 st.session_state.is_authenticated = True
                 st.session_state.cuenta_actual = None
                 
@@ -81,7 +71,6 @@ def check_saved_session():
                 cuenta_id = cookie_manager.get('cuenta_actual')
                 if cuenta_id:
                     st.session_state.cuenta_actual = int(cuenta_id)
-            conn.close()
         except Exception as e:
             print(f"Error restaurando sesión: {e}")
             clear_session()
@@ -141,16 +130,7 @@ def show_account_selector():
     st.sidebar.title(f"👋 Hola, {st.session_state.user_name}")
     
     # Obtener cuentas del usuario
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("""
-        SELECT c.id, c.nombre 
-        FROM cuentas c
-        JOIN usuarios_cuentas uc ON c.id = uc.cuenta_id
-        WHERE uc.usuario_id = ?
-    """, (st.session_state.user_id,))
-    cuentas = c.fetchall()
-    conn.close()
+    cuentas = get_cuentas_usuario(st.session_state.user_id)
     
     # Crear diccionario de cuentas
     cuentas_dict = {cuenta[1]: cuenta[0] for cuenta in cuentas}
@@ -168,19 +148,16 @@ def show_account_selector():
             nombre_cuenta = st.text_input("Nombre de la nueva cuenta")
             if st.form_submit_button("Crear Cuenta"):
                 if nombre_cuenta:
-                    conn = get_db_connection()
-                    c = conn.cursor()
-                    c.execute(
-                        "INSERT INTO cuentas (nombre, creador_id) VALUES (?, ?)",
-                        (nombre_cuenta, st.session_state.user_id)
-                    )
-                    cuenta_id = c.lastrowid
-                    c.execute(
-                        "INSERT INTO usuarios_cuentas (usuario_id, cuenta_id, rol) VALUES (?, ?, ?)",
-                        (st.session_state.user_id, cuenta_id, 'admin')
-                    )
-                    conn.commit()
-                    conn.close()
+                    with transaccion() as conn:
+                        cuenta_id = conn.execute(
+                            "INSERT INTO cuentas (nombre, creador_id) VALUES (?, ?) RETURNING id",
+                            (nombre_cuenta, st.session_state.user_id)
+                        ).fetchone()[0]
+                        conn.execute(
+                            "INSERT INTO usuarios_cuentas (usuario_id, cuenta_id, rol) VALUES (?, ?, ?)",
+                            (st.session_state.user_id, cuenta_id, 'admin')
+                        )
+                    invalidar_todo()
                     st.rerun()
     else:
         st.session_state.cuenta_actual = cuentas_dict[cuenta_seleccionada]
@@ -189,77 +166,46 @@ def show_main_menu():
     if 'cuenta_actual' not in st.session_state:
         st.session_state.cuenta_actual = None
         
-    show_account_selector()
-    opcion = show_sidebar("main")
-    
-    if opcion == "App":
-        show_main_dashboard()
-    elif opcion == "Gastos":
-        from pages.gastos import mostrar_contenido_gastos
-        mostrar_contenido_gastos()
-    elif opcion == "Categorías":
-        from pages.categorias import mostrar_contenido_categorias
-        mostrar_contenido_categorias()
-    elif opcion == "Análisis":
-        from pages.analisis import mostrar_contenido_analisis
-        mostrar_contenido_analisis()
-    elif opcion == "Configuración":
-        from pages.configuracion import mostrar_contenido_configuracion
-        mostrar_contenido_configuracion()
+    with perfilador.medir_rerun() as medicion:
+        with perfilador.fase('menu'):
+            show_account_selector()
+            opcion = show_sidebar("main")
+        # Los gastos que llegan por la API no pasan por la caché de este proceso
+        if st.session_state.cuenta_actual:
+            detectar_cambios_externos(st.session_state.cuenta_actual)
+        medicion.pagina = opcion
+        
+        if opcion == "App":
+            show_main_dashboard()
+        elif opcion == "Gastos":
+            from pages.gastos import mostrar_contenido_gastos
+            mostrar_contenido_gastos()
+        elif opcion == "Categorías":
+            from pages.categorias import mostrar_contenido_categorias
+            mostrar_contenido_categorias()
+        elif opcion == "Análisis":
+            from pages.analisis import mostrar_contenido_analisis
+            mostrar_contenido_analisis()
+        elif opcion == "Configuración":
+            from pages.configuracion import mostrar_contenido_configuracion
+            mostrar_contenido_configuracion()
 
 def show_main_dashboard():
     if not st.session_state.get('cuenta_actual'):
         st.warning(get_text('seleccione_cuenta_dashboard'))
         return
     
-    # Obtener datos generales
-    conn = get_db_connection()
-    
-    # Total gastado este mes
-    total_mes = pd.read_sql_query("""
-        SELECT COALESCE(SUM(cantidad), 0) as total
-        FROM gastos 
-        WHERE cuenta_id = ? 
-        AND strftime('%Y-%m', fecha) = ?
-    """, conn, params=(st.session_state.cuenta_actual, datetime.now().strftime('%Y-%m'))).iloc[0]['total']
-    
-    # Total gastado mes anterior
-    total_mes_anterior = pd.read_sql_query("""
-        SELECT COALESCE(SUM(cantidad), 0) as total
-        FROM gastos 
-        WHERE cuenta_id = ? 
-        AND strftime('%Y-%m', fecha) = ?
-    """, conn, params=(st.session_state.cuenta_actual, (datetime.now() - timedelta(days=30)).strftime('%Y-%m'))).iloc[0]['total']
-    
-    # Presupuesto total
-    presupuesto_total = pd.read_sql_query("""
-        SELECT COALESCE(SUM(presupuesto_mensual), 0) as total
-        FROM categorias
-        WHERE cuenta_id = ?
-    """, conn, params=(st.session_state.cuenta_actual,)).iloc[0]['total']
-    
-    # Últimos 10 gastos (sin filtro de mes)
-    ultimos_gastos = pd.read_sql_query("""
-        SELECT 
-            strftime('%d/%m/%Y', g.fecha) as fecha,
-            g.cantidad,
-            g.lugar,
-            c.nombre as categoria,
-            g.notas
-        FROM gastos g
-        JOIN categorias c ON g.categoria_id = c.id
-        WHERE g.cuenta_id = ?
-        ORDER BY g.fecha DESC, g.id DESC
-        LIMIT 10
-    """, conn, params=(st.session_state.cuenta_actual,))
-    
-    conn.close()
+    hoy = date.today()
+    snapshot = get_dashboard_snapshot(st.session_state.cuenta_actual, hoy)
+    total_mes = snapshot.total_mes
+    total_mes_anterior = snapshot.total_mes_anterior
+    presupuesto_total = snapshot.presupuesto_total
     
     # Mostrar información en el dashboard
     st.title("Dashboard")
     
     # Métricas principales
-    col1, col2, col3 = st.columns(3)
+    col1, col2, col3, col4 = st.columns(4)
     
     with col1:
         st.metric(
@@ -277,35 +223,72 @@ def show_main_dashboard():
         )
     
     with col3:
-        dias_restantes = (date(datetime.now().year, datetime.now().month + 1 if datetime.now().month < 12 else 1, 1) - date(datetime.now().year, datetime.now().month, datetime.now().day)).days
-        gasto_diario = total_mes / datetime.now().day if datetime.now().day > 0 else 0
+        dias_restantes = calendar.monthrange(hoy.year, hoy.month)[1] - hoy.day + 1
+        gasto_diario = total_mes / hoy.day
         st.metric(
             get_text('promedio_diario'),
             f"${gasto_diario:,.2f}",
             f"{dias_restantes} {get_text('dias_restantes')}"
         )
     
+    # Previsión a fin de mes por categoría
+    from utils.prevision import prevision_mes, NIVEL_CONFIANZA
+    from utils.anomalias import get_gastos_inusuales, es_inusual
+    with perfilador.fase('datos'):
+        prevision = prevision_mes(st.session_state.cuenta_actual, hoy)
+    _, prevista, minimo, maximo = prevision.total
+    with col4:
+        st.metric(
+            get_text('prevision_fin_mes'),
+            f"${prevista / 100:,.2f}",
+            f"{NIVEL_CONFIANZA:.0%}: ${minimo / 100:,.0f} – ${maximo / 100:,.0f}",
+            delta_color="off"
+        )
+    
+    for i in prevision.sobre_presupuesto():
+        st.warning(get_text('supera_presupuesto').format(
+            categoria=prevision.categorias[i],
+            prevista=prevision.prevista[i] / 100,
+            presupuesto=prevision.presupuesto[i] / 100,
+        ))
+    
     # Últimos gastos
     st.subheader(get_text('ultimos_gastos'))
-    if not ultimos_gastos.empty:
+    if snapshot.ultimos_gastos:
         # Contenedor más estrecho para los gastos
         with st.container():
-            for _, gasto in ultimos_gastos.iterrows():
+            for gasto in snapshot.ultimos_gastos:
                 col1, col2, col3, col4 = st.columns([2, 2, 1, 1])
                 with col1:
-                    st.write(f"**{gasto['lugar']}** - {gasto['categoria']}")
+                    st.write(f"**{gasto.lugar}** - {gasto.categoria}")
                 with col2:
-                    if pd.notna(gasto['notas']):
-                        st.write(f"💭 {gasto['notas']}")
+                    if gasto.notas:
+                        st.write(f"💭 {gasto.notas}")
                     else:
                         st.write("")
                 with col3:
-                    st.write(f"💰 ${gasto['cantidad']:,.2f}")
+                    st.write(f"💰 ${gasto.cantidad:,.2f}")
+                    if es_inusual(gasto.anomalia):
+                        st.caption(f"⚠️ {get_text('inusual')}")
                 with col4:
-                    st.write(f"📅 {gasto['fecha']}")
+                    st.write(f"📅 {gasto.fecha.strftime('%d/%m/%Y')}")
                 st.markdown("<hr style='margin: 3px 0;'>", unsafe_allow_html=True)
     else:
         st.info(get_text('no_hay_gastos'))
+    
+    # Gastos inusuales de los últimos 30 días
+    inusuales = get_gastos_inusuales(
+        st.session_state.cuenta_actual, (hoy - timedelta(days=30)).isoformat()
+    )
+    if inusuales:
+        st.subheader(f"⚠️ {get_text('gastos_inusuales')}")
+        st.caption(get_text('gastos_inusuales_ayuda'))
+        for gasto in inusuales:
+            st.write(
+                f"**{gasto['lugar']}** - {gasto['categoria']} · "
+                f"${desde_centimos(gasto['centimos']):,.2f} · "
+                f"{date.fromisoformat(gasto['fecha']).strftime('%d/%m/%Y')}"
+            )
 
 def main():
     # Inicialización básica
@@ -320,6 +303,7 @@ def main():
         st.session_state.cuenta_actual = None
     
     apply_custom_css()
+    preparar_cookie_manager()
     check_saved_session()
     
     # Mostrar la interfaz apropiada
@@ -334,5 +318,7 @@ if __name__ == "__main__":
         page_icon="💰",
         layout="wide"
     )
-    init_db()
-    main()
\ No newline at end of file
+    with medir_ejecucion():
+        # Esquema y migraciones sólo corren la primera vez en cada proceso
+        init_db()
+        main()
\ No newline at end of file
@@ -1,11 +1,12 @@
 import streamlit as st
-import sqlite3
 from translations import get_text
 from utils.session import set_current_account, clear_session
+from database import get_db_connection, transaccion, ErrorBaseDatos
+from utils.cache import cacheado, invalidar_todo
 
+@cacheado(por_cuenta=False)
 def get_cuentas_usuario(user_id):
-    conn = sqlite3.connect('finanzas.db')
-    c = conn.cursor()
+    c = get_db_connection().cursor()
     c.execute("""
         SELECT c.id, c.nombre 
         FROM cuentas c
@@ -13,29 +14,23 @@ def get_cuentas_usuario(user_id):
         WHERE uc.usuario_id = ?
         ORDER BY c.nombre
     """, (user_id,))
-    cuentas = c.fetchall()
-    conn.close()
-    return cuentas
+    return c.fetchall()
 
 def crear_cuenta(nombre, user_id):
-    conn = sqlite3.connect('finanzas.db')
-    c = conn.cursor()
     try:
-        c.execute(
-            "INSERT INTO cuentas (nombre, creador_id) VALUES (?, ?)",
-            (nombre, user_id)
-        )
-        cuenta_id = c.lastrowid
-        c.execute(
-            "INSERT INTO usuarios_cuentas (usuario_id, cuenta_id, rol) VALUES (?, ?, ?)",
-            (user_id, cuenta_id, 'admin')
-        )
-        conn.commit()
+        with transaccion() as conn:
+            cuenta_id = conn.execute(
+                "INSERT INTO cuentas (nombre, creador_id) VALUES (?, ?) RETURNING id",
+                (nombre, user_id)
+            ).fetchone()[0]
+            conn.execute(
+                "INSERT INTO usuarios_cuentas (usuario_id, cuenta_id, rol) VALUES (?, ?, ?)",
+                (user_id, cuenta_id, 'admin')
+            )
+        invalidar_todo()
         return True
-    except sqlite3.Error:
+    except ErrorBaseDatos:
         return False
-    finally:
-        conn.close()
 
 def apply_custom_css():
     st.markdown("""
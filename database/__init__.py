@@ -0,0 +1,880 @@
+import itertools
+import os
+import re
+import sqlite3
+import threading
+import time
+import queue
+import hashlib
+import unicodedata
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, date
+from decimal import Decimal, ROUND_HALF_UP
+from functools import lru_cache
+from typing import NamedTuple, Optional, Tuple
+from utils.cache import cacheado, invalidar_cuenta, invalidar_todo
+from utils import perfilador, trazas
+from database.models import (
+    ESQUEMA_SQLITE, ESQUEMA_POSTGRES, RESUMEN_MENSUAL_SQLITE, RESUMEN_MENSUAL_POSTGRES,
+    BUSQUEDA_SQLITE, BUSQUEDA_POSTGRES, VERSIONES_SQLITE, VERSIONES_POSTGRES,
+    UMBRAL_ANOMALIA,
+)
+
+try:
+    import psycopg2
+    import psycopg2.extensions
+    import psycopg2.extras
+except ImportError:  # sólo hace falta con PostgreSQL
+    psycopg2 = None
+
+DB_PATH = 'finanzas.db'
+
+# URL de PostgreSQL (la que inyectan Render o docker-compose); sin ella se
+# usa el archivo SQLite de DB_PATH
+DATABASE_URL = os.environ.get('DATABASE_URL')
+
+# Excepciones de cualquiera de los dos backends, para los except de las páginas
+ErrorBaseDatos = (sqlite3.Error,) + ((psycopg2.Error,) if psycopg2 else ())
+ErrorIntegridad = (sqlite3.IntegrityError,) + ((psycopg2.IntegrityError,) if psycopg2 else ())
+
+# Pragmas aplicados una sola vez al abrir cada conexión del pool
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA temp_store = MEMORY",
+)
+
+# Conexiones ociosas que se conservan para reutilizar entre reruns
+POOL_MAX_CONEXIONES = 8
+
+# Filas por bloque en las lecturas que no cargan el resultado entero
+TAMANO_BLOQUE_LECTURA = 5000
+
+class CursorSQLite(sqlite3.Cursor):
+    """Cursor que pasa cada consulta por utils.trazas.
+
+    Las filas leídas iterando el cursor no se cuentan; las de fetch*, sí.
+    """
+    _traza = None
+
+    def execute(self, sql, params=()):
+        if not trazas.ACTIVAS:
+            return super().execute(sql, params)
+        self._traza = trazas.Traza(sql, lambda: self.connection.plan_consulta(sql, params))
+        inicio = time.perf_counter()
+        super().execute(sql, params)
+        self._traza.sumar(time.perf_counter() - inicio, max(self.rowcount, 0))
+        return self
+
+    def executemany(self, sql, filas):
+        if not trazas.ACTIVAS:
+            return super().executemany(sql, filas)
+        self._traza = trazas.Traza(sql)
+        inicio = time.perf_counter()
+        super().executemany(sql, filas)
+        self._traza.sumar(time.perf_counter() - inicio, max(self.rowcount, 0))
+        return self
+
+    def _leer(self, lectura, *args):
+        if self._traza is None:
+            return lectura(*args)
+        inicio = time.perf_counter()
+        resultado = lectura(*args)
+        filas = len(resultado) if isinstance(resultado, list) else int(resultado is not None)
+        self._traza.sumar(time.perf_counter() - inicio, filas)
+        return resultado
+
+    def fetchone(self):
+        return self._leer(super().fetchone)
+
+    def fetchmany(self, *args):
+        return self._leer(super().fetchmany, *args)
+
+    def fetchall(self):
+        return self._leer(super().fetchall)
+
+def _plan_sqlite(conn, sql, params):
+    """Líneas de EXPLAIN QUERY PLAN, sangradas según el árbol del plan."""
+    # Cursor base: el plan no se traza
+    filas = sqlite3.Cursor(conn).execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    niveles = {0: -1}
+    lineas = []
+    for id_, padre, _, detalle in filas:
+        niveles[id_] = niveles.get(padre, -1) + 1
+        lineas.append('  ' * niveles[id_] + detalle)
+    return lineas
+
+class ConexionPool(sqlite3.Connection):
+    """Conexión del pool: close() descarta la transacción abierta pero no cierra."""
+
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+
+    def cerrar(self):
+        super().close()
+
+    def cursor(self, factory=CursorSQLite):
+        return super().cursor(factory)
+
+    # Los atajos de sqlite3.Connection ejecutan sin pasar por los métodos
+    # del cursor; así sí se trazan
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, filas):
+        return self.cursor().executemany(sql, filas)
+
+    def cursor_servidor(self):
+        # sqlite3 ya avanza la consulta fila a fila según se leen
+        return self.cursor()
+
+    def plan_consulta(self, sql, params=()):
+        return _plan_sqlite(self, sql, params)
+
+class PoolConexiones:
+    def __init__(self, ruta, maximo=POOL_MAX_CONEXIONES):
+        self.ruta = ruta
+        self._libres = queue.LifoQueue(maxsize=maximo)
+
+    def _abrir(self):
+        # check_same_thread=False: la conexión pasa de un hilo a otro al
+        # volver al pool, pero nunca la usan dos hilos a la vez
+        conn = sqlite3.connect(self.ruta, factory=ConexionPool, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def obtener(self):
+        try:
+            return self._libres.get_nowait()
+        except queue.Empty:
+            return self._abrir()
+
+    def devolver(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._libres.put_nowait(conn)
+        except queue.Full:
+            conn.cerrar()
+
+    def cerrar_todas(self):
+        while True:
+            try:
+                self._libres.get_nowait().cerrar()
+            except queue.Empty:
+                break
+
+# Un backend es un pool (obtener/devolver/cerrar_todas) más lo que cambia de
+# un motor a otro: cómo abrir una transacción de escritura, cómo agrupar
+# fechas por mes o año, el DDL (incluidos la búsqueda de texto y los
+# contadores de cambios) y la introspección del esquema. Todo lo demás es
+# SQL común a SQLite y PostgreSQL.
+
+class BackendSQLite(PoolConexiones):
+    dialecto = 'sqlite'
+    # IMMEDIATE toma el bloqueo de escritura al inicio y espera (busy_timeout)
+    # en vez de fallar con "database is locked" a mitad de la transacción
+    sql_begin = "BEGIN IMMEDIATE"
+
+    def mes(self, columna):
+        return f"substr({columna}, 1, 7)"
+
+    def anio(self, columna):
+        return f"substr({columna}, 1, 4)"
+
+    def crear_tablas(self, conn):
+        conn.executescript(ESQUEMA_SQLITE)
+
+    def crear_resumen_mensual(self, conn):
+        conn.executescript(RESUMEN_MENSUAL_SQLITE)
+
+    def crear_busqueda(self, conn):
+        # Triggers y reconstrucción juntos: un índice a medias se corrompe
+        # con el primer 'delete' de una fila que aún no contiene
+        try:
+            conn.executescript(f"BEGIN IMMEDIATE; {BUSQUEDA_SQLITE} COMMIT;")
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def crear_versiones(self, conn):
+        conn.executescript(VERSIONES_SQLITE)
+
+    def columnas(self, conn, tabla):
+        return [fila['name'] for fila in conn.execute(f"PRAGMA table_info({tabla})")]
+
+    def existe_indice(self, conn, nombre):
+        return conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (nombre,)
+        ).fetchone() is not None
+
+# Marcadores `:nombre` de las consultas con parámetros por nombre (sin tocar
+# los casts `::tipo` de PostgreSQL)
+_MARCADOR_NOMBRADO = re.compile(r"(?<![:\w]):([A-Za-z_]\w*)")
+
+@lru_cache(maxsize=256)
+def _traducir_sql(sql, por_nombre):
+    """Pasa una consulta del estilo sqlite3 (`?`, `:nombre`) al de psycopg2.
+
+    Las consultas de la aplicación no llevan `?` dentro de literales.
+    """
+    sql = sql.replace('%', '%%')
+    if por_nombre:
+        return _MARCADOR_NOMBRADO.sub(r"%(\1)s", sql)
+    return sql.replace('?', '%s')
+
+_cursores_servidor = itertools.count()
+
+class CursorPostgres:
+    """Cursor de psycopg2 con la interfaz de sqlite3, trazado como CursorSQLite."""
+
+    def __init__(self, cursor, conexion):
+        self._cursor = cursor
+        self._conexion = conexion
+        self._traza = None
+
+    def execute(self, sql, params=()):
+        if not trazas.ACTIVAS:
+            self._cursor.execute(_traducir_sql(sql, isinstance(params, dict)), params)
+            return self
+        self._traza = trazas.Traza(sql, lambda: self._conexion.plan_consulta(sql, params))
+        inicio = time.perf_counter()
+        self._cursor.execute(_traducir_sql(sql, isinstance(params, dict)), params)
+        # En las consultas que devuelven filas se cuentan al leerlas
+        filas = self._cursor.rowcount if self._cursor.description is None else 0
+        self._traza.sumar(time.perf_counter() - inicio, max(filas, 0))
+        return self
+
+    def executemany(self, sql, filas):
+        # psycopg2 acumula en rowcount las filas afectadas de todo el lote
+        if not trazas.ACTIVAS:
+            self._cursor.executemany(_traducir_sql(sql, False), filas)
+            return self
+        self._traza = trazas.Traza(sql)
+        inicio = time.perf_counter()
+        self._cursor.executemany(_traducir_sql(sql, False), filas)
+        self._traza.sumar(time.perf_counter() - inicio, max(self._cursor.rowcount, 0))
+        return self
+
+    def _leer(self, lectura, *args):
+        if self._traza is None:
+            return lectura(*args)
+        inicio = time.perf_counter()
+        resultado = lectura(*args)
+        filas = len(resultado) if isinstance(resultado, list) else int(resultado is not None)
+        self._traza.sumar(time.perf_counter() - inicio, filas)
+        return resultado
+
+    def fetchone(self):
+        return self._leer(self._cursor.fetchone)
+
+    def fetchall(self):
+        return self._leer(self._cursor.fetchall)
+
+    def fetchmany(self, tamano):
+        return self._leer(self._cursor.fetchmany, tamano)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def close(self):
+        self._cursor.close()
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+class ConexionPostgres:
+    """Conexión del pool de SQLAlchemy con la interfaz de sqlite3 que usa la app.
+
+    Trabaja en autocommit y abre las transacciones explícitamente, como el
+    BEGIN IMMEDIATE de SQLite, para que in_transaction refleje lo mismo en
+    los dos backends. Las filas se leen por nombre o por posición.
+    """
+
+    def __init__(self, conexion_pool):
+        self._conexion_pool = conexion_pool
+        self._pg = conexion_pool.dbapi_connection
+
+    @property
+    def in_transaction(self):
+        return self._pg.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def cursor(self):
+        return CursorPostgres(self._pg.cursor(cursor_factory=psycopg2.extras.DictCursor), self)
+
+    def cursor_servidor(self):
+        """Cursor con nombre: el resultado se queda en el servidor y llega por bloques.
+
+        WITH HOLD para poder usarlo fuera de una transacción, en autocommit.
+        """
+        nombre = f"lectura_{next(_cursores_servidor)}"
+        return CursorPostgres(
+            self._pg.cursor(name=nombre, withhold=True, cursor_factory=psycopg2.extras.DictCursor), self
+        )
+
+    def plan_consulta(self, sql, params=()):
+        """Líneas de EXPLAIN, sin ejecutar la consulta.
+
+        Dentro de una transacción va en un SAVEPOINT: si fallara, no la
+        dejaría abortada.
+        """
+        en_transaccion = self.in_transaction
+        with self._pg.cursor() as cursor:
+            if en_transaccion:
+                cursor.execute("SAVEPOINT plan_consulta")
+            try:
+                cursor.execute("EXPLAIN " + _traducir_sql(sql, isinstance(params, dict)), params)
+                lineas = [fila[0] for fila in cursor.fetchall()]
+            except psycopg2.Error:
+                if en_transaccion:
+                    cursor.execute("ROLLBACK TO SAVEPOINT plan_consulta")
+                raise
+            finally:
+                if en_transaccion:
+                    cursor.execute("RELEASE SAVEPOINT plan_consulta")
+        return lineas
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, filas):
+        return self.cursor().executemany(sql, filas)
+
+    def executescript(self, script):
+        with self._pg.cursor() as cursor:
+            cursor.execute(script)
+
+    def commit(self):
+        if self.in_transaction:
+            self._pg.cursor().execute("COMMIT")
+
+    def rollback(self):
+        if self.in_transaction:
+            self._pg.cursor().execute("ROLLBACK")
+
+    def close(self):
+        self.rollback()
+
+    def cerrar(self):
+        self.rollback()
+        self._conexion_pool.close()
+
+def _texto(valor, cursor):
+    return valor
+
+def _bytes(valor, cursor):
+    return None if valor is None else bytes(psycopg2.BINARY(valor, cursor))
+
+def _float(valor, cursor):
+    return None if valor is None else float(valor)
+
+class BackendPostgres:
+    dialecto = 'postgresql'
+    sql_begin = "BEGIN"
+
+    def __init__(self, url, maximo=POOL_MAX_CONEXIONES):
+        from sqlalchemy import create_engine, event
+
+        if psycopg2 is None:
+            raise RuntimeError("Para usar PostgreSQL hace falta instalar psycopg2-binary")
+        self.url = url
+        self._engine = create_engine(
+            url,
+            pool_size=maximo,
+            max_overflow=maximo,
+            pool_pre_ping=True,
+            pool_recycle=1800,
+        )
+
+        @event.listens_for(self._engine, 'connect')
+        def _configurar(conn, registro):
+            conn.autocommit = True
+            # Mismos tipos que devuelve sqlite3: fechas como texto ISO,
+            # contraseñas como bytes y sumas NUMERIC como float
+            for oids, nombre, conversion in (
+                (psycopg2.extensions.DATE.values, 'FECHA_ISO', _texto),
+                (psycopg2.BINARY.values, 'BYTES', _bytes),
+                (psycopg2.extensions.DECIMAL.values, 'DECIMAL_FLOAT', _float),
+            ):
+                psycopg2.extensions.register_type(
+                    psycopg2.extensions.new_type(oids, nombre, conversion), conn
+                )
+
+    def obtener(self):
+        return ConexionPostgres(self._engine.raw_connection())
+
+    def devolver(self, conn):
+        conn.cerrar()
+
+    def cerrar_todas(self):
+        self._engine.dispose()
+
+    def mes(self, columna):
+        return f"to_char({columna}, 'YYYY-MM')"
+
+    def anio(self, columna):
+        return f"to_char({columna}, 'YYYY')"
+
+    def crear_tablas(self, conn):
+        conn.executescript(ESQUEMA_POSTGRES)
+
+    def crear_resumen_mensual(self, conn):
+        conn.executescript(RESUMEN_MENSUAL_POSTGRES)
+
+    def crear_busqueda(self, conn):
+        conn.executescript(BUSQUEDA_POSTGRES)
+
+    def crear_versiones(self, conn):
+        conn.executescript(VERSIONES_POSTGRES)
+
+    def columnas(self, conn, tabla):
+        return [fila['column_name'] for fila in conn.execute(
+            "SELECT column_name FROM information_schema.columns "
+            "WHERE table_schema = current_schema() AND table_name = ?", (tabla,)
+        )]
+
+    def existe_indice(self, conn, nombre):
+        return conn.execute(
+            "SELECT 1 FROM pg_indexes WHERE schemaname = current_schema() AND indexname = ?", (nombre,)
+        ).fetchone() is not None
+
+def crear_backend(destino):
+    """Backend para una URL postgres:// o postgresql://, o la ruta de un archivo SQLite."""
+    if re.match(r"postgres(ql)?(\+\w+)?://", destino):
+        # Render y Heroku anuncian postgres://, que SQLAlchemy ya no acepta
+        return BackendPostgres(re.sub(r"^postgres(ql)?(\+\w+)?://", "postgresql+psycopg2://", destino))
+    return BackendSQLite(destino)
+
+class _Prestamo:
+    """Conexión asignada a un hilo; vuelve al pool cuando el hilo termina."""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.conn = pool.obtener()
+
+    def __del__(self):
+        try:
+            self.pool.devolver(self.conn)
+        except Exception:
+            pass
+
+_backend = crear_backend(DATABASE_URL or DB_PATH)
+_local = threading.local()
+
+# Backend cuyo esquema ya se migró en este proceso
+_inicializada = None
+_bloqueo_inicializacion = threading.Lock()
+
+def get_db_connection():
+    """Devuelve la conexión del hilo actual (una por hilo, reutilizada del pool).
+
+    No hace falta cerrarla: se devuelve al pool cuando termina el hilo.
+    """
+    prestamo = getattr(_local, 'prestamo', None)
+    if prestamo is None or prestamo.pool is not _backend:
+        prestamo = _Prestamo(_backend)
+        _local.prestamo = prestamo
+    return prestamo.conn
+
+@contextmanager
+def transaccion():
+    """Ejecuta el bloque en una transacción: commit al salir, rollback si hay error.
+
+    En SQLite usa BEGIN IMMEDIATE para tomar el bloqueo de escritura al
+    inicio. Las transacciones anidadas se resuelven con un SAVEPOINT.
+    """
+    conn = get_db_connection()
+    if conn.in_transaction:
+        conn.execute("SAVEPOINT anidada")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK TO SAVEPOINT anidada")
+            conn.execute("RELEASE SAVEPOINT anidada")
+            raise
+        conn.execute("RELEASE SAVEPOINT anidada")
+        return
+
+    conn.execute(_backend.sql_begin)
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+def leer_df(query, params=()):
+    """Resultado de la consulta como DataFrame, en cualquiera de los backends."""
+    import pandas as pd
+
+    # La consulta cuenta como sql en el perfilador; construir el DataFrame, como datos
+    with perfilador.fase('datos'):
+        cursor = get_db_connection().execute(query, params)
+        columnas = [columna[0] for columna in cursor.description]
+        return pd.DataFrame.from_records(
+            [tuple(fila) for fila in cursor.fetchall()], columns=columnas, coerce_float=True
+        )
+
+@contextmanager
+def leer_por_bloques(query, params=(), tamano=TAMANO_BLOQUE_LECTURA):
+    """Resultado de la consulta como (columnas, bloques), sin cargarlo entero.
+
+    `bloques` es un iterador de listas de tuplas de hasta `tamano` filas, y
+    sólo es válido dentro del with.
+    """
+    cursor = get_db_connection().cursor_servidor().execute(query, params)
+    try:
+        # Los cursores con nombre no tienen description hasta el primer fetch
+        primero = cursor.fetchmany(tamano)
+        columnas = [columna[0] for columna in cursor.description]
+
+        def bloques():
+            bloque = primero
+            while bloque:
+                yield [tuple(fila) for fila in bloque]
+                bloque = cursor.fetchmany(tamano)
+
+        yield columnas, bloques()
+    finally:
+        cursor.close()
+
+def sql_mes(columna):
+    """Expresión SQL que agrupa una columna de fecha por mes ('YYYY-MM')."""
+    return _backend.mes(columna)
+
+def sql_anio(columna):
+    """Expresión SQL con el año ('YYYY') de una columna de fecha."""
+    return _backend.anio(columna)
+
+def get_backend():
+    return _backend
+
+def dialecto():
+    return _backend.dialecto
+
+def configurar_db(destino):
+    """Cambia de base de datos (ruta SQLite o URL de PostgreSQL) y vacía el pool."""
+    global DB_PATH, _backend
+    _backend.cerrar_todas()
+    if not re.match(r"postgres(ql)?(\+\w+)?://", destino):
+        DB_PATH = destino
+    _backend = crear_backend(destino)
+
+def cerrar_conexiones():
+    if getattr(_local, 'prestamo', None) is not None:
+        del _local.prestamo
+    _backend.cerrar_todas()
+
+def initialize_db():
+    """Crea o actualiza el esquema aplicando las migraciones pendientes.
+
+    Sólo trabaja la primera vez en cada proceso (o tras configurar_db): los
+    reruns de Streamlit vuelven sin tocar la base de datos.
+    """
+    global _inicializada
+    if _inicializada is _backend:
+        return
+    with _bloqueo_inicializacion:
+        if _inicializada is not _backend:
+            from database.migrate import migrar
+            migrar()
+            _inicializada = _backend
+
+def reconstruir_resumen_mensual(cuenta_id=None):
+    """Recalcula gastos_mensuales a partir de gastos, de una cuenta o de todas."""
+    filtro, params = ("WHERE cuenta_id = ?", (cuenta_id,)) if cuenta_id is not None else ("", ())
+    with transaccion() as conn:
+        conn.execute(f"DELETE FROM gastos_mensuales {filtro}", params)
+        conn.execute(f'''
+            INSERT INTO gastos_mensuales
+                (cuenta_id, categoria_id, mes, total_centimos, num_gastos, minimo_centimos, maximo_centimos)
+            SELECT cuenta_id, categoria_id, {sql_mes('fecha')},
+                   SUM(centimos), COUNT(*), MIN(centimos), MAX(centimos)
+            FROM gastos
+            {filtro}
+            GROUP BY cuenta_id, categoria_id, {sql_mes('fecha')}
+        ''', params)
+
+# Los importes se guardan en céntimos enteros (gastos.centimos) y las fechas
+# como 'YYYY-MM-DD'; la conversión se hace sólo al escribir y al mostrar.
+def a_centimos(cantidad):
+    """Céntimos enteros de un importe (float, str o Decimal), redondeando
+    el medio céntimo hacia arriba como se escribe a mano."""
+    return int((Decimal(str(cantidad)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+def desde_centimos(centimos):
+    return centimos / 100
+
+def fecha_iso(valor):
+    """'YYYY-MM-DD' de un date, datetime o texto ISO; rechaza lo demás."""
+    if isinstance(valor, datetime):
+        valor = valor.date()
+    if isinstance(valor, date):
+        return valor.isoformat()
+    return date.fromisoformat(str(valor)[:10]).isoformat()
+
+# Huella de un gasto para detectar importaciones repetidas: hash de fecha,
+# lugar normalizado y cantidad en céntimos, más el número de ocurrencia
+# ("<hash>:1", "<hash>:2", ...). Así dos cargos idénticos del mismo día se
+# conservan, pero volver a importar el mismo extracto no duplica nada.
+def normalizar_lugar(lugar):
+    """Nombre de comercio sin diferencias de mayúsculas, espacios ni Unicode."""
+    return ' '.join(unicodedata.normalize('NFKC', str(lugar)).casefold().split())
+
+def huella_base(fecha, lugar, centimos):
+    lugar = normalizar_lugar(lugar)
+    texto = f"{str(fecha)[:10]}|{lugar}|{int(centimos)}"
+    return hashlib.blake2b(texto.encode('utf-8'), digest_size=12).hexdigest()
+
+def siguiente_huella(conn, cuenta_id, base, excluir_id=None):
+    """Primera huella libre para `base` en la cuenta."""
+    query = '''
+        SELECT MAX(CAST(substr(huella, ?) AS INTEGER))
+        FROM gastos
+        WHERE cuenta_id = ? AND huella >= ? AND huella < ?
+    '''
+    params = [len(base) + 2, cuenta_id, base + ':', base + ';']
+    if excluir_id is not None:
+        query += " AND id != ?"
+        params.append(excluir_id)
+    ultima = conn.execute(query, params).fetchone()[0]
+    return f"{base}:{(ultima or 0) + 1}"
+
+def clave_mes(anio, mes):
+    """Clave 'YYYY-MM' con la que gastos_mensuales agrupa cada mes."""
+    return f"{int(anio):04d}-{int(mes):02d}"
+
+def mes_anterior(anio, mes):
+    anio, mes = int(anio), int(mes)
+    return (anio - 1, 12) if mes == 1 else (anio, mes - 1)
+
+class GastoReciente(NamedTuple):
+    id: int
+    fecha: date
+    cantidad: float
+    lugar: str
+    categoria: str
+    notas: Optional[str]
+    anomalia: Optional[float]
+
+@dataclass(frozen=True)
+class DashboardSnapshot:
+    total_mes: float
+    total_mes_anterior: float
+    presupuesto_total: float
+    ultimos_gastos: Tuple[GastoReciente, ...]
+
+@cacheado()
+def get_dashboard_snapshot(cuenta_id, today):
+    """Datos del dashboard en una sola consulta.
+
+    Depende sólo de (cuenta_id, today) y devuelve un objeto inmutable, así
+    que el resultado se puede cachear hasta el siguiente cambio de la cuenta.
+    """
+    filas = get_db_connection().execute('''
+        WITH ultimos AS (
+            SELECT g.id, g.fecha, g.centimos, g.lugar, c.nombre AS categoria, g.notas, g.anomalia
+            FROM gastos g
+            JOIN categorias c ON g.categoria_id = c.id
+            WHERE g.cuenta_id = :cuenta_id
+            ORDER BY g.fecha DESC, g.id DESC
+            LIMIT 10
+        )
+        SELECT
+            (SELECT COALESCE(SUM(total_centimos), 0) FROM gastos_mensuales
+             WHERE cuenta_id = :cuenta_id AND mes = :mes) AS total_mes,
+            (SELECT COALESCE(SUM(total_centimos), 0) FROM gastos_mensuales
+             WHERE cuenta_id = :cuenta_id AND mes = :mes_anterior) AS total_mes_anterior,
+            (SELECT COALESCE(SUM(presupuesto_mensual), 0) FROM categorias
+             WHERE cuenta_id = :cuenta_id) AS presupuesto_total,
+            u.id, u.fecha, u.centimos, u.lugar, u.categoria, u.notas, u.anomalia
+        FROM (SELECT 1) AS uno
+        LEFT JOIN ultimos u ON TRUE
+        ORDER BY u.fecha DESC, u.id DESC
+    ''', {
+        'cuenta_id': cuenta_id,
+        'mes': clave_mes(today.year, today.month),
+        'mes_anterior': clave_mes(*mes_anterior(today.year, today.month)),
+    }).fetchall()
+    
+    # Los totales se repiten en cada fila; si la cuenta no tiene gastos
+    # llega una única fila con id NULL
+    primera = filas[0]
+    return DashboardSnapshot(
+        total_mes=desde_centimos(primera['total_mes']),
+        total_mes_anterior=desde_centimos(primera['total_mes_anterior']),
+        presupuesto_total=primera['presupuesto_total'],
+        ultimos_gastos=tuple(
+            GastoReciente(
+                fila['id'],
+                date.fromisoformat(fila['fecha']),
+                desde_centimos(fila['centimos']),
+                fila['lugar'],
+                fila['categoria'],
+                fila['notas'],
+                fila['anomalia'],
+            )
+            for fila in filas if fila['id'] is not None
+        ),
+    )
+
+def get_pagina_gastos(cuenta_id, tamano, desde=None, hasta=None, despues_de=None, solo_inusuales=False):
+    """Una página del historial ordenada por (fecha, id) descendente.
+
+    Paginación por clave: `despues_de` es el (fecha, id) de la última fila de
+    la página anterior, así que cada página cuesta lo mismo sin importar lo
+    lejos que esté. Devuelve (filas, hay_mas).
+    """
+    query = """
+        SELECT 
+            g.id,
+            g.fecha,
+            g.lugar,
+            g.centimos / 100.0 as cantidad,
+            c.nombre as categoria,
+            g.notas,
+            u.nombre as usuario,
+            g.categoria_id,
+            g.anomalia
+        FROM gastos g
+        JOIN categorias c ON g.categoria_id = c.id
+        JOIN usuarios u ON g.usuario_id = u.id
+        WHERE g.cuenta_id = ?
+    """
+    params = [cuenta_id]
+    
+    if desde and hasta:
+        query += " AND g.fecha >= ? AND g.fecha < ?"
+        params.extend([desde, hasta])
+    
+    # Literal para que el planificador pueda usar el índice parcial
+    if solo_inusuales:
+        query += f" AND g.anomalia >= {UMBRAL_ANOMALIA}"
+    
+    if despues_de:
+        query += " AND (g.fecha, g.id) < (?, ?)"
+        params.extend(despues_de)
+    
+    # Una fila de más para saber si existe una página siguiente
+    query += " ORDER BY g.fecha DESC, g.id DESC LIMIT ?"
+    params.append(tamano + 1)
+    
+    filas = get_db_connection().execute(query, params).fetchall()
+    return filas[:tamano], len(filas) > tamano
+
+def get_resumen_mensual(cuenta_id, desde=None, hasta=None):
+    """Gasto por mes y categoría desde gastos_mensuales ('YYYY-MM', ambos incluidos)."""
+    query = """
+        SELECT gm.mes, gm.categoria_id, c.nombre AS categoria, gm.num_gastos,
+               gm.total_centimos, gm.minimo_centimos, gm.maximo_centimos
+        FROM gastos_mensuales gm
+        JOIN categorias c ON c.id = gm.categoria_id
+        WHERE gm.cuenta_id = ?
+    """
+    params = [cuenta_id]
+    if desde:
+        query += " AND gm.mes >= ?"
+        params.append(desde)
+    if hasta:
+        query += " AND gm.mes <= ?"
+        params.append(hasta)
+    query += " ORDER BY gm.mes DESC, gm.total_centimos DESC"
+    return get_db_connection().execute(query, params).fetchall()
+
+def firma_cuenta(conn, cuenta_id):
+    """(cambios, gastos) de la cuenta: cambia con cualquier alta, baja o
+    modificación de sus gastos, la haga el proceso que la haga."""
+    fila = conn.execute('''
+        SELECT
+            COALESCE((SELECT cambios FROM versiones_cuentas WHERE cuenta_id = ?), 0),
+            COALESCE((SELECT SUM(num_gastos) FROM gastos_mensuales WHERE cuenta_id = ?), 0)
+    ''', (cuenta_id, cuenta_id)).fetchone()
+    return int(fila[0]), int(fila[1])
+
+# Segundos entre comprobaciones de la firma de una cuenta
+CAMBIOS_EXTERNOS_TTL = 5
+
+_firmas_vistas = {}  # cuenta_id -> (firma, momento de la comprobación)
+
+def detectar_cambios_externos(cuenta_id):
+    """Invalida la caché de la cuenta si su firma cambió desde la última vez.
+
+    La caché sólo se entera de las escrituras de este proceso; las de la API
+    u otras réplicas se notan así, con hasta CAMBIOS_EXTERNOS_TTL de retraso.
+    """
+    ahora = time.monotonic()
+    anterior, comprobada = _firmas_vistas.get(cuenta_id, (None, None))
+    if comprobada is not None and ahora - comprobada < CAMBIOS_EXTERNOS_TTL:
+        return
+    firma = firma_cuenta(get_db_connection(), cuenta_id)
+    _firmas_vistas[cuenta_id] = (firma, ahora)
+    if anterior is not None and firma != anterior:
+        invalidar_cuenta(cuenta_id)
+
+def rango_mes(anio, mes):
+    """Devuelve (inicio, fin) del mes como fechas ISO para filtrar con
+    `fecha >= inicio AND fecha < fin`, que a diferencia de strftime() sobre
+    la columna sí puede usar los índices."""
+    anio, mes = int(anio), int(mes)
+    inicio = date(anio, mes, 1)
+    fin = date(anio + 1, 1, 1) if mes == 12 else date(anio, mes + 1, 1)
+    return inicio.isoformat(), fin.isoformat()
+
+def rango_anio(anio):
+    anio = int(anio)
+    return date(anio, 1, 1).isoformat(), date(anio + 1, 1, 1).isoformat()
+
+def get_user_by_email(email):
+    conn = get_db_connection()
+    return conn.execute('SELECT * FROM usuarios WHERE email = ?', (email,)).fetchone()
+
+def create_user(nombre, email, password_hash):
+    try:
+        with transaccion() as conn:
+            conn.execute(
+                'INSERT INTO usuarios (nombre, email, password) VALUES (?, ?, ?)',
+                (nombre, email, password_hash)
+            )
+        return True
+    except ErrorIntegridad:
+        return False
+
+def get_user_accounts(user_id):
+    conn = get_db_connection()
+    return conn.execute('''
+        SELECT c.*, uc.rol
+        FROM cuentas c
+        JOIN usuarios_cuentas uc ON c.id = uc.cuenta_id
+        WHERE uc.usuario_id = ?
+        ORDER BY c.nombre
+    ''', (user_id,)).fetchall()
+
+def create_account(nombre, user_id):
+    try:
+        with transaccion() as conn:
+            cuenta_id = conn.execute(
+                'INSERT INTO cuentas (nombre, creador_id) VALUES (?, ?) RETURNING id', (nombre, user_id)
+            ).fetchone()[0]
+            conn.execute(
+                'INSERT INTO usuarios_cuentas (usuario_id, cuenta_id, rol) VALUES (?, ?, ?)',
+                (user_id, cuenta_id, 'admin')
+            )
+        invalidar_todo()
+        return cuenta_id
+    except ErrorBaseDatos:
+        return None
+
+# Renombrar init_db a initialize_db
+init_db = initialize_db
\ No newline at end of file
@@ -1,20 +1,418 @@
-import sqlite3
+import os
+import re
+import socket
+import time
+from dataclasses import dataclass
+from datetime import date
+from typing import Callable
 
-def migrate_database():
-    conn = sqlite3.connect('finanzas.db')
-    c = conn.cursor()
-    
+from database import (
+    get_db_connection, transaccion, reconstruir_resumen_mensual,
+    huella_base, siguiente_huella, get_backend,
+)
+from database.models import (
+    TABLA_GASTOS_SQLITE, INDICES_GASTOS, RESUMEN_MENSUAL_SQLITE, TABLA_SESIONES, TABLA_ESTADISTICAS,
+    TABLA_TRABAJOS, INDICE_MEMBRESIAS,
+)
+
+# Filas que cada lote de un backfill actualiza en su propia transacción; los
+# escritores sólo esperan lo que tarda un lote, no la migración entera
+TAMANO_LOTE = 5000
+
+# Segundos que vale el bloqueo sin renovarse; si el proceso que migraba
+# muere, otro puede retomarlo pasado este tiempo
+DURACION_BLOQUEO = 300
+
+# Espera máxima de un proceso mientras otro aplica las migraciones
+ESPERA_BLOQUEO = 600
+
+@dataclass
+class Migracion:
+    version: int
+    descripcion: str
+    aplicar: Callable
+
+MIGRACIONES = []
+
+def migracion(version, descripcion):
+    """Registra una migración. Deben ser idempotentes: si el proceso muere a
+    mitad, la siguiente ejecución la repite desde el principio."""
+    def registrar(func):
+        MIGRACIONES.append(Migracion(version, descripcion, func))
+        MIGRACIONES.sort(key=lambda m: m.version)
+        return func
+    return registrar
+
+@migracion(1, "Tablas base e índices")
+def _tablas_base(conn, progreso):
+    get_backend().crear_tablas(conn)
+
+@migracion(2, "Columna notas en gastos")
+def _columna_notas(conn, progreso):
+    if 'notas' not in get_backend().columnas(conn, 'gastos'):
+        conn.execute("ALTER TABLE gastos ADD COLUMN notas TEXT")
+        conn.commit()
+
+@migracion(3, "Resumen mensual gastos_mensuales")
+def _resumen_mensual(conn, progreso):
+    if 'centimos' not in get_backend().columnas(conn, 'gastos'):
+        # Base anterior a los importes en céntimos: la migración 5 crea el
+        # resumen al convertir la tabla
+        return
+    get_backend().crear_resumen_mensual(conn)
+
+    # Los triggers ya mantienen las altas nuevas; el recálculo va por
+    # cuentas, cada una en su transacción
+    cuentas = [fila[0] for fila in conn.execute("SELECT DISTINCT cuenta_id FROM gastos ORDER BY cuenta_id")]
+    for hechas, cuenta_id in enumerate(cuentas, 1):
+        reconstruir_resumen_mensual(cuenta_id)
+        progreso(hechas, len(cuentas))
+
+@migracion(4, "Huellas de importación")
+def _huellas(conn, progreso):
+    if 'huella' not in get_backend().columnas(conn, 'gastos'):
+        conn.execute("ALTER TABLE gastos ADD COLUMN huella TEXT")
+        conn.commit()
+
+    # El índice único admite varias huellas NULL, así que se crea antes del
+    # backfill y sirve a siguiente_huella para numerar las repeticiones
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_gastos_cuenta_huella ON gastos (cuenta_id, huella)"
+    )
+    conn.commit()
+
+    # En una base anterior a la migración 5 el importe aún es un REAL
+    if 'centimos' in get_backend().columnas(conn, 'gastos'):
+        centimos = "centimos"
+    else:
+        centimos = "CAST(ROUND(cantidad * 100) AS INTEGER)"
+
+    total = conn.execute("SELECT COUNT(*) FROM gastos WHERE huella IS NULL").fetchone()[0]
+    hechas = 0
+    ultimo_id = 0
+    while True:
+        with transaccion() as conn:
+            filas = conn.execute(f'''
+                SELECT id, cuenta_id, fecha, lugar, {centimos} AS centimos FROM gastos
+                WHERE huella IS NULL AND id > ?
+                ORDER BY id LIMIT ?
+            ''', (ultimo_id, TAMANO_LOTE)).fetchall()
+            if not filas:
+                break
+
+            # Numerar en orden de id, continuando desde lo que ya haya en la base
+            siguientes = {}
+            actualizaciones = []
+            for fila in filas:
+                clave = (fila['cuenta_id'], huella_base(fila['fecha'], fila['lugar'], fila['centimos']))
+                if clave not in siguientes:
+                    siguientes[clave] = int(siguiente_huella(conn, *clave).rsplit(':', 1)[1])
+                actualizaciones.append((f"{clave[1]}:{siguientes[clave]}", fila['id']))
+                siguientes[clave] += 1
+            conn.executemany("UPDATE gastos SET huella = ? WHERE id = ?", actualizaciones)
+
+        ultimo_id = filas[-1]['id']
+        hechas += len(filas)
+        progreso(hechas, total)
+
+@migracion(5, "Importes en céntimos y fechas ISO estrictas")
+def _centimos(conn, progreso):
+    if 'centimos' in get_backend().columnas(conn, 'gastos'):
+        return
+    if get_backend().dialecto == 'sqlite':
+        _centimos_sqlite(conn, progreso)
+    else:
+        _centimos_postgres(conn, progreso)
+
+# Conversión de cada columna antigua (cantidad REAL, fecha DATE libre)
+_COLUMNAS_GASTOS = "id, cuenta_id, categoria_id, centimos, lugar, fecha, usuario_id, notas, huella, created_at"
+_CONVERTIR_GASTO = (
+    "{f}id, {f}cuenta_id, {f}categoria_id, CAST(ROUND({f}cantidad * 100) AS INTEGER), {f}lugar, "
+    "date({f}fecha), {f}usuario_id, {f}notas, {f}huella, {f}created_at"
+)
+
+# Fechas libres de la columna antigua que se saben leer: ISO sin ceros
+# delante y día/mes/año con /, - o . (año de cuatro o dos cifras, como el CSV)
+_FECHAS_LIBRES = (
+    (re.compile(r"\s*(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})\b"), ('anio', 'mes', 'dia')),
+    (re.compile(r"\s*(\d{1,2})[-/.](\d{1,2})[-/.](\d{4})\b"), ('dia', 'mes', 'anio')),
+    (re.compile(r"\s*(\d{1,2})[-/.](\d{1,2})[-/.](\d{2})\b"), ('dia', 'mes', 'anio')),
+)
+
+def _leer_fecha_libre(texto):
+    """'YYYY-MM-DD' de una fecha en uno de los formatos de _FECHAS_LIBRES, o None."""
+    for patron, orden in _FECHAS_LIBRES:
+        encontrada = patron.match(str(texto))
+        if encontrada:
+            partes = dict(zip(orden, map(int, encontrada.groups())))
+            if partes['anio'] < 100:
+                partes['anio'] += 2000
+            try:
+                return date(partes['anio'], partes['mes'], partes['dia']).isoformat()
+            except ValueError:
+                return None
+    return None
+
+def _normalizar_gastos_sqlite(conn):
+    """Pasa a ISO las fechas que date() no entiende y les rehace la huella.
+
+    Si queda alguna fila que la tabla nueva rechazaría (fecha ilegible,
+    importe o lugar vacíos) la migración se detiene y las enumera, sin tocar
+    nada: copiarlas las perdería.
+    """
+    filas = conn.execute('''
+        SELECT id, cuenta_id, fecha, lugar, CAST(ROUND(cantidad * 100) AS INTEGER) AS centimos
+        FROM gastos
+        WHERE date(fecha) IS NULL OR cantidad IS NULL OR lugar IS NULL
+    ''').fetchall()
+    corregidas, ilegibles = [], []
+    for fila in filas:
+        fecha = _leer_fecha_libre(fila['fecha'])
+        if fecha is None or fila['centimos'] is None or fila['lugar'] is None:
+            ilegibles.append(fila)
+        else:
+            corregidas.append((fila, fecha))
+    if ilegibles:
+        detalle = ', '.join(
+            f"id {fila['id']} (fecha {fila['fecha']!r}, lugar {fila['lugar']!r}, céntimos {fila['centimos']})"
+            for fila in ilegibles[:50]
+        )
+        raise ValueError(
+            f"{len(ilegibles)} gastos no se pueden convertir; corríjalos y vuelva a arrancar: {detalle}"
+        )
+
+    with transaccion() as conn:
+        for fila, fecha in corregidas:
+            base = huella_base(fecha, fila['lugar'], fila['centimos'])
+            conn.execute(
+                "UPDATE gastos SET fecha = ?, huella = ? WHERE id = ?",
+                (fecha, siguiente_huella(conn, fila['cuenta_id'], base, excluir_id=fila['id']), fila['id'])
+            )
+
+def _centimos_sqlite(conn, progreso):
+    """SQLite no puede añadir un CHECK ni cambiar el tipo de una columna, así
+    que la tabla se reconstruye: se copia por lotes a gastos_nueva mientras
+    unos triggers replican las escrituras concurrentes, y al final se
+    intercambian las tablas en una transacción corta."""
+    _normalizar_gastos_sqlite(conn)
+    conn.executescript(f'''
+        {TABLA_GASTOS_SQLITE.format(tabla='gastos_nueva')}
+        
+        CREATE TRIGGER IF NOT EXISTS trg_gastos_nueva_insert AFTER INSERT ON gastos
+        BEGIN
+            INSERT OR REPLACE INTO gastos_nueva ({_COLUMNAS_GASTOS})
+            VALUES ({_CONVERTIR_GASTO.format(f='NEW.')});
+        END;
+        
+        CREATE TRIGGER IF NOT EXISTS trg_gastos_nueva_update AFTER UPDATE ON gastos
+        BEGIN
+            DELETE FROM gastos_nueva WHERE id = OLD.id;
+            INSERT OR REPLACE INTO gastos_nueva ({_COLUMNAS_GASTOS})
+            VALUES ({_CONVERTIR_GASTO.format(f='NEW.')});
+        END;
+        
+        CREATE TRIGGER IF NOT EXISTS trg_gastos_nueva_delete AFTER DELETE ON gastos
+        BEGIN
+            DELETE FROM gastos_nueva WHERE id = OLD.id;
+        END;
+    ''')
+
+    # Las filas que ya copió un trigger son más recientes y se saltan; sin
+    # OR IGNORE, que también se tragaría los NOT NULL y CHECK que fallen
+    ultimo_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM gastos").fetchone()[0]
+    desde = 0
+    while desde < ultimo_id:
+        hasta = desde + TAMANO_LOTE
+        with transaccion() as conn:
+            conn.execute(f'''
+                INSERT INTO gastos_nueva ({_COLUMNAS_GASTOS})
+                SELECT {_CONVERTIR_GASTO.format(f='')} FROM gastos
+                WHERE id > ? AND id <= ?
+                AND id NOT IN (SELECT id FROM gastos_nueva WHERE id > ? AND id <= ?)
+            ''', (desde, hasta, desde, hasta))
+        desde = hasta
+        progreso(min(desde, ultimo_id), ultimo_id)
+
+    # Intercambio: al borrar gastos desaparecen también sus índices y
+    # triggers (los de réplica y los del resumen antiguo)
     try:
-        # Verificar si la columna existe
-        c.execute("SELECT notas FROM gastos LIMIT 1")
-    except sqlite3.OperationalError:
-        # La columna no existe, agregarla
-        print("Agregando columna 'notas' a la tabla gastos...")
-        c.execute("ALTER TABLE gastos ADD COLUMN notas TEXT")
+        conn.executescript(f'''
+            BEGIN IMMEDIATE;
+            UPDATE sqlite_sequence
+            SET seq = MAX(seq, COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'gastos'), 0))
+            WHERE name = 'gastos_nueva';
+            DROP TABLE gastos;
+            ALTER TABLE gastos_nueva RENAME TO gastos;
+            {INDICES_GASTOS}
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_gastos_cuenta_huella ON gastos (cuenta_id, huella);
+            DROP TABLE IF EXISTS gastos_mensuales;
+            {RESUMEN_MENSUAL_SQLITE}
+            INSERT INTO gastos_mensuales
+                (cuenta_id, categoria_id, mes, total_centimos, num_gastos, minimo_centimos, maximo_centimos)
+            SELECT cuenta_id, categoria_id, substr(fecha, 1, 7),
+                   SUM(centimos), COUNT(*), MIN(centimos), MAX(centimos)
+            FROM gastos
+            GROUP BY cuenta_id, categoria_id, substr(fecha, 1, 7);
+            COMMIT;
+        ''')
+    except BaseException:
+        conn.rollback()
+        raise
+
+def _centimos_postgres(conn, progreso):
+    """En PostgreSQL fecha ya es DATE; el cambio de tipo de cantidad reescribe
+    la tabla bajo un bloqueo exclusivo, en una sola transacción."""
+    with transaccion() as conn:
+        conn.execute("DROP TRIGGER IF EXISTS trg_gastos_mensuales ON gastos")
+        conn.execute("ALTER TABLE gastos ALTER COLUMN cantidad TYPE BIGINT USING round(cantidad * 100)::bigint")
+        conn.execute("ALTER TABLE gastos RENAME COLUMN cantidad TO centimos")
+        conn.execute("DROP TABLE IF EXISTS gastos_mensuales")
+    get_backend().crear_resumen_mensual(conn)
+    cuentas = [fila[0] for fila in conn.execute("SELECT DISTINCT cuenta_id FROM gastos ORDER BY cuenta_id")]
+    for hechas, cuenta_id in enumerate(cuentas, 1):
+        reconstruir_resumen_mensual(cuenta_id)
+        progreso(hechas, len(cuentas))
+
+@migracion(6, "Sesiones de login")
+def _sesiones(conn, progreso):
+    conn.executescript(TABLA_SESIONES)
+
+@migracion(7, "Detección de gastos inusuales")
+def _anomalias(conn, progreso):
+    from utils.anomalias import reconstruir_anomalias
+
+    if 'anomalia' not in get_backend().columnas(conn, 'gastos'):
+        conn.execute("ALTER TABLE gastos ADD COLUMN anomalia DOUBLE PRECISION")
+        conn.commit()
+    conn.executescript(TABLA_ESTADISTICAS)
+
+    # Cada cuenta en su transacción; las altas que lleguen mientras tanto
+    # a una cuenta ya recorrida se anotan solas
+    cuentas = [fila[0] for fila in conn.execute("SELECT DISTINCT cuenta_id FROM gastos ORDER BY cuenta_id")]
+    for hechas, cuenta_id in enumerate(cuentas, 1):
+        reconstruir_anomalias(cuenta_id)
+        progreso(hechas, len(cuentas))
+
+@migracion(8, "Búsqueda de texto en lugar y notas")
+def _busqueda(conn, progreso):
+    get_backend().crear_busqueda(conn)
+
+@migracion(9, "Trabajos en segundo plano")
+def _trabajos(conn, progreso):
+    conn.executescript(TABLA_TRABAJOS)
+
+@migracion(10, "Contadores de cambios para las instantáneas")
+def _versiones(conn, progreso):
+    get_backend().crear_versiones(conn)
+
+@migracion(11, "Índice de membresías con rol")
+def _indice_membresias(conn, progreso):
+    conn.executescript(INDICE_MEMBRESIAS)
+
+@migracion(12, "Latido de los trabajos en segundo plano")
+def _latido_trabajos(conn, progreso):
+    if 'latido' not in get_backend().columnas(conn, 'trabajos'):
+        conn.execute("ALTER TABLE trabajos ADD COLUMN latido DOUBLE PRECISION")
         conn.commit()
-        print("Migración completada exitosamente")
-    
-    conn.close()
+
+def _crear_tablas_control(conn):
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            descripcion TEXT NOT NULL,
+            duracion_ms INTEGER NOT NULL,
+            aplicada_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+
+        CREATE TABLE IF NOT EXISTS bloqueo_migraciones (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            propietario TEXT NOT NULL,
+            expira DOUBLE PRECISION NOT NULL
+        );
+    ''')
+
+def version_actual(conn=None):
+    conn = conn or get_db_connection()
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+class BloqueoMigraciones:
+    """Bloqueo entre procesos y réplicas, guardado en la propia base.
+
+    Es una fila con caducidad en vez de una transacción abierta, para que los
+    lotes de los backfills puedan ir confirmándose mientras se conserva.
+    """
+
+    def __init__(self, propietario=None):
+        self.propietario = propietario or f"{socket.gethostname()}:{os.getpid()}:{id(self)}"
+
+    def tomar(self, espera=ESPERA_BLOQUEO):
+        limite = time.monotonic() + espera
+        while True:
+            with transaccion() as conn:
+                conn.execute("DELETE FROM bloqueo_migraciones WHERE expira < ?", (time.time(),))
+                tomado = conn.execute('''
+                    INSERT INTO bloqueo_migraciones (id, propietario, expira) VALUES (1, ?, ?)
+                    ON CONFLICT (id) DO NOTHING
+                ''', (self.propietario, time.time() + DURACION_BLOQUEO)).rowcount
+            if tomado:
+                return
+            if time.monotonic() > limite:
+                raise TimeoutError("Otro proceso lleva demasiado tiempo aplicando migraciones")
+            time.sleep(0.5)
+
+    def renovar(self):
+        with transaccion() as conn:
+            conn.execute(
+                "UPDATE bloqueo_migraciones SET expira = ? WHERE id = 1 AND propietario = ?",
+                (time.time() + DURACION_BLOQUEO, self.propietario)
+            )
+
+    def soltar(self):
+        with transaccion() as conn:
+            conn.execute("DELETE FROM bloqueo_migraciones WHERE id = 1 AND propietario = ?", (self.propietario,))
+
+    def __enter__(self):
+        self.tomar()
+        return self
+
+    def __exit__(self, *exc):
+        self.soltar()
+
+def migrar(informar=print):
+    """Aplica en orden las migraciones pendientes y devuelve sus versiones.
+
+    Si el esquema ya está al día sólo cuesta una consulta. Cada paso informa
+    de su progreso y su duración con `informar`.
+    """
+    conn = get_db_connection()
+    _crear_tablas_control(conn)
+    ultima = MIGRACIONES[-1].version
+    if version_actual(conn) >= ultima:
+        return []
+
+    aplicadas = []
+    with BloqueoMigraciones() as bloqueo:
+        # Otra réplica pudo terminar mientras esperábamos el bloqueo
+        actual = version_actual(conn)
+        for paso in MIGRACIONES:
+            if paso.version <= actual:
+                continue
+
+            def progreso(hechas, total, paso=paso):
+                bloqueo.renovar()
+                informar(f"Migración {paso.version} ({paso.descripcion}): {hechas}/{total}")
+
+            inicio = time.perf_counter()
+            paso.aplicar(conn, progreso)
+            duracion_ms = round((time.perf_counter() - inicio) * 1000)
+            with transaccion() as conn:
+                conn.execute(
+                    "INSERT INTO schema_version (version, descripcion, duracion_ms) VALUES (?, ?, ?)",
+                    (paso.version, paso.descripcion, duracion_ms)
+                )
+            informar(f"Migración {paso.version} ({paso.descripcion}) aplicada en {duracion_ms} ms")
+            aplicadas.append(paso.version)
+    return aplicadas
 
 if __name__ == "__main__":
-    migrate_database() 
\ No newline at end of file
+    migrar()
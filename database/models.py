@@ -1,52 +1,427 @@
-import sqlite3
-import bcrypt
-from datetime import datetime
-
-CREATE_TABLES = """
-CREATE TABLE IF NOT EXISTS usuarios (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    email TEXT UNIQUE NOT NULL,
-    password TEXT NOT NULL,
-    nombre TEXT NOT NULL,
-    fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
-
-CREATE TABLE IF NOT EXISTS cuentas (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    nombre TEXT NOT NULL,
-    creador_id INTEGER,
-    fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (creador_id) REFERENCES usuarios(id)
-);
-
-CREATE TABLE IF NOT EXISTS usuarios_cuentas (
-    usuario_id INTEGER,
-    cuenta_id INTEGER,
-    rol TEXT CHECK(rol IN ('admin', 'usuario')) DEFAULT 'usuario',
-    FOREIGN KEY (usuario_id) REFERENCES usuarios(id),
-    FOREIGN KEY (cuenta_id) REFERENCES cuentas(id),
-    PRIMARY KEY (usuario_id, cuenta_id)
-);
-
-CREATE TABLE IF NOT EXISTS categorias (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    cuenta_id INTEGER,
-    nombre TEXT NOT NULL,
-    presupuesto_mensual REAL,
-    FOREIGN KEY (cuenta_id) REFERENCES cuentas(id)
-);
-
-CREATE TABLE IF NOT EXISTS gastos (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    cuenta_id INTEGER,
-    categoria_id INTEGER,
-    cantidad REAL NOT NULL,
-    lugar TEXT,
-    fecha DATE NOT NULL,
-    usuario_id INTEGER,
-    fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (cuenta_id) REFERENCES cuentas(id),
-    FOREIGN KEY (categoria_id) REFERENCES categorias(id),
-    FOREIGN KEY (usuario_id) REFERENCES usuarios(id)
-);
-""" 
\ No newline at end of file
+# Esquema de la base de datos para cada backend. Lo aplican las migraciones
+# de database/migrate.py; todas las sentencias son idempotentes.
+
+# Importes en céntimos enteros, para que las sumas sean exactas, y fechas
+# 'YYYY-MM-DD' estrictas: el CHECK rechaza cualquier otro formato o tipo.
+TABLA_GASTOS_SQLITE = '''CREATE TABLE IF NOT EXISTS {tabla} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            cuenta_id INTEGER NOT NULL,
+            categoria_id INTEGER NOT NULL,
+            centimos INTEGER NOT NULL CHECK (typeof(centimos) = 'integer'),
+            lugar TEXT NOT NULL,
+            fecha TEXT NOT NULL CHECK (fecha IS date(fecha)),
+            usuario_id INTEGER NOT NULL,
+            notas TEXT,
+            huella TEXT,
+            anomalia REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (cuenta_id) REFERENCES cuentas (id),
+            FOREIGN KEY (categoria_id) REFERENCES categorias (id),
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
+        );'''
+
+INDICES_GASTOS = '''CREATE INDEX IF NOT EXISTS idx_gastos_cuenta_fecha ON gastos (cuenta_id, fecha);
+        CREATE INDEX IF NOT EXISTS idx_gastos_categoria_fecha ON gastos (categoria_id, fecha);'''
+
+# Sesiones de login: la cookie lleva un token opaco y aquí sólo se guarda su
+# SHA-256. expira es un timestamp Unix para compararlo igual en los dos motores.
+TABLA_SESIONES = '''
+        CREATE TABLE IF NOT EXISTS sesiones (
+            token_hash TEXT PRIMARY KEY,
+            usuario_id INTEGER NOT NULL REFERENCES usuarios (id) ON DELETE CASCADE,
+            expira DOUBLE PRECISION NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS idx_sesiones_usuario ON sesiones (usuario_id);
+    '''
+
+# Trabajos en segundo plano (utils/trabajos.py). Los tiempos son timestamps
+# Unix, como en sesiones. El índice único parcial impide dos trabajos activos
+# del mismo tipo en una cuenta.
+TABLA_TRABAJOS = '''
+        CREATE TABLE IF NOT EXISTS trabajos (
+            id TEXT PRIMARY KEY,
+            tipo TEXT NOT NULL,
+            cuenta_id INTEGER NOT NULL REFERENCES cuentas (id) ON DELETE CASCADE,
+            usuario_id INTEGER REFERENCES usuarios (id) ON DELETE SET NULL,
+            estado TEXT NOT NULL,
+            proceso TEXT NOT NULL,
+            hechas INTEGER NOT NULL DEFAULT 0,
+            total INTEGER,
+            resultado TEXT,
+            error TEXT,
+            creado DOUBLE PRECISION NOT NULL,
+            iniciado DOUBLE PRECISION,
+            terminado DOUBLE PRECISION,
+            latido DOUBLE PRECISION
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_trabajos_activos ON trabajos (cuenta_id, tipo)
+            WHERE estado IN ('pendiente', 'en_curso');
+        CREATE INDEX IF NOT EXISTS idx_trabajos_cuenta ON trabajos (cuenta_id, creado);
+    '''
+
+# Puntuación a partir de la cual un gasto se marca como inusual. El índice
+# parcial repite el valor literal (así lo pueden usar las consultas), de modo
+# que cambiarlo exige una migración que recree el índice.
+UMBRAL_ANOMALIA = 3.0
+
+# Acumuladores de Welford del log del importe por cuenta y ámbito
+# ('categoria' con el id, 'lugar' con el nombre normalizado).
+TABLA_ESTADISTICAS = f'''
+        CREATE TABLE IF NOT EXISTS estadisticas_gastos (
+            cuenta_id INTEGER NOT NULL REFERENCES cuentas (id) ON DELETE CASCADE,
+            ambito TEXT NOT NULL,
+            clave TEXT NOT NULL,
+            n INTEGER NOT NULL,
+            media DOUBLE PRECISION NOT NULL,
+            m2 DOUBLE PRECISION NOT NULL,
+            PRIMARY KEY (cuenta_id, ambito, clave)
+        );
+        CREATE INDEX IF NOT EXISTS idx_gastos_inusuales ON gastos (cuenta_id, fecha)
+            WHERE anomalia >= {UMBRAL_ANOMALIA};
+    '''
+
+# Membresías de un usuario con su rol sin leer la tabla: la PRIMARY KEY
+# (usuario_id, cuenta_id) encuentra las filas pero no cubre rol, y el informe
+# consolidado parte de aquí para cada consulta
+INDICE_MEMBRESIAS = '''CREATE INDEX IF NOT EXISTS idx_usuarios_cuentas_rol ON usuarios_cuentas (usuario_id, cuenta_id, rol);'''
+
+ESQUEMA_SQLITE = f'''
+        CREATE TABLE IF NOT EXISTS usuarios (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nombre TEXT NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        
+        CREATE TABLE IF NOT EXISTS cuentas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nombre TEXT NOT NULL,
+            creador_id INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (creador_id) REFERENCES usuarios (id)
+        );
+        
+        CREATE TABLE IF NOT EXISTS usuarios_cuentas (
+            usuario_id INTEGER NOT NULL,
+            cuenta_id INTEGER NOT NULL,
+            rol TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (usuario_id, cuenta_id),
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (id),
+            FOREIGN KEY (cuenta_id) REFERENCES cuentas (id)
+        );
+        
+        CREATE TABLE IF NOT EXISTS categorias (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nombre TEXT NOT NULL,
+            cuenta_id INTEGER NOT NULL,
+            presupuesto_mensual REAL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (cuenta_id) REFERENCES cuentas (id)
+        );
+        
+        {TABLA_GASTOS_SQLITE.format(tabla='gastos')}
+        
+        -- Índices para los filtros por cuenta/categoría y rango de fechas
+        {INDICES_GASTOS}
+        CREATE INDEX IF NOT EXISTS idx_categorias_cuenta ON categorias (cuenta_id);
+        {INDICE_MEMBRESIAS}
+    '''
+
+ESQUEMA_POSTGRES = f'''
+        CREATE TABLE IF NOT EXISTS usuarios (
+            id SERIAL PRIMARY KEY,
+            nombre TEXT NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            password BYTEA NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        
+        CREATE TABLE IF NOT EXISTS cuentas (
+            id SERIAL PRIMARY KEY,
+            nombre TEXT NOT NULL,
+            creador_id INTEGER NOT NULL REFERENCES usuarios (id),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        
+        -- SQLite no aplica las claves foráneas; aquí sí, así que los accesos
+        -- se borran con el usuario para que eliminar_usuario siga funcionando
+        CREATE TABLE IF NOT EXISTS usuarios_cuentas (
+            usuario_id INTEGER NOT NULL REFERENCES usuarios (id) ON DELETE CASCADE,
+            cuenta_id INTEGER NOT NULL REFERENCES cuentas (id),
+            rol TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (usuario_id, cuenta_id)
+        );
+        
+        CREATE TABLE IF NOT EXISTS categorias (
+            id SERIAL PRIMARY KEY,
+            nombre TEXT NOT NULL,
+            cuenta_id INTEGER NOT NULL REFERENCES cuentas (id),
+            presupuesto_mensual DOUBLE PRECISION DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        
+        -- huella con COLLATE "C": siguiente_huella busca por rango de bytes
+        CREATE TABLE IF NOT EXISTS gastos (
+            id SERIAL PRIMARY KEY,
+            cuenta_id INTEGER NOT NULL REFERENCES cuentas (id),
+            categoria_id INTEGER NOT NULL REFERENCES categorias (id),
+            centimos BIGINT NOT NULL,
+            lugar TEXT NOT NULL,
+            fecha DATE NOT NULL,
+            usuario_id INTEGER NOT NULL REFERENCES usuarios (id),
+            notas TEXT,
+            huella TEXT COLLATE "C",
+            anomalia DOUBLE PRECISION,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        
+        {INDICES_GASTOS}
+        CREATE INDEX IF NOT EXISTS idx_categorias_cuenta ON categorias (cuenta_id);
+        {INDICE_MEMBRESIAS}
+'''
+
+# Resumen mensual por cuenta y categoría (mes = 'YYYY-MM'), mantenido por
+# triggers. Las altas se suman de forma incremental; bajas y modificaciones
+# recalculan sólo el grupo afectado (un mes de una categoría) para que
+# mínimo y máximo sigan siendo exactos.
+#
+# El rango `fecha >= 'YYYY-MM' AND fecha < 'YYYY-MM-32'` abarca todo el mes
+# y sí usa idx_gastos_categoria_fecha.
+_RECALCULAR_GRUPO = '''
+        DELETE FROM gastos_mensuales
+        WHERE cuenta_id = {fila}.cuenta_id
+        AND categoria_id = {fila}.categoria_id
+        AND mes = substr({fila}.fecha, 1, 7);
+        
+        INSERT INTO gastos_mensuales (cuenta_id, categoria_id, mes, total_centimos, num_gastos, minimo_centimos, maximo_centimos)
+        SELECT cuenta_id, categoria_id, substr({fila}.fecha, 1, 7),
+               SUM(centimos), COUNT(*), MIN(centimos), MAX(centimos)
+        FROM gastos
+        WHERE categoria_id = {fila}.categoria_id
+        AND cuenta_id = {fila}.cuenta_id
+        AND fecha >= substr({fila}.fecha, 1, 7)
+        AND fecha < substr({fila}.fecha, 1, 7) || '-32'
+        GROUP BY cuenta_id, categoria_id;
+'''
+
+RESUMEN_MENSUAL_SQLITE = f'''
+        CREATE TABLE IF NOT EXISTS gastos_mensuales (
+            cuenta_id INTEGER NOT NULL,
+            categoria_id INTEGER NOT NULL,
+            mes TEXT NOT NULL,
+            total_centimos INTEGER NOT NULL,
+            num_gastos INTEGER NOT NULL,
+            minimo_centimos INTEGER NOT NULL,
+            maximo_centimos INTEGER NOT NULL,
+            PRIMARY KEY (cuenta_id, categoria_id, mes)
+        );
+        CREATE INDEX IF NOT EXISTS idx_gastos_mensuales_cuenta_mes ON gastos_mensuales (cuenta_id, mes);
+        
+        CREATE TRIGGER IF NOT EXISTS trg_gastos_mensuales_insert AFTER INSERT ON gastos
+        BEGIN
+            INSERT INTO gastos_mensuales (cuenta_id, categoria_id, mes, total_centimos, num_gastos, minimo_centimos, maximo_centimos)
+            VALUES (NEW.cuenta_id, NEW.categoria_id, substr(NEW.fecha, 1, 7),
+                    NEW.centimos, 1, NEW.centimos, NEW.centimos)
+            ON CONFLICT (cuenta_id, categoria_id, mes) DO UPDATE SET
+                total_centimos = total_centimos + excluded.total_centimos,
+                num_gastos = num_gastos + 1,
+                minimo_centimos = MIN(minimo_centimos, excluded.minimo_centimos),
+                maximo_centimos = MAX(maximo_centimos, excluded.maximo_centimos);
+        END;
+        
+        CREATE TRIGGER IF NOT EXISTS trg_gastos_mensuales_delete AFTER DELETE ON gastos
+        BEGIN
+            {_RECALCULAR_GRUPO.format(fila='OLD')}
+        END;
+        
+        CREATE TRIGGER IF NOT EXISTS trg_gastos_mensuales_update
+        AFTER UPDATE OF cuenta_id, categoria_id, centimos, fecha ON gastos
+        BEGIN
+            {_RECALCULAR_GRUPO.format(fila='OLD')}
+            {_RECALCULAR_GRUPO.format(fila='NEW')}
+        END;
+    '''
+
+# En PostgreSQL el mismo mantenimiento con una función de trigger; el mes se
+# recalcula con un rango de fechas para usar idx_gastos_categoria_fecha
+RESUMEN_MENSUAL_POSTGRES = '''
+        CREATE TABLE IF NOT EXISTS gastos_mensuales (
+            cuenta_id INTEGER NOT NULL,
+            categoria_id INTEGER NOT NULL,
+            mes TEXT NOT NULL,
+            total_centimos BIGINT NOT NULL,
+            num_gastos INTEGER NOT NULL,
+            minimo_centimos BIGINT NOT NULL,
+            maximo_centimos BIGINT NOT NULL,
+            PRIMARY KEY (cuenta_id, categoria_id, mes)
+        );
+        CREATE INDEX IF NOT EXISTS idx_gastos_mensuales_cuenta_mes ON gastos_mensuales (cuenta_id, mes);
+        
+        CREATE OR REPLACE FUNCTION recalcular_gasto_mensual(p_cuenta INTEGER, p_categoria INTEGER, p_fecha DATE)
+        RETURNS void AS $$
+        DECLARE
+            inicio DATE := date_trunc('month', p_fecha)::date;
+        BEGIN
+            DELETE FROM gastos_mensuales
+            WHERE cuenta_id = p_cuenta
+            AND categoria_id = p_categoria
+            AND mes = to_char(inicio, 'YYYY-MM');
+            
+            INSERT INTO gastos_mensuales (cuenta_id, categoria_id, mes, total_centimos, num_gastos, minimo_centimos, maximo_centimos)
+            SELECT cuenta_id, categoria_id, to_char(inicio, 'YYYY-MM'),
+                   SUM(centimos), COUNT(*), MIN(centimos), MAX(centimos)
+            FROM gastos
+            WHERE categoria_id = p_categoria
+            AND cuenta_id = p_cuenta
+            AND fecha >= inicio
+            AND fecha < inicio + INTERVAL '1 month'
+            GROUP BY cuenta_id, categoria_id;
+        END;
+        $$ LANGUAGE plpgsql;
+        
+        CREATE OR REPLACE FUNCTION trg_gastos_mensuales() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO gastos_mensuales (cuenta_id, categoria_id, mes, total_centimos, num_gastos, minimo_centimos, maximo_centimos)
+                VALUES (NEW.cuenta_id, NEW.categoria_id, to_char(NEW.fecha, 'YYYY-MM'),
+                        NEW.centimos, 1, NEW.centimos, NEW.centimos)
+                ON CONFLICT (cuenta_id, categoria_id, mes) DO UPDATE SET
+                    total_centimos = gastos_mensuales.total_centimos + EXCLUDED.total_centimos,
+                    num_gastos = gastos_mensuales.num_gastos + 1,
+                    minimo_centimos = LEAST(gastos_mensuales.minimo_centimos, EXCLUDED.minimo_centimos),
+                    maximo_centimos = GREATEST(gastos_mensuales.maximo_centimos, EXCLUDED.maximo_centimos);
+                RETURN NULL;
+            END IF;
+            
+            PERFORM recalcular_gasto_mensual(OLD.cuenta_id, OLD.categoria_id, OLD.fecha);
+            IF TG_OP = 'UPDATE' THEN
+                PERFORM recalcular_gasto_mensual(NEW.cuenta_id, NEW.categoria_id, NEW.fecha);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        
+        DROP TRIGGER IF EXISTS trg_gastos_mensuales ON gastos;
+        CREATE TRIGGER trg_gastos_mensuales
+        AFTER INSERT OR DELETE OR UPDATE OF cuenta_id, categoria_id, centimos, fecha ON gastos
+        FOR EACH ROW EXECUTE PROCEDURE trg_gastos_mensuales();
+'''
+
+# Búsqueda de texto en lugar y notas. En SQLite es un índice FTS5 de
+# contenido externo (lee el texto de gastos, no lo duplica) que mantienen los
+# triggers. cuenta_id se indexa como un token más, así el filtro por cuenta
+# lo resuelve el propio índice. unicode61 con remove_diacritics ignora
+# mayúsculas y acentos, y los índices de prefijo aceleran 'me*'. Sin
+# búsquedas de frases no hacen falta posiciones: detail = 'column' deja el
+# índice más pequeño y los prefijos más rápidos.
+BUSQUEDA_SQLITE = '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS gastos_fts USING fts5(
+            lugar, notas, cuenta_id,
+            content = 'gastos', content_rowid = 'id',
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3',
+            detail = 'column'
+        );
+        
+        CREATE TRIGGER IF NOT EXISTS trg_gastos_fts_insert AFTER INSERT ON gastos
+        BEGIN
+            INSERT INTO gastos_fts (rowid, lugar, notas, cuenta_id)
+            VALUES (NEW.id, NEW.lugar, NEW.notas, NEW.cuenta_id);
+        END;
+        
+        CREATE TRIGGER IF NOT EXISTS trg_gastos_fts_delete AFTER DELETE ON gastos
+        BEGIN
+            INSERT INTO gastos_fts (gastos_fts, rowid, lugar, notas, cuenta_id)
+            VALUES ('delete', OLD.id, OLD.lugar, OLD.notas, OLD.cuenta_id);
+        END;
+        
+        CREATE TRIGGER IF NOT EXISTS trg_gastos_fts_update AFTER UPDATE OF lugar, notas, cuenta_id ON gastos
+        BEGIN
+            INSERT INTO gastos_fts (gastos_fts, rowid, lugar, notas, cuenta_id)
+            VALUES ('delete', OLD.id, OLD.lugar, OLD.notas, OLD.cuenta_id);
+            INSERT INTO gastos_fts (rowid, lugar, notas, cuenta_id)
+            VALUES (NEW.id, NEW.lugar, NEW.notas, NEW.cuenta_id);
+        END;
+        
+        INSERT INTO gastos_fts (gastos_fts) VALUES ('rebuild');
+'''
+
+# En PostgreSQL, un índice GIN sobre una expresión tsvector: se mantiene solo
+# y no reescribe la tabla. Las consultas tienen que repetir exactamente
+# DOCUMENTO_BUSQUEDA para que el planificador use el índice.
+DOCUMENTO_BUSQUEDA = (
+    "(setweight(to_tsvector('simple', sin_acentos({g}lugar)), 'A')"
+    " || setweight(to_tsvector('simple', sin_acentos(COALESCE({g}notas, ''))), 'B'))"
+)
+
+BUSQUEDA_POSTGRES = f'''
+        CREATE OR REPLACE FUNCTION sin_acentos(texto TEXT) RETURNS TEXT AS $$
+            SELECT translate(lower(texto), 'áàâäãåéèêëíìîïóòôöõúùûüñç', 'aaaaaaeeeeiiiiooooouuuunc')
+        $$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+        
+        CREATE INDEX IF NOT EXISTS idx_gastos_busqueda ON gastos
+            USING GIN ({DOCUMENTO_BUSQUEDA.format(g='')});
+        
+        -- Sin estadísticas de la expresión el planificador prefiere recorrer
+        -- gastos por id y calcular el tsvector de cada fila
+        ANALYZE gastos;
+'''
+
+# Contador de modificaciones y borrados de gastos por cuenta, para saber si
+# una instantánea de utils/instantaneas.py sigue valiendo. Las altas no lo
+# tocan: se detectan por el número de gastos de gastos_mensuales y se añaden
+# a la instantánea sin rehacerla. Sólo cuentan los cambios reales de las
+# columnas que la instantánea guarda: editar las notas o recalcular anomalia
+# no la invalida.
+_SUMAR_CAMBIO = '''
+            INSERT INTO versiones_cuentas (cuenta_id, cambios) VALUES ({fila}.cuenta_id, 1)
+            ON CONFLICT (cuenta_id) DO UPDATE SET cambios = versiones_cuentas.cambios + 1;'''
+
+TABLA_VERSIONES = '''
+        CREATE TABLE IF NOT EXISTS versiones_cuentas (
+            cuenta_id INTEGER PRIMARY KEY,
+            cambios INTEGER NOT NULL DEFAULT 0
+        );
+'''
+
+VERSIONES_SQLITE = f'''{TABLA_VERSIONES}
+        CREATE TRIGGER IF NOT EXISTS trg_versiones_delete AFTER DELETE ON gastos
+        BEGIN{_SUMAR_CAMBIO.format(fila='OLD')}
+        END;
+        
+        CREATE TRIGGER IF NOT EXISTS trg_versiones_update
+        AFTER UPDATE OF cuenta_id, categoria_id, centimos, fecha ON gastos
+        WHEN OLD.cuenta_id IS NOT NEW.cuenta_id OR OLD.categoria_id IS NOT NEW.categoria_id
+            OR OLD.centimos IS NOT NEW.centimos OR OLD.fecha IS NOT NEW.fecha
+        BEGIN{_SUMAR_CAMBIO.format(fila='OLD')}{_SUMAR_CAMBIO.format(fila='NEW')}
+        END;
+'''
+
+VERSIONES_POSTGRES = f'''{TABLA_VERSIONES}
+        CREATE OR REPLACE FUNCTION trg_versiones_cuentas() RETURNS trigger AS $$
+        BEGIN{_SUMAR_CAMBIO.format(fila='OLD')}
+            IF TG_OP = 'UPDATE' THEN
+                INSERT INTO versiones_cuentas (cuenta_id, cambios) VALUES (NEW.cuenta_id, 1)
+                ON CONFLICT (cuenta_id) DO UPDATE SET cambios = versiones_cuentas.cambios + 1;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        
+        DROP TRIGGER IF EXISTS trg_versiones_delete ON gastos;
+        CREATE TRIGGER trg_versiones_delete
+        AFTER DELETE ON gastos
+        FOR EACH ROW EXECUTE PROCEDURE trg_versiones_cuentas();
+        
+        DROP TRIGGER IF EXISTS trg_versiones_update ON gastos;
+        CREATE TRIGGER trg_versiones_update
+        AFTER UPDATE OF cuenta_id, categoria_id, centimos, fecha ON gastos
+        FOR EACH ROW
+        WHEN ((OLD.cuenta_id, OLD.categoria_id, OLD.centimos, OLD.fecha)
+              IS DISTINCT FROM (NEW.cuenta_id, NEW.categoria_id, NEW.centimos, NEW.fecha))
+        EXECUTE PROCEDURE trg_versiones_cuentas();
+'''
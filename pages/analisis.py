@@ -1,60 +1,62 @@
 import streamlit as st
-import sqlite3
-import pandas as pd
+import numpy as np
 import plotly.express as px
-from datetime import datetime, timedelta
-from components.sidebar import show_sidebar
+from datetime import datetime, date, timedelta
+from components.sidebar import show_sidebar, get_cuentas_usuario
 from translations import get_text
 import time
+from database import transaccion, leer_df, rango_mes, clave_mes, mes_anterior, detectar_cambios_externos
+from utils.cache import cacheado, invalidar_cuenta, versiones_cuentas
+from utils.analitica import cargar_series, media_movil
+from utils.anomalias import retirar
+from pages.gastos import actualizar_gasto, mostrar_exportacion
+from utils.exportacion import exportar_gastos_mes
+from utils import perfilador
 
-def get_gastos_mes(cuenta_id, mes=None, anio=None):
-    conn = sqlite3.connect('finanzas.db')
-    
-    if not mes or not anio:
-        hoy = datetime.now()
-        mes = mes or hoy.month
-        anio = anio or hoy.year
-    
+# El mes va siempre en los argumentos: forma parte de la clave de la caché
+@cacheado()
+def get_gastos_mes(cuenta_id, mes, anio):
     query = """
     SELECT 
         c.nombre as categoria,
         c.presupuesto_mensual,
-        COALESCE(SUM(g.cantidad), 0) as total_gastado,
-        COUNT(g.id) as num_gastos
+        COALESCE(SUM(gm.total_centimos), 0) / 100.0 as total_gastado,
+        COALESCE(SUM(gm.num_gastos), 0) as num_gastos
     FROM categorias c
-    LEFT JOIN gastos g ON c.id = g.categoria_id 
-        AND strftime('%m-%Y', g.fecha) = ?
+    LEFT JOIN gastos_mensuales gm ON gm.cuenta_id = c.cuenta_id
+        AND gm.categoria_id = c.id
+        AND gm.mes = ?
     WHERE c.cuenta_id = ?
     GROUP BY c.nombre, c.presupuesto_mensual
     ORDER BY total_gastado DESC
     """
     
-    df = pd.read_sql_query(query, conn, params=(f"{mes:02d}-{anio}", cuenta_id))
-    conn.close()
-    return df
+    return leer_df(query, (clave_mes(anio, mes), cuenta_id))
 
 def eliminar_gasto(gasto_id):
-    conn = sqlite3.connect('finanzas.db')
-    c = conn.cursor()
     try:
-        c.execute("DELETE FROM gastos WHERE id = ?", (gasto_id,))
-        conn.commit()
+        with transaccion() as conn:
+            fila = conn.execute(
+                "DELETE FROM gastos WHERE id = ? RETURNING cuenta_id, categoria_id, lugar, centimos",
+                (int(gasto_id),)
+            ).fetchone()
+            if fila:
+                retirar(conn, fila['cuenta_id'], fila['categoria_id'], fila['lugar'], fila['centimos'])
+        if fila:
+            invalidar_cuenta(fila['cuenta_id'])
         return True
     except Exception as e:
         st.error(f"Error al eliminar: {str(e)}")
         return False
-    finally:
-        conn.close()
 
+@cacheado()
 def get_gastos_detallados(cuenta_id, mes, anio, categoria=None):
-    conn = sqlite3.connect('finanzas.db')
-    
     query = """
     SELECT 
         g.id,
         g.fecha,
         g.lugar,
-        g.cantidad,
+        g.centimos / 100.0 as cantidad,
         c.nombre as categoria,
         g.notas,
         u.nombre as usuario
@@ -62,10 +64,10 @@ def get_gastos_detallados(cuenta_id, mes, anio, categoria=None):
     JOIN categorias c ON g.categoria_id = c.id
     JOIN usuarios u ON g.usuario_id = u.id
     WHERE g.cuenta_id = ?
-    AND strftime('%m-%Y', g.fecha) = ?
+    AND g.fecha >= ? AND g.fecha < ?
     """
     
-    params = [cuenta_id, f"{mes:02d}-{anio}"]
+    params = [cuenta_id, *rango_mes(anio, mes)]
     
     if categoria:
         query += " AND c.nombre = ?"
@@ -73,9 +75,50 @@ def get_gastos_detallados(cuenta_id, mes, anio, categoria=None):
     
     query += " ORDER BY g.fecha DESC"
     
-    df = pd.read_sql_query(query, conn, params=tuple(params))
-    conn.close()
-    return df
+    return leer_df(query, tuple(params))
+
+@cacheado()
+def get_anios_gastos(cuenta_id):
+    return leer_df("""
+        SELECT DISTINCT substr(mes, 1, 4) as year 
+        FROM gastos_mensuales 
+        WHERE cuenta_id = ?
+        ORDER BY year DESC
+    """, (cuenta_id,))
+
+# Las lecturas consolidadas cruzan cuentas: `versiones` (versiones_cuentas()
+# de las cuentas del usuario) sólo está para la clave de la caché, que así
+# cambia con cualquier escritura en cualquiera de ellas
+@cacheado(por_cuenta=False)
+def get_consolidado_mes(usuario_id, mes, versiones):
+    """Gasto de un mes ('YYYY-MM') en todas las cuentas del usuario, por cuenta y categoría.
+
+    Una sola consulta sobre gastos_mensuales tenga el usuario las cuentas que
+    tenga; las cuentas sin gastos en el mes salen en una fila sin categoría.
+    """
+    return leer_df("""
+        SELECT uc.cuenta_id, cu.nombre AS cuenta, uc.rol,
+               c.nombre AS categoria, gm.total_centimos, gm.num_gastos
+        FROM usuarios_cuentas uc
+        JOIN cuentas cu ON cu.id = uc.cuenta_id
+        LEFT JOIN gastos_mensuales gm ON gm.cuenta_id = uc.cuenta_id AND gm.mes = ?
+        LEFT JOIN categorias c ON c.id = gm.categoria_id
+        WHERE uc.usuario_id = ?
+        ORDER BY cu.nombre, uc.cuenta_id
+    """, (mes, usuario_id))
+
+@cacheado(por_cuenta=False)
+def get_evolucion_consolidada(usuario_id, anio, versiones):
+    """Total de cada mes del año por cuenta, en todas las cuentas del usuario."""
+    return leer_df("""
+        SELECT gm.mes, uc.cuenta_id, cu.nombre AS cuenta, SUM(gm.total_centimos) AS total_centimos
+        FROM usuarios_cuentas uc
+        JOIN cuentas cu ON cu.id = uc.cuenta_id
+        JOIN gastos_mensuales gm ON gm.cuenta_id = uc.cuenta_id AND gm.mes >= ? AND gm.mes <= ?
+        WHERE uc.usuario_id = ?
+        GROUP BY gm.mes, uc.cuenta_id, cu.nombre
+        ORDER BY gm.mes
+    """, (clave_mes(anio, 1), clave_mes(anio, 12), usuario_id))
 
 def mostrar_analisis(show_sidebar_param=True):
     if 'user_id' not in st.session_state:
@@ -198,14 +241,7 @@ def mostrar_contenido_analisis():
     col1, col2 = st.columns(2)
     
     # Obtener años únicos
-    conn = sqlite3.connect('finanzas.db')
-    years_df = pd.read_sql_query("""
-        SELECT DISTINCT strftime('%Y', fecha) as year 
-        FROM gastos 
-        WHERE cuenta_id = ?
-        ORDER BY year DESC
-    """, conn, params=(st.session_state.cuenta_actual,))
-    conn.close()
+    years_df = get_anios_gastos(st.session_state.cuenta_actual)
     
     years = years_df['year'].tolist() if not years_df.empty else [datetime.now().year]
     
@@ -239,10 +275,11 @@ def mostrar_contenido_analisis():
     )
     
     # Tabs para diferentes vistas
-    tab1, tab2, tab3 = st.tabs([
+    tab1, tab2, tab3, tab4 = st.tabs([
         get_text('resumen_mensual'),
         get_text('gastos_categoria'),
-        get_text('tendencias')
+        get_text('tendencias'),
+        get_text('consolidado')
     ])
     
     # Agregar estado para confirmación de eliminación
@@ -351,14 +388,13 @@ def mostrar_contenido_analisis():
         # Modal de edición
         if 'gasto_a_editar' in st.session_state:
             gasto_id = st.session_state.gasto_a_editar
-            conn = sqlite3.connect('finanzas.db')
-            gasto_df = pd.read_sql_query("""
-                SELECT g.*, c.nombre as categoria
+            gasto_df = leer_df("""
+                SELECT g.id, g.fecha, g.centimos / 100.0 as cantidad, g.lugar, g.notas,
+                       g.categoria_id, c.nombre as categoria
                 FROM gastos g
                 JOIN categorias c ON g.categoria_id = c.id
                 WHERE g.id = ?
-            """, conn, params=(gasto_id,))
-            conn.close()
+            """, (int(gasto_id),))
             
             if not gasto_df.empty:
                 gasto = gasto_df.iloc[0]
@@ -372,29 +408,19 @@ def mostrar_contenido_analisis():
                         format="%.2f"
                     )
                     lugar = st.text_input("Lugar", value=gasto['lugar'])
-                    fecha = st.date_input("Fecha", value=pd.to_datetime(gasto['fecha']))
+                    fecha = st.date_input("Fecha", value=date.fromisoformat(gasto['fecha']))
                     notas = st.text_area("Notas", value=gasto['notas'] if gasto['notas'] else "")
                     
                     col1, col2 = st.columns(2)
                     with col1:
                         if st.form_submit_button("Guardar"):
-                            conn = sqlite3.connect('finanzas.db')
-                            c = conn.cursor()
-                            try:
-                                c.execute("""
-                                    UPDATE gastos 
-                                    SET cantidad = ?, lugar = ?, fecha = ?, notas = ?
-                                    WHERE id = ?
-                                """, (cantidad, lugar, fecha, notas, gasto_id))
-                                conn.commit()
+                            if actualizar_gasto(gasto_id, gasto['categoria_id'], cantidad, lugar, fecha, notas):
                                 st.success("Gasto actualizado exitosamente")
                                 del st.session_state.gasto_a_editar
                                 time.sleep(0.5)
                                 st.rerun()
-                            except Exception as e:
-                                st.error(f"Error al actualizar: {str(e)}")
-                            finally:
-                                conn.close()
+                            else:
+                                st.error("Error al actualizar el gasto")
                     
                     with col2:
                         if st.form_submit_button("Cancelar"):
@@ -405,7 +431,7 @@ def mostrar_contenido_analisis():
         # Gráficas en la parte superior
         col1, col2 = st.columns(2)
         
-        with col1:
+        with col1, perfilador.fase('graficos'):
             fig_pie = px.pie(
                 df_mes,
                 values='total_gastado',
@@ -414,7 +440,7 @@ def mostrar_contenido_analisis():
             )
             st.plotly_chart(fig_pie, use_container_width=True)
         
-        with col2:
+        with col2, perfilador.fase('graficos'):
             fig_bar = px.bar(
                 df_mes,
                 x='categoria',
@@ -478,61 +504,230 @@ def mostrar_contenido_analisis():
             # Mostrar total de registros
             st.info(f"Total de gastos: {len(gastos_detallados)}")
             
-            # Exportar a CSV
-            csv = gastos_detallados.to_csv(index=False).encode('utf-8')
-            st.download_button(
-                "Descargar como CSV",
-                csv,
-                f"gastos_{categoria_seleccionada}_{mes_seleccionado[0]}-{anio_seleccionado}.csv",
-                "text/csv",
-                key='download-csv'
+            # Exportar (se genera al pulsar, leyendo por bloques)
+            mostrar_exportacion(
+                f"gastos_{categoria_seleccionada}_{mes_seleccionado[0]}-{anio_seleccionado}", 'detalle',
+                lambda formato: exportar_gastos_mes(
+                    st.session_state.cuenta_actual, mes_seleccionado[0], anio_seleccionado, formato,
+                    None if categoria_seleccionada == 'Todas las categorías' else categoria_seleccionada
+                )
             )
         else:
             st.info(get_text('sin_gastos'))
     
     with tab3:
-        # Análisis de tendencias
-        meses_atras = 6
-        
-        # Obtener datos históricos
-        conn = sqlite3.connect('finanzas.db')
-        query_tendencias = """
-        SELECT 
-            strftime('%m-%Y', fecha) as mes,
-            c.nombre as categoria,
-            SUM(g.cantidad) as total
-        FROM gastos g
-        JOIN categorias c ON g.categoria_id = c.id
-        WHERE g.cuenta_id = ?
-        AND fecha >= date('now', ?)
-        GROUP BY mes, c.nombre
-        ORDER BY mes
-        """
-        
-        df_tendencias = pd.read_sql_query(
-            query_tendencias, 
-            conn, 
-            params=(st.session_state.cuenta_actual, f'-{meses_atras} months')
+        mostrar_tendencias(st.session_state.cuenta_actual)
+    
+    with tab4:
+        mostrar_consolidado(st.session_state.user_id, anio_seleccionado, mes_seleccionado[0])
+
+# Meses hacia atrás que puede abarcar la pestaña de tendencias (0 = todo)
+PERIODOS_TENDENCIAS = (6, 12, 24, 0)
+# Periodos de la media móvil, según se agrupe por mes o por semana
+MEDIA_MOVIL = {'mes': 3, 'semana': 4}
+
+def mostrar_tendencias(cuenta_id):
+    with perfilador.fase('datos'):
+        series = cargar_series(cuenta_id)
+    if series.vacia:
+        st.info(get_text('sin_datos_tendencia'))
+        return
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        meses = st.selectbox(
+            get_text('periodo'),
+            options=PERIODOS_TENDENCIAS,
+            format_func=lambda m: get_text('todo_historial') if m == 0 else f"{m} {get_text('meses')}",
+            key="tendencias_periodo"
+        )
+    with col2:
+        agrupacion = st.radio(
+            get_text('agrupar_por'),
+            options=list(MEDIA_MOVIL),
+            format_func=lambda a: get_text(f'por_{a}'),
+            horizontal=True,
+            key="tendencias_agrupacion"
+        )
+    
+    # Ventana [desde, hasta): los últimos `meses` meses incluido el actual
+    hoy = date.today()
+    hasta = hoy + timedelta(days=1)
+    desde = None
+    if meses:
+        anio, mes = hoy.year, hoy.month
+        for _ in range(meses - 1):
+            anio, mes = mes_anterior(anio, mes)
+        desde = date(anio, mes, 1)
+    
+    with perfilador.fase('datos'):
+        if agrupacion == 'mes':
+            periodos, matriz = series.por_mes(desde, hasta)
+        else:
+            periodos, matriz = series.por_semana(desde, hasta)
+    if not len(periodos):
+        st.info(get_text('sin_datos_tendencia'))
+        return
+    
+    # Una serie por categoría con gasto en la ventana
+    with perfilador.fase('graficos'):
+        etiquetas = periodos.astype(str)
+        con_gasto = matriz.any(axis=1)
+        datos = {
+            'periodo': np.tile(etiquetas, int(con_gasto.sum())),
+            'categoria': np.repeat(np.array(series.categorias)[con_gasto], len(etiquetas)),
+            'total': (matriz[con_gasto] / 100).ravel(),
+        }
+        fig_trend = px.line(
+            datos,
+            x='periodo',
+            y='total',
+            color='categoria',
+            markers=True,
+            title=get_text('tendencia_gastos'),
+            labels={
+                'periodo': get_text(agrupacion),
+                'total': 'Total Gastado',
+                'categoria': 'Categoría'
+            }
+        )
+        st.plotly_chart(fig_trend, use_container_width=True)
+    
+    # Total de todas las categorías y su media móvil
+    with perfilador.fase('graficos'):
+        total = matriz.sum(axis=0) / 100
+        ventana = MEDIA_MOVIL[agrupacion]
+        fig_total = px.line(
+            {
+                'periodo': np.tile(etiquetas, 2),
+                'serie': np.repeat([get_text('total'), f"{get_text('media_movil')} ({ventana})"], len(etiquetas)),
+                'total': np.concatenate([total, media_movil(total, ventana)]),
+            },
+            x='periodo',
+            y='total',
+            color='serie',
+            labels={'periodo': get_text(agrupacion), 'total': get_text('total'), 'serie': ''}
+        )
+        st.plotly_chart(fig_total, use_container_width=True)
+    
+    # Curva de gasto acumulado en la ventana
+    with perfilador.fase('graficos'):
+        dias, acumulado = series.acumulado(desde, hasta)
+        fig_acumulado = px.area(
+            {'fecha': dias.astype(str), 'total': acumulado.sum(axis=0) / 100},
+            x='fecha',
+            y='total',
+            title=get_text('gasto_acumulado'),
+            labels={'fecha': get_text('fecha'), 'total': get_text('total')}
+        )
+        st.plotly_chart(fig_acumulado, use_container_width=True)
+    
+    # Cuota de cada categoría y comparación con la misma ventana un año antes
+    with perfilador.fase('datos'):
+        inicio = desde or series.inicio.item()
+        actual, anterior = series.interanual(inicio, hasta)
+        _, cuotas = series.cuotas(desde, hasta)
+        orden = np.argsort(-actual)
+        orden = orden[actual[orden] > 0]
+        variacion = np.divide(
+            actual - anterior, anterior,
+            out=np.full(len(actual), np.nan), where=anterior > 0
+        )
+    st.dataframe(
+        {
+            get_text('categoria'): [series.categorias[i] for i in orden],
+            get_text('total'): [f"${actual[i] / 100:,.2f}" for i in orden],
+            get_text('cuota'): [f"{cuotas[i] * 100:.1f}%" for i in orden],
+            get_text('vs_anio_anterior'): [
+                "N/A" if np.isnan(variacion[i]) else f"{variacion[i] * 100:+.1f}%" for i in orden
+            ],
+        },
+        hide_index=True,
+        use_container_width=True
+    )
+
+def _etiquetas_cuentas(cuentas):
+    """cuenta_id -> nombre para mostrar; los nombres repetidos llevan el id."""
+    repetidos = cuentas['cuenta'].duplicated(keep=False)
+    return {
+        cuenta_id: f"{nombre} (#{cuenta_id})" if repetido else nombre
+        for cuenta_id, nombre, repetido in zip(cuentas['cuenta_id'], cuentas['cuenta'], repetidos)
+    }
+
+def mostrar_consolidado(usuario_id, anio, mes):
+    cuenta_ids = [cuenta['id'] for cuenta in get_cuentas_usuario(usuario_id)]
+    for cuenta_id in cuenta_ids:
+        detectar_cambios_externos(cuenta_id)
+    versiones = versiones_cuentas(cuenta_ids)
+    
+    resumen = get_consolidado_mes(usuario_id, clave_mes(anio, mes), versiones)
+    cuentas = resumen.drop_duplicates('cuenta_id')[['cuenta_id', 'cuenta', 'rol']]
+    etiquetas = _etiquetas_cuentas(cuentas)
+    del_mes = resumen.dropna(subset=['categoria'])
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric(get_text('total_consolidado'), f"${del_mes['total_centimos'].sum() / 100:,.2f}")
+    with col2:
+        st.metric(get_text('num_cuentas'), len(cuentas))
+    
+    if del_mes.empty:
+        st.info(get_text('sin_gastos'))
+    else:
+        # Por cuenta, también las que no tienen gastos en el mes
+        with perfilador.fase('datos'):
+            por_cuenta = cuentas.join(
+                del_mes.groupby('cuenta_id')[['total_centimos', 'num_gastos']].sum(), on='cuenta_id'
+            ).fillna({'total_centimos': 0, 'num_gastos': 0})
+            total = por_cuenta['total_centimos'].sum()
+        st.subheader(get_text('desglose_cuentas'))
+        st.dataframe(
+            {
+                get_text('cuenta'): por_cuenta['cuenta_id'].map(etiquetas),
+                get_text('rol'): [get_text(f'rol_{rol}') for rol in por_cuenta['rol']],
+                get_text('total'): [f"${c / 100:,.2f}" for c in por_cuenta['total_centimos']],
+                get_text('num_gastos'): por_cuenta['num_gastos'].astype(int),
+                get_text('cuota'): [f"{c / total * 100:.1f}%" for c in por_cuenta['total_centimos']],
+            },
+            hide_index=True,
+            use_container_width=True
         )
-        conn.close()
         
-        if not df_tendencias.empty:
-            # Gráfica de líneas para tendencias
-            fig_trend = px.line(
-                df_tendencias,
+        # Por categoría: las que se llaman igual en varias cuentas se suman
+        st.subheader(get_text('desglose_categorias'))
+        with perfilador.fase('datos'):
+            # Por id: dos cuentas con el mismo nombre son columnas distintas
+            tabla = del_mes.pivot_table(
+                index='categoria', columns='cuenta_id', values='total_centimos', aggfunc='sum', fill_value=0
+            ).rename(columns=etiquetas) / 100
+            tabla.columns.name = None
+            tabla.insert(0, get_text('total'), tabla.sum(axis=1))
+            tabla = tabla.sort_values(get_text('total'), ascending=False)
+        st.dataframe(
+            tabla,
+            column_config={
+                columna: st.column_config.NumberColumn(columna, format="$%.2f") for columna in tabla.columns
+            },
+            use_container_width=True
+        )
+    
+    evolucion = get_evolucion_consolidada(usuario_id, anio, versiones)
+    if not evolucion.empty:
+        with perfilador.fase('graficos'):
+            # Copia: el resultado cacheado se comparte y no se modifica
+            evolucion = evolucion.assign(
+                total=evolucion['total_centimos'] / 100,
+                cuenta=evolucion['cuenta_id'].map(etiquetas).fillna(evolucion['cuenta']),
+            )
+            fig = px.bar(
+                evolucion,
                 x='mes',
                 y='total',
-                color='categoria',
-                title=get_text('tendencia_gastos'),
-                labels={
-                    'mes': 'Mes',
-                    'total': 'Total Gastado',
-                    'categoria': 'Categoría'
-                }
+                color='cuenta',
+                title=get_text('evolucion_consolidada'),
+                labels={'mes': get_text('mes'), 'total': get_text('total'), 'cuenta': get_text('cuenta')}
             )
-            st.plotly_chart(fig_trend, use_container_width=True)
-        else:
-            st.info(get_text('sin_datos_tendencia'))
+            st.plotly_chart(fig, use_container_width=True)
 
 if __name__ == "__main__":
     mostrar_contenido_analisis() 
\ No newline at end of file
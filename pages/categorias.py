@@ -1,71 +1,72 @@
 import streamlit as st
-import sqlite3
-import pandas as pd
+from datetime import date
 from components.sidebar import show_sidebar
 from translations import get_text
+from database import transaccion, leer_df, clave_mes, ErrorBaseDatos
+from utils.cache import cacheado, invalidar_cuenta
+from utils.prevision import prevision_mes, NIVEL_CONFIANZA
 
-def get_categorias(cuenta_id):
-    conn = sqlite3.connect('finanzas.db')
+# `hoy` forma parte de la clave de la caché: al cambiar de mes no se
+# sirven los totales del anterior
+@cacheado()
+def get_categorias(cuenta_id, hoy):
     query = """
     SELECT 
         c.id,
         c.nombre,
         c.presupuesto_mensual,
-        COALESCE(SUM(g.cantidad), 0) as gasto_actual
+        COALESCE(SUM(gm.total_centimos), 0) / 100.0 as gasto_actual
     FROM categorias c
-    LEFT JOIN gastos g ON c.id = g.categoria_id 
-        AND strftime('%Y-%m', g.fecha) = strftime('%Y-%m', 'now')
+    LEFT JOIN gastos_mensuales gm ON gm.cuenta_id = c.cuenta_id
+        AND gm.categoria_id = c.id
+        AND gm.mes = ?
     WHERE c.cuenta_id = ?
     GROUP BY c.id, c.nombre, c.presupuesto_mensual
     ORDER BY c.nombre
     """
-    df = pd.read_sql_query(query, conn, params=(cuenta_id,))
-    conn.close()
-    return df
+    return leer_df(query, (clave_mes(hoy.year, hoy.month), cuenta_id))
 
 def crear_categoria(nombre, presupuesto, cuenta_id):
     try:
-        conn = sqlite3.connect('finanzas.db')
-        c = conn.cursor()
-        c.execute(
-            "INSERT INTO categorias (nombre, presupuesto_mensual, cuenta_id) VALUES (?, ?, ?)",
-            (nombre, presupuesto, cuenta_id)
-        )
-        conn.commit()
-        conn.close()
+        with transaccion() as conn:
+            conn.execute(
+                "INSERT INTO categorias (nombre, presupuesto_mensual, cuenta_id) VALUES (?, ?, ?)",
+                (nombre, presupuesto, cuenta_id)
+            )
+        invalidar_cuenta(cuenta_id)
         return True
-    except sqlite3.Error:
+    except ErrorBaseDatos:
         return False
 
 def actualizar_categoria(categoria_id, nombre, presupuesto):
     try:
-        conn = sqlite3.connect('finanzas.db')
-        c = conn.cursor()
-        c.execute(
-            "UPDATE categorias SET nombre = ?, presupuesto_mensual = ? WHERE id = ?",
-            (nombre, presupuesto, categoria_id)
-        )
-        conn.commit()
-        conn.close()
+        with transaccion() as conn:
+            fila = conn.execute(
+                "UPDATE categorias SET nombre = ?, presupuesto_mensual = ? WHERE id = ? RETURNING cuenta_id",
+                (nombre, presupuesto, int(categoria_id))
+            ).fetchone()
+        if fila:
+            invalidar_cuenta(fila['cuenta_id'])
         return True
-    except sqlite3.Error:
+    except ErrorBaseDatos:
         return False
 
 def eliminar_categoria(categoria_id):
     try:
-        conn = sqlite3.connect('finanzas.db')
-        c = conn.cursor()
-        # Verificar si hay gastos asociados
-        c.execute("SELECT COUNT(*) FROM gastos WHERE categoria_id = ?", (categoria_id,))
-        if c.fetchone()[0] > 0:
-            conn.close()
-            return False, "No se puede eliminar una categoría que tiene gastos asociados"
-        
-        c.execute("DELETE FROM categorias WHERE id = ?", (categoria_id,))
-        conn.commit()
-        conn.close()
+        with transaccion() as conn:
+            c = conn.cursor()
+            # Verificar si hay gastos asociados
+            c.execute("SELECT COUNT(*) FROM gastos WHERE categoria_id = ?", (int(categoria_id),))
+            if c.fetchone()[0] > 0:
+                return False, "No se puede eliminar una categoría que tiene gastos asociados"
+            
+            fila = c.execute(
+                "DELETE FROM categorias WHERE id = ? RETURNING cuenta_id", (int(categoria_id),)
+            ).fetchone()
+        if fila:
+            invalidar_cuenta(fila['cuenta_id'])
         return True, "Categoría eliminada exitosamente"
-    except sqlite3.Error as e:
+    except ErrorBaseDatos as e:
         return False, f"Error al eliminar la categoría: {str(e)}"
 
 def mostrar_contenido_categorias():
@@ -88,7 +89,9 @@ def mostrar_contenido_categorias():
     
     # Mostrar categorías existentes
     st.subheader("Categorías Existentes")
-    categorias = get_categorias(st.session_state.cuenta_actual)
+    hoy = date.today()
+    categorias = get_categorias(st.session_state.cuenta_actual, hoy)
+    prevision = prevision_mes(st.session_state.cuenta_actual, hoy)
     
     if not categorias.empty:
         for _, categoria in categorias.iterrows():
@@ -131,15 +134,28 @@ def mostrar_contenido_categorias():
                 # Mostrar gastos del mes actual
                 gasto_actual = categoria['gasto_actual']
                 presupuesto = categoria['presupuesto_mensual']
+                _, prevista, minimo, maximo = prevision.de_categoria(categoria['id']) or (0, 0, 0, 0)
+                texto_prevision = (
+                    f"**Previsión a fin de mes:** ${prevista / 100:,.2f} "
+                    f"({NIVEL_CONFIANZA:.0%}: ${minimo / 100:,.2f} – ${maximo / 100:,.2f})"
+                )
                 if presupuesto > 0:
                     porcentaje = (gasto_actual / presupuesto) * 100
+                    porcentaje_previsto = (prevista / 100 / presupuesto) * 100
                     color = 'green' if porcentaje < 80 else 'orange' if porcentaje < 100 else 'red'
+                    color_previsto = 'green' if porcentaje_previsto < 80 else 'orange' if porcentaje_previsto < 100 else 'red'
                     st.markdown(f"""
                     **Gastos del mes actual:** ${gasto_actual:,.2f} / ${presupuesto:,.2f}  
                     <span style='color:{color}'>{porcentaje:.1f}% del presupuesto</span>
                     """, unsafe_allow_html=True)
+                    st.progress(min(porcentaje / 100, 1.0))
+                    st.markdown(f"""
+                    {texto_prevision}  
+                    <span style='color:{color_previsto}'>{porcentaje_previsto:.1f}% del presupuesto</span>
+                    """, unsafe_allow_html=True)
                 else:
                     st.write(f"**Gastos del mes actual:** ${gasto_actual:,.2f}")
+                    st.markdown(texto_prevision)
     else:
         st.info("No hay categorías creadas")
 
@@ -1,8 +1,13 @@
+import time
+
 import streamlit as st
-import sqlite3
-import pandas as pd
 import bcrypt
-from database import get_db_connection
+import pandas as pd
+import plotly.express as px
+from database import get_db_connection, transaccion
+from utils import arranque, perfilador, trabajos, trazas
+from utils.cache import invalidar_todo, estadisticas_cache
+from utils.autenticacion import rol_en_cuenta, revocar_sesiones_usuario
 
 # Al inicio del archivo, después de los imports
 TRANSLATIONS = {
@@ -52,7 +57,28 @@ TRANSLATIONS = {
         'usuario_actualizado': 'Usuario actualizado exitosamente',
         'error_actualizar': 'Error al actualizar usuario',
         'usuario_registrado': 'Usuario registrado exitosamente',
-        'error_registrar': 'Error al registrar usuario'
+        'error_registrar': 'Error al registrar usuario',
+        'perfilador': 'Rendimiento',
+        'activar_perfilador': 'Medir los reruns',
+        'perfilador_ayuda': 'Reparte el tiempo de cada rerun entre menú, SQL, datos, gráficos y widgets. Las mediciones son del proceso y se pierden al reiniciarlo.',
+        'sin_muestras': 'Todavía no hay reruns medidos',
+        'tiempos_por_fase': 'Tiempos por página y fase',
+        'histograma_pagina': 'Histograma de una página',
+        'pagina': 'Página',
+        'consultas_sql': 'Consultas SQL más costosas',
+        'consultas_lentas': 'Consultas lentas',
+        'descargar_perfil': 'Descargar mediciones',
+        'descargar_trazas': 'Descargar trazas SQL',
+        'reiniciar_perfil': 'Reiniciar mediciones',
+        'arranque_ms': 'Arranque (ms)',
+        'ultimo_rerun_ms': 'Último rerun (ms)',
+        'trabajos_en_proceso': 'Trabajos en este proceso',
+        'trabajos_segundo_plano': 'Trabajos en segundo plano (últimos 7 días)',
+        'cache_lecturas': 'Caché de lecturas',
+        'cache_entradas': 'Entradas',
+        'cache_aciertos': 'Aciertos',
+        'cache_fallos': 'Fallos',
+        'cache_desalojos': 'Desalojos'
     },
     'en': {
         'configuracion': '⚙️ Settings',
@@ -100,7 +126,28 @@ TRANSLATIONS = {
         'usuario_actualizado': 'User successfully updated',
         'error_actualizar': 'Error updating user',
         'usuario_registrado': 'User successfully registered',
-        'error_registrar': 'Error registering user'
+        'error_registrar': 'Error registering user',
+        'perfilador': 'Performance',
+        'activar_perfilador': 'Measure reruns',
+        'perfilador_ayuda': 'Splits the time of each rerun into menu, SQL, data, charts and widgets. Measurements live in the process and are lost when it restarts.',
+        'sin_muestras': 'No reruns measured yet',
+        'tiempos_por_fase': 'Times by page and phase',
+        'histograma_pagina': 'Histogram of a page',
+        'pagina': 'Page',
+        'consultas_sql': 'Most expensive SQL queries',
+        'consultas_lentas': 'Slow queries',
+        'descargar_perfil': 'Download measurements',
+        'descargar_trazas': 'Download SQL traces',
+        'reiniciar_perfil': 'Reset measurements',
+        'arranque_ms': 'Startup (ms)',
+        'ultimo_rerun_ms': 'Last rerun (ms)',
+        'trabajos_en_proceso': 'Jobs in this process',
+        'trabajos_segundo_plano': 'Background jobs (last 7 days)',
+        'cache_lecturas': 'Read cache',
+        'cache_entradas': 'Entries',
+        'cache_aciertos': 'Hits',
+        'cache_fallos': 'Misses',
+        'cache_desalojos': 'Evictions'
     },
     'de': {
         'configuracion': '⚙️ Einstellungen',
@@ -148,7 +195,28 @@ TRANSLATIONS = {
         'usuario_actualizado': 'Benutzer erfolgreich aktualisiert',
         'error_actualizar': 'Fehler beim Aktualisieren des Benutzers',
         'usuario_registrado': 'Benutzer erfolgreich registriert',
-        'error_registrar': 'Fehler beim Registrieren des Benutzers'
+        'error_registrar': 'Fehler beim Registrieren des Benutzers',
+        'perfilador': 'Leistung',
+        'activar_perfilador': 'Reruns messen',
+        'perfilador_ayuda': 'Teilt die Zeit jedes Reruns in Menü, SQL, Daten, Diagramme und Widgets auf. Die Messungen gehören zum Prozess und gehen bei einem Neustart verloren.',
+        'sin_muestras': 'Noch keine Reruns gemessen',
+        'tiempos_por_fase': 'Zeiten nach Seite und Phase',
+        'histograma_pagina': 'Histogramm einer Seite',
+        'pagina': 'Seite',
+        'consultas_sql': 'Teuerste SQL-Abfragen',
+        'consultas_lentas': 'Langsame Abfragen',
+        'descargar_perfil': 'Messungen herunterladen',
+        'descargar_trazas': 'SQL-Traces herunterladen',
+        'reiniciar_perfil': 'Messungen zurücksetzen',
+        'arranque_ms': 'Start (ms)',
+        'ultimo_rerun_ms': 'Letzter Rerun (ms)',
+        'trabajos_en_proceso': 'Aufträge in diesem Prozess',
+        'trabajos_segundo_plano': 'Hintergrundaufträge (letzte 7 Tage)',
+        'cache_lecturas': 'Lese-Cache',
+        'cache_entradas': 'Einträge',
+        'cache_aciertos': 'Treffer',
+        'cache_fallos': 'Fehlschläge',
+        'cache_desalojos': 'Verdrängungen'
     }
 }
 
@@ -160,89 +228,79 @@ def get_todos_usuarios():
     conn = get_db_connection()
     c = conn.cursor()
     c.execute("SELECT id, nombre, email FROM usuarios ORDER BY nombre")
-    usuarios = c.fetchall()
-    conn.close()
-    return usuarios
+    return c.fetchall()
 
 def eliminar_usuario(user_id):
     if user_id == st.session_state.user_id:
         return False, get_text('no_eliminar_propio')
     
-    conn = get_db_connection()
-    c = conn.cursor()
     try:
-        c.execute("DELETE FROM usuarios WHERE id = ?", (user_id,))
-        conn.commit()
+        with transaccion() as conn:
+            revocar_sesiones_usuario(user_id)
+            conn.execute("DELETE FROM usuarios WHERE id = ?", (user_id,))
+        invalidar_todo()
         return True, get_text('usuario_eliminado')
     except Exception as e:
         return False, f"{get_text('error_eliminar')}: {str(e)}"
-    finally:
-        conn.close()
 
 def actualizar_usuario(user_id, nombre, email, nueva_password=None):
-    conn = get_db_connection()
-    c = conn.cursor()
     try:
-        c.execute("SELECT id FROM usuarios WHERE email = ? AND id != ?", (email, user_id))
-        if c.fetchone():
-            return False, get_text('email_registrado')
-        
-        if nueva_password:
-            hashed = bcrypt.hashpw(nueva_password.encode('utf-8'), bcrypt.gensalt())
-            c.execute(
-                "UPDATE usuarios SET nombre = ?, email = ?, password = ? WHERE id = ?",
-                (nombre, email, hashed, user_id)
-            )
-        else:
-            c.execute(
-                "UPDATE usuarios SET nombre = ?, email = ? WHERE id = ?",
-                (nombre, email, user_id)
-            )
-        conn.commit()
+        with transaccion() as conn:
+            c = conn.cursor()
+            c.execute("SELECT id FROM usuarios WHERE email = ? AND id != ?", (email, user_id))
+            if c.fetchone():
+                return False, get_text('email_registrado')
+            
+            if nueva_password:
+                hashed = bcrypt.hashpw(nueva_password.encode('utf-8'), bcrypt.gensalt())
+                c.execute(
+                    "UPDATE usuarios SET nombre = ?, email = ?, password = ? WHERE id = ?",
+                    (nombre, email, hashed, user_id)
+                )
+                # Cerrar las demás sesiones abiertas con la contraseña anterior
+                revocar_sesiones_usuario(user_id, excepto=st.session_state.get('sesion_token'))
+            else:
+                c.execute(
+                    "UPDATE usuarios SET nombre = ?, email = ? WHERE id = ?",
+                    (nombre, email, user_id)
+                )
+        invalidar_todo()
         return True, get_text('usuario_actualizado')
     except Exception as e:
         return False, f"{get_text('error_actualizar')}: {str(e)}"
-    finally:
-        conn.close()
 
 def get_todas_cuentas():
     conn = get_db_connection()
     c = conn.cursor()
     c.execute("SELECT id, nombre FROM cuentas ORDER BY nombre")
-    cuentas = c.fetchall()
-    conn.close()
-    return cuentas
+    return c.fetchall()
 
 def registrar_usuario_con_cuentas(nombre, email, password, cuentas_acceso):
-    conn = get_db_connection()
-    c = conn.cursor()
     try:
-        c.execute("SELECT 1 FROM usuarios WHERE email = ?", (email,))
-        if c.fetchone():
-            return False, get_text('email_registrado')
-        
-        # Crear usuario
         hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-        c.execute(
-            "INSERT INTO usuarios (nombre, email, password) VALUES (?, ?, ?)",
-            (nombre, email, hashed)
-        )
-        usuario_id = c.lastrowid
-        
-        # Asignar accesos a cuentas
-        for cuenta_id, rol in cuentas_acceso:
-            if cuenta_id and rol:  # Solo si se seleccionó una cuenta y un rol
-                c.execute(
-                    "INSERT INTO usuarios_cuentas (usuario_id, cuenta_id, rol) VALUES (?, ?, ?)",
-                    (usuario_id, cuenta_id, rol)
-                )
-        
-        conn.commit()
+        with transaccion() as conn:
+            c = conn.cursor()
+            c.execute("SELECT 1 FROM usuarios WHERE email = ?", (email,))
+            if c.fetchone():
+                return False, get_text('email_registrado')
+            
+            # Crear usuario
+            usuario_id = c.execute(
+                "INSERT INTO usuarios (nombre, email, password) VALUES (?, ?, ?) RETURNING id",
+                (nombre, email, hashed)
+            ).fetchone()[0]
+            
+            # Asignar accesos a cuentas
+            for cuenta_id, rol in cuentas_acceso:
+                if cuenta_id and rol:  # Solo si se seleccionó una cuenta y un rol
+                    c.execute(
+                        "INSERT INTO usuarios_cuentas (usuario_id, cuenta_id, rol) VALUES (?, ?, ?)",
+                        (usuario_id, cuenta_id, rol)
+                    )
+        invalidar_todo()
         return True, get_text('usuario_registrado')
     except Exception as e:
         return False, f"{get_text('error_registrar')}: {str(e)}"
-    finally:
-        conn.close()
 
 def get_nombre_idioma(codigo):
     nombres = {
@@ -255,12 +313,18 @@ def get_nombre_idioma(codigo):
 def mostrar_contenido_configuracion():
     st.title(get_text('configuracion'))
     
-    tab1, tab2, tab3, tab4 = st.tabs([
+    nombres = [
         get_text('gestion_usuarios'),
         get_text('nuevo_usuario'),
         get_text('mi_cuenta'),
         get_text('idiomas')
-    ])
+    ]
+    # El perfilador solo para los administradores de la cuenta actual
+    es_admin = rol_en_cuenta(st.session_state.user_id, st.session_state.get('cuenta_actual')) == 'admin'
+    if es_admin:
+        nombres.append(get_text('perfilador'))
+    tabs = st.tabs(nombres)
+    tab1, tab2, tab3, tab4 = tabs[:4]
     
     with tab1:
         st.header(get_text('usuarios_registrados'))
@@ -452,4 +516,88 @@ def mostrar_contenido_configuracion():
         if st.button(get_text('guardar')):
             st.session_state.language = idioma
             st.success(get_text('idioma_cambiado'))
-            st.rerun() 
\ No newline at end of file
+            st.rerun() 
+    
+    if es_admin:
+        with tabs[4]:
+            mostrar_perfilador()
+
+def mostrar_perfilador():
+    st.header(get_text('perfilador'))
+    activo = st.toggle(get_text('activar_perfilador'), value=perfilador.ACTIVO, help=get_text('perfilador_ayuda'))
+    if activo != perfilador.ACTIVO:
+        perfilador.activar(activo)
+    
+    col1, col2, col3 = st.columns(3)
+    col1.metric(get_text('arranque_ms'), f"{arranque.tiempos['arranque_ms'] or 0:.0f}")
+    col2.metric(get_text('ultimo_rerun_ms'), f"{arranque.tiempos['ultimo_rerun_ms'] or 0:.0f}")
+    col3.metric(get_text('trabajos_en_proceso'), trabajos.en_este_proceso())
+    
+    paginas = perfilador.paginas()
+    if not paginas:
+        st.info(get_text('sin_muestras'))
+    else:
+        st.subheader(get_text('tiempos_por_fase'))
+        st.dataframe(pd.DataFrame(perfilador.resumen()).round(1), hide_index=True, use_container_width=True)
+        
+        st.subheader(get_text('histograma_pagina'))
+        pagina = st.selectbox(get_text('pagina'), paginas)
+        etiquetas = perfilador.etiquetas_histograma()
+        datos = [
+            {'intervalo': etiqueta, 'fase': nombre, 'reruns': cuenta}
+            for nombre, cuentas in perfilador.histograma(pagina).items()
+            for etiqueta, cuenta in zip(etiquetas, cuentas)
+        ]
+        fig = px.bar(
+            datos, x='intervalo', y='reruns', color='fase', barmode='group',
+            labels={'intervalo': 'ms', 'reruns': 'Reruns', 'fase': ''}
+        )
+        st.plotly_chart(fig, use_container_width=True)
+    
+    consultas = trazas.contadores()[:20]
+    if consultas:
+        st.subheader(get_text('consultas_sql'))
+        st.dataframe(pd.DataFrame(consultas).round(1), hide_index=True, use_container_width=True)
+    
+    cache = estadisticas_cache()
+    lecturas = cache['aciertos'] + cache['fallos']
+    st.subheader(get_text('cache_lecturas'))
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric(get_text('cache_entradas'), f"{cache['entradas']} / {cache['maximo']}")
+    col2.metric(
+        get_text('cache_aciertos'), cache['aciertos'],
+        f"{100 * cache['aciertos'] / lecturas:.0f} %" if lecturas else None, delta_color='off'
+    )
+    col3.metric(get_text('cache_fallos'), cache['fallos'])
+    col4.metric(get_text('cache_desalojos'), cache['desalojos'])
+    
+    metricas = trabajos.metricas(desde=time.time() - 7 * 24 * 3600)
+    if metricas:
+        st.subheader(get_text('trabajos_segundo_plano'))
+        st.dataframe(
+            pd.DataFrame([dict(zip(fila.keys(), fila)) for fila in metricas]).round(2),
+            hide_index=True, use_container_width=True
+        )
+    
+    lentas = trazas.consultas_lentas()
+    if lentas:
+        st.subheader(f"{get_text('consultas_lentas')} (≥ {trazas.UMBRAL_LENTA_MS:.0f} ms)")
+        for entrada in lentas:
+            with st.expander(f"{entrada['ms']:.0f} ms · {entrada['origen']} · {entrada['momento']}"):
+                st.code(entrada['sql'], language='sql')
+                if entrada['plan']:
+                    st.code('\n'.join(entrada['plan']))
+    
+    col1, col2, col3 = st.columns(3)
+    col1.download_button(
+        get_text('descargar_perfil'), perfilador.exportar(),
+        file_name='perfil_reruns.json', mime='application/json'
+    )
+    col2.download_button(
+        get_text('descargar_trazas'), trazas.exportar(),
+        file_name='trazas_sql.json', mime='application/json'
+    )
+    if col3.button(get_text('reiniciar_perfil')):
+        perfilador.reiniciar()
+        trazas.reiniciar()
+        st.rerun()
@@ -1,69 +1,76 @@
 import streamlit as st
-import sqlite3
-import pandas as pd
 from datetime import datetime
 from components.sidebar import show_sidebar
 from translations import get_text
 import calendar
+import logging
 import time
+from database import (
+    get_db_connection, transaccion, leer_df, ErrorBaseDatos, rango_mes, rango_anio,
+    huella_base, siguiente_huella, a_centimos, desde_centimos, fecha_iso, get_pagina_gastos,
+)
+from utils.cache import cacheado, invalidar_cuenta
+from database.models import UMBRAL_ANOMALIA
+from utils.anomalias import anotar, retirar, es_inusual
+from utils.busqueda import buscar_gastos, totales_busqueda
+from utils import trabajos
+from utils.exportacion import exportar_gastos, FORMATOS
 
+_log = logging.getLogger(__name__)
+
+# Tipo de trabajo en segundo plano de las importaciones CSV
+TRABAJO_IMPORTAR = 'importar_csv'
+
+@cacheado()
 def get_categorias(cuenta_id):
-    conn = sqlite3.connect('finanzas.db')
     query = "SELECT id, nombre FROM categorias WHERE cuenta_id = ? ORDER BY nombre"
-    df = pd.read_sql_query(query, conn, params=(cuenta_id,))
-    conn.close()
-    return df
+    return leer_df(query, (cuenta_id,))
 
+@cacheado()
 def get_usuarios_cuenta(cuenta_id):
-    conn = sqlite3.connect('finanzas.db')
     query = """
     SELECT u.id, u.nombre 
     FROM usuarios u
     JOIN usuarios_cuentas uc ON u.id = uc.usuario_id
     WHERE uc.cuenta_id = ?
     """
-    df = pd.read_sql_query(query, conn, params=(cuenta_id,))
-    conn.close()
-    return df
+    return leer_df(query, (cuenta_id,))
 
 def registrar_gasto(cuenta_id, categoria_id, cantidad, lugar, fecha, usuario_id, notas):
-    conn = sqlite3.connect('finanzas.db')
-    c = conn.cursor()
     try:
-        # Imprimir valores para debug
-        print(f"Insertando gasto: {cuenta_id}, {categoria_id}, {cantidad}, {lugar}, {fecha}, {usuario_id}, {notas}")
-        
-        c.execute("""
-            INSERT INTO gastos 
-                (cuenta_id, categoria_id, cantidad, lugar, fecha, usuario_id, notas)
-            VALUES 
-                (?, ?, ?, ?, ?, ?, ?)
-        """, (
-            cuenta_id,
-            int(categoria_id),  # Asegurar que sea entero
-            float(cantidad),    # Asegurar que sea float
-            str(lugar),        # Asegurar que sea string
-            fecha.strftime('%Y-%m-%d'),  # Formatear fecha correctamente
-            int(usuario_id),   # Asegurar que sea entero
-            str(notas) if notas else None  # Manejar notas vacías
-        ))
-        
-        conn.commit()
+        fecha = fecha_iso(fecha)  # Formatear fecha correctamente
+        centimos = a_centimos(cantidad)
+        with transaccion() as conn:
+            huella = siguiente_huella(conn, cuenta_id, huella_base(fecha, lugar, centimos))
+            anomalia = anotar(conn, cuenta_id, categoria_id, lugar, centimos)
+            conn.execute("""
+                INSERT INTO gastos 
+                    (cuenta_id, categoria_id, centimos, lugar, fecha, usuario_id, notas, huella, anomalia)
+                VALUES 
+                    (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (
+                cuenta_id,
+                int(categoria_id),  # Asegurar que sea entero
+                centimos,
+                str(lugar),        # Asegurar que sea string
+                fecha,
+                int(usuario_id),   # Asegurar que sea entero
+                str(notas) if notas else None,  # Manejar notas vacías
+                huella,
+                anomalia
+            ))
+        invalidar_cuenta(cuenta_id)
         return True
-    except sqlite3.Error as e:
-        print(f"Error SQL: {e}")  # Debug
+    except ErrorBaseDatos:
+        _log.exception("No se pudo registrar el gasto en la cuenta %s", cuenta_id)
         return False
-    except Exception as e:
-        print(f"Error general: {e}")  # Debug
+    except Exception:
+        _log.exception("Gasto inválido para la cuenta %s", cuenta_id)
         return False
-    finally:
-        conn.close()
 
 def get_gastos_recientes(cuenta_id, mes=None, anio=None):
-    conn = sqlite3.connect('finanzas.db')
-    
     query = """
-    SELECT g.id, g.cantidad, g.lugar, g.fecha, c.nombre as categoria, 
+    SELECT g.id, g.centimos / 100.0 as cantidad, g.lugar, g.fecha, c.nombre as categoria, 
            u.nombre as usuario, g.notas
     FROM gastos g
     JOIN categorias c ON g.categoria_id = c.id
@@ -74,121 +81,159 @@ def get_gastos_recientes(cuenta_id, mes=None, anio=None):
     params = [cuenta_id]
     
     if mes and anio:
-        query += " AND strftime('%m-%Y', g.fecha) = ?"
-        params.append(f"{mes:02d}-{anio}")
+        query += " AND g.fecha >= ? AND g.fecha < ?"
+        params.extend(rango_mes(anio, mes))
     elif anio:
-        query += " AND strftime('%Y', g.fecha) = ?"
-        params.append(str(anio))
+        query += " AND g.fecha >= ? AND g.fecha < ?"
+        params.extend(rango_anio(anio))
         
     query += " ORDER BY g.fecha DESC"
     
-    df = pd.read_sql_query(query, conn, params=tuple(params))
-    conn.close()
-    return df
+    return leer_df(query, tuple(params))
+
+# Tamaños de página disponibles en el historial
+TAMANOS_PAGINA = (25, 50, 100)
+
+@cacheado()
+def get_totales_historial(cuenta_id, mes=None, solo_inusuales=False):
+    """Número de gastos y total del historial (mes = 'YYYY-MM' o todos)."""
+    if solo_inusuales:
+        # Son pocos: se cuentan sobre el índice parcial de gastos inusuales
+        query = f"""
+            SELECT COUNT(*) as num_gastos, COALESCE(SUM(centimos), 0) as total_centimos
+            FROM gastos
+            WHERE cuenta_id = ? AND anomalia >= {UMBRAL_ANOMALIA}
+        """
+        params = [cuenta_id]
+        if mes:
+            query += " AND fecha >= ? AND fecha < ?"
+            params.extend(rango_mes(int(mes[:4]), int(mes[5:])))
+        fila = get_db_connection().execute(query, params).fetchone()
+        return fila['num_gastos'], desde_centimos(fila['total_centimos'])
+    
+    query = """
+        SELECT COALESCE(SUM(num_gastos), 0) as num_gastos, COALESCE(SUM(total_centimos), 0) as total_centimos
+        FROM gastos_mensuales
+        WHERE cuenta_id = ?
+    """
+    params = [cuenta_id]
+    if mes:
+        query += " AND mes = ?"
+        params.append(mes)
+    fila = get_db_connection().execute(query, params).fetchone()
+    return fila['num_gastos'], desde_centimos(fila['total_centimos'])
+
+@cacheado()
+def get_meses_con_gastos(cuenta_id):
+    return leer_df("""
+        SELECT DISTINCT mes as periodo
+        FROM gastos_mensuales
+        WHERE cuenta_id = ?
+        ORDER BY periodo DESC
+    """, (cuenta_id,))
+
+def mostrar_exportacion(nombre_archivo, clave, exportar):
+    """Botones para descargar en CSV o Parquet; el archivo sólo se genera al pulsarlos.
+
+    `exportar(formato)` devuelve el archivo abierto (ver utils.exportacion).
+    """
+    etiquetas = {'csv': get_text('descargar_csv'), 'parquet': get_text('descargar_parquet')}
+    for columna, formato in zip(st.columns(len(FORMATOS)), FORMATOS):
+        with columna:
+            if st.button(etiquetas[formato], key=f'preparar-{formato}-{clave}'):
+                # Streamlit sirve la descarga desde memoria: aquí se lee el
+                # archivo ya terminado, una sola copia
+                with exportar(formato) as archivo:
+                    datos = archivo.read()
+                st.download_button(
+                    etiquetas[formato],
+                    datos,
+                    f"{nombre_archivo}.{formato}",
+                    FORMATOS[formato],
+                    key=f'download-{formato}-{clave}'
+                )
 
 def importar_gastos_desde_csv(cuenta_id, archivo_csv):
-    try:
-        # Leer el CSV
-        df = pd.read_csv(archivo_csv)
-        
-        conn = sqlite3.connect('finanzas.db')
-        c = conn.cursor()
-        
-        # Obtener gastos existentes para verificar duplicados
-        c.execute("""
-            SELECT fecha, lugar, cantidad 
-            FROM gastos 
-            WHERE cuenta_id = ?
-        """, (cuenta_id,))
-        gastos_existentes = set(map(lambda x: (x[0], x[1].lower(), float(x[2])), c.fetchall()))
-        
-        # Mapeo de categorías existentes
-        c.execute("SELECT id, nombre FROM categorias WHERE cuenta_id = ?", (cuenta_id,))
-        categorias = dict(c.fetchall())
-        categorias_inv = {v.lower(): k for k, v in categorias.items()}
-        
-        gastos_importados = 0
-        errores = 0
-        duplicados = 0
-        
-        for _, row in df.iterrows():
-            try:
-                # Convertir fecha del formato DD/MM/YY a YYYY-MM-DD
-                fecha = datetime.strptime(row['date'], '%d/%m/%y').strftime('%Y-%m-%d')
-                
-                # Verificar si el gasto ya existe
-                gasto_key = (fecha, row['store'].lower(), float(row['amount']))
-                if gasto_key in gastos_existentes:
-                    duplicados += 1
-                    continue
-                
-                # Buscar la categoría
-                categoria_id = categorias_inv.get(row['category'].lower())
-                if not categoria_id:
-                    c.execute(
-                        "INSERT INTO categorias (nombre, cuenta_id) VALUES (?, ?)",
-                        (row['category'], cuenta_id)
-                    )
-                    categoria_id = c.lastrowid
-                    categorias_inv[row['category'].lower()] = categoria_id
-                
-                # Insertar el gasto
-                c.execute("""
-                    INSERT INTO gastos 
-                    (cuenta_id, categoria_id, cantidad, lugar, fecha, usuario_id)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                """, (
-                    cuenta_id,
-                    categoria_id,
-                    float(row['amount']),
-                    row['store'],
-                    fecha,
-                    st.session_state.user_id
-                ))
-                gastos_importados += 1
-                
-            except Exception as e:
-                errores += 1
-                st.error(f"Error en fila {gastos_importados + errores + duplicados}: {str(e)}")
-                continue
-        
-        conn.commit()
-        conn.close()
-        
-        mensaje = f"Se importaron {gastos_importados} gastos nuevos."
-        if duplicados > 0:
-            mensaje += f" Se omitieron {duplicados} gastos duplicados."
-        if errores > 0:
-            mensaje += f" Errores: {errores}"
-            
-        return True, mensaje
-        
-    except Exception as e:
-        return False, f"Error al importar: {str(e)}"
+    """Envía la importación a segundo plano y devuelve el id del trabajo.
+
+    Si la cuenta ya tiene una importación en marcha se devuelve esa.
+    """
+    # pandas sólo se carga cuando de verdad se importa un archivo
+    from utils.importador import importar_en_segundo_plano
+    usuario_id = st.session_state.user_id
+    return trabajos.enviar(
+        TRABAJO_IMPORTAR, cuenta_id, usuario_id,
+        importar_en_segundo_plano, cuenta_id, usuario_id, archivo_csv.getvalue()
+    )
+
+@st.fragment(run_every=1)
+def mostrar_progreso_importacion(trabajo_id):
+    """Barra de progreso que se refresca sola hasta que el trabajo termina."""
+    trabajo = trabajos.obtener(trabajo_id)
+    if trabajo is None or not trabajo.activo:
+        st.rerun()
+    if trabajo.estado == 'pendiente':
+        st.progress(0.0, text=get_text('importacion_en_cola'))
+    else:
+        st.progress(
+            trabajo.fraccion or 0.0,
+            text=get_text('importando').format(hechas=trabajo.hechas, total=trabajo.total or 0)
+        )
+
+def mostrar_resultado_importacion(trabajo):
+    if trabajo.estado == 'terminado':
+        for error in trabajo.resultado['mensajes_error']:
+            st.error(error)
+        st.success(trabajo.resultado['mensaje'])
+    elif trabajo.estado == 'fallido':
+        st.error(get_text('importacion_fallida').format(error=trabajo.error))
+    else:
+        st.warning(get_text('importacion_interrumpida'))
 
 def actualizar_gasto(gasto_id, categoria_id, cantidad, lugar, fecha, notas):
-    conn = sqlite3.connect('finanzas.db')
-    c = conn.cursor()
     try:
-        c.execute("""
-            UPDATE gastos 
-            SET categoria_id = ?, cantidad = ?, lugar = ?, fecha = ?, notas = ?
-            WHERE id = ?
-        """, (
-            int(categoria_id),
-            float(cantidad),
-            str(lugar),
-            fecha.strftime('%Y-%m-%d'),
-            str(notas) if notas else None,
-            gasto_id
-        ))
-        conn.commit()
+        gasto_id = int(gasto_id)
+        fecha = fecha_iso(fecha)
+        centimos = a_centimos(cantidad)
+        with transaccion() as conn:
+            anterior = conn.execute(
+                "SELECT cuenta_id, categoria_id, lugar, centimos, huella, anomalia FROM gastos WHERE id = ?",
+                (gasto_id,)
+            ).fetchone()
+            if anterior is None:
+                return False
+            
+            # Volver a puntuarlo sólo si cambia algo de lo que mira el detector
+            anomalia = anterior['anomalia']
+            if (anterior['categoria_id'], anterior['lugar'], anterior['centimos']) != (int(categoria_id), str(lugar), centimos):
+                retirar(conn, anterior['cuenta_id'], anterior['categoria_id'], anterior['lugar'], anterior['centimos'])
+                anomalia = anotar(conn, anterior['cuenta_id'], categoria_id, lugar, centimos)
+            
+            # Conservar la huella si fecha, lugar y cantidad no cambian
+            base = huella_base(fecha, lugar, centimos)
+            huella = anterior['huella']
+            if not huella or not huella.startswith(base + ':'):
+                huella = siguiente_huella(conn, anterior['cuenta_id'], base, excluir_id=gasto_id)
+            
+            conn.execute("""
+                UPDATE gastos 
+                SET categoria_id = ?, centimos = ?, lugar = ?, fecha = ?, notas = ?, huella = ?, anomalia = ?
+                WHERE id = ?
+            """, (
+                int(categoria_id),
+                centimos,
+                str(lugar),
+                fecha,
+                str(notas) if notas else None,
+                huella,
+                anomalia,
+                gasto_id
+            ))
+        invalidar_cuenta(anterior['cuenta_id'])
         return True
-    except Exception as e:
-        print(f"Error al actualizar gasto: {e}")
+    except Exception:
+        _log.exception("No se pudo actualizar el gasto %s", gasto_id)
         return False
-    finally:
-        conn.close()
 
 def mostrar_contenido_gastos():
     if not st.session_state.cuenta_actual:
@@ -279,15 +324,7 @@ def mostrar_contenido_gastos():
         st.subheader(get_text('historial_gastos'))
         
         # Obtener lista de meses disponibles
-        conn = sqlite3.connect('finanzas.db')
-        meses_df = pd.read_sql_query("""
-            SELECT DISTINCT 
-                strftime('%m', fecha) as mes,
-                strftime('%Y', fecha) as anio
-            FROM gastos
-            WHERE cuenta_id = ?
-            ORDER BY fecha DESC
-        """, conn, params=(st.session_state.cuenta_actual,))
+        meses_df = get_meses_con_gastos(st.session_state.cuenta_actual)
         
         # Crear opciones de meses
         meses_opciones = []
@@ -314,11 +351,10 @@ def mostrar_contenido_gastos():
         }
         
         # Agregar meses disponibles
-        for _, row in meses_df.iterrows():
-            mes_num = int(row['mes'])
-            anio = row['anio']
-            nombre_mes = get_text(meses_keys[mes_num])
-            meses_opciones.append((row['mes'], anio, f"{nombre_mes} {anio}"))
+        for periodo in meses_df['periodo']:
+            anio, mes = periodo.split('-')
+            nombre_mes = get_text(meses_keys[int(mes)])
+            meses_opciones.append((mes, anio, f"{nombre_mes} {anio}"))
         
         # Encontrar índice del mes actual
         mes_actual_idx = 0
@@ -335,37 +371,82 @@ def mostrar_contenido_gastos():
             index=mes_actual_idx
         )
         
-        # Construir la consulta SQL según el mes seleccionado
-        query = """
-            SELECT 
-                g.id,
-                strftime('%d/%m/%Y', g.fecha) as fecha,
-                g.lugar,
-                g.cantidad,
-                c.nombre as categoria,
-                g.notas,
-                u.nombre as usuario,
-                g.categoria_id,
-                date(g.fecha) as fecha_original
-            FROM gastos g
-            JOIN categorias c ON g.categoria_id = c.id
-            JOIN usuarios u ON g.usuario_id = u.id
-            WHERE g.cuenta_id = ?
-        """
-        params = [st.session_state.cuenta_actual]
+        tamano_pagina = st.selectbox(
+            get_text('por_pagina'),
+            options=TAMANOS_PAGINA,
+            key='historial_tamano'
+        )
         
         if mes_seleccionado[0] != "00":  # Si no es "Todos los meses"
-            query += " AND strftime('%m-%Y', g.fecha) = ?"
-            params.append(f"{mes_seleccionado[0]}-{mes_seleccionado[1]}")
+            desde, hasta = rango_mes(mes_seleccionado[1], mes_seleccionado[0])
+            mes_clave = f"{mes_seleccionado[1]}-{mes_seleccionado[0]}"
+        else:
+            desde, hasta, mes_clave = None, None, None
+        
+        solo_inusuales = st.checkbox(get_text('solo_inusuales'), key='historial_inusuales')
+        busqueda = st.text_input(
+            get_text('buscar'),
+            key='historial_busqueda',
+            placeholder=get_text('buscar_ayuda')
+        ).strip()
         
-        query += " ORDER BY g.fecha DESC, g.id DESC"
+        # Pila de cursores de la paginación; se reinicia al cambiar de filtro.
+        # Al buscar el cursor es el id de la última fila
+        filtro = (st.session_state.cuenta_actual, mes_clave, tamano_pagina, solo_inusuales, busqueda)
+        if st.session_state.get('historial_filtro') != filtro:
+            st.session_state.historial_filtro = filtro
+            st.session_state.historial_cursores = [None]
+            st.session_state.historial_editando = None
+        cursores = st.session_state.historial_cursores
         
-        # Obtener y mostrar los gastos
-        gastos_df = pd.read_sql_query(query, conn, params=params)
+        if busqueda:
+            num_gastos, total = totales_busqueda(
+                st.session_state.cuenta_actual, busqueda, desde, hasta, solo_inusuales
+            )
+            gastos, hay_mas = buscar_gastos(
+                st.session_state.cuenta_actual,
+                busqueda,
+                tamano_pagina,
+                desde,
+                hasta,
+                cursores[-1],
+                solo_inusuales
+            )
+        else:
+            num_gastos, total = get_totales_historial(st.session_state.cuenta_actual, mes_clave, solo_inusuales)
+            gastos, hay_mas = get_pagina_gastos(
+                st.session_state.cuenta_actual,
+                tamano_pagina,
+                desde,
+                hasta,
+                cursores[-1],
+                solo_inusuales
+            )
         
-        if not gastos_df.empty:
-            for _, gasto in gastos_df.iterrows():
-                with st.expander(f"📝 {gasto['lugar']} - ${gasto['cantidad']:,.2f} ({gasto['fecha']})"):
+        if gastos:
+            categorias_nombres = categorias['nombre'].tolist()
+            for gasto in gastos:
+                fecha = datetime.strptime(gasto['fecha'][:10], '%Y-%m-%d').date()
+                col1, col2, col3, col4, col5 = st.columns([3, 2, 1, 1, 1])
+                with col1:
+                    st.write(f"**{gasto['lugar']}** - {gasto['categoria']}")
+                    if gasto['notas']:
+                        st.caption(f"💭 {gasto['notas']}")
+                with col2:
+                    st.write(f"👤 {gasto['usuario']}")
+                with col3:
+                    st.write(f"💰 ${gasto['cantidad']:,.2f}")
+                    if es_inusual(gasto['anomalia']):
+                        st.caption(f"⚠️ {get_text('inusual')}")
+                with col4:
+                    st.write(f"📅 {fecha.strftime('%d/%m/%Y')}")
+                with col5:
+                    if st.button("✏️", key=f"editar_historial_{gasto['id']}"):
+                        st.session_state.historial_editando = gasto['id']
+                        st.rerun()
+                
+                # Sólo la fila en edición construye su formulario
+                if st.session_state.historial_editando == gasto['id']:
                     with st.form(f"editar_gasto_{gasto['id']}"):
                         col1, col2 = st.columns(2)
                         
@@ -375,33 +456,28 @@ def mostrar_contenido_gastos():
                                 min_value=0.01,
                                 step=0.01,
                                 format="%.2f",
-                                value=float(gasto['cantidad']),
-                                key=f"cantidad_{gasto['id']}"
+                                value=float(gasto['cantidad'])
                             )
                             nueva_categoria = st.selectbox(
                                 get_text('categoria'),
-                                options=categorias['nombre'].tolist(),
-                                index=categorias['nombre'].tolist().index(gasto['categoria']),
-                                key=f"categoria_{gasto['id']}"
+                                options=categorias_nombres,
+                                index=categorias_nombres.index(gasto['categoria'])
                             )
                         
                         with col2:
                             nuevo_lugar = st.text_input(
                                 get_text('lugar'),
-                                value=gasto['lugar'],
-                                key=f"lugar_{gasto['id']}"
+                                value=gasto['lugar']
                             )
                             nueva_fecha = st.date_input(
                                 get_text('fecha'),
-                                value=pd.to_datetime(gasto['fecha_original']).date(),
-                                key=f"fecha_{gasto['id']}"
+                                value=fecha
                             )
                         
                         nuevas_notas = st.text_area(
                             get_text('notas'),
-                            value=gasto['notas'] if pd.notna(gasto['notas']) else "",
-                            height=100,
-                            key=f"notas_{gasto['id']}"
+                            value=gasto['notas'] or "",
+                            height=100
                         )
                         
                         col1, col2 = st.columns([1,4])
@@ -420,109 +496,84 @@ def mostrar_contenido_gastos():
                                     nuevas_notas
                                 ):
                                     st.success("Gasto actualizado correctamente")
+                                    st.session_state.historial_editando = None
                                     time.sleep(0.5)
                                     st.rerun()
                                 else:
                                     st.error("Error al actualizar el gasto")
+                        with col2:
+                            if st.form_submit_button(get_text('cancelar')):
+                                st.session_state.historial_editando = None
+                                st.rerun()
+                
+                st.markdown("<hr style='margin: 3px 0;'>", unsafe_allow_html=True)
+            
+            # Navegación entre páginas
+            col1, col2, col3 = st.columns([1, 2, 1])
+            with col1:
+                if len(cursores) > 1 and st.button(get_text('pagina_anterior')):
+                    cursores.pop()
+                    st.rerun()
+            with col2:
+                paginas = max(1, -(-num_gastos // tamano_pagina))
+                st.caption(f"{get_text('pagina')} {len(cursores)} / {paginas}")
+            with col3:
+                if hay_mas and st.button(get_text('pagina_siguiente')):
+                    ultimo = gastos[-1]
+                    cursores.append(ultimo['id'] if busqueda else (ultimo['fecha'], ultimo['id']))
+                    st.rerun()
             
             # Mostrar total
-            st.info(f"Total: ${gastos_df['cantidad'].sum():,.2f}")
+            st.info(f"{get_text('total_registros')}: {num_gastos} | Total: ${total:,.2f}")
             
-            # Botón para exportar a CSV
-            csv = gastos_df.to_csv(index=False).encode('utf-8')
-            st.download_button(
-                get_text('descargar_csv'),
-                csv,
-                "gastos.csv",
-                "text/csv",
-                key='download-csv'
+            # La exportación recorre la consulta por bloques y sólo se genera cuando se pide
+            mostrar_exportacion(
+                "gastos", 'historial',
+                lambda formato: exportar_gastos(st.session_state.cuenta_actual, formato, desde, hasta)
             )
+        elif busqueda:
+            st.info(get_text('sin_resultados'))
         else:
             st.info(get_text('sin_gastos'))
-        
-        conn.close()
 
     # Tab para importar CSV
     with tab3:
         st.subheader("Importar gastos desde CSV")
-        with st.form("importar_csv"):
-            st.info("""
-            El archivo CSV debe contener las siguientes columnas:
-            - date (DD/MM/YY)
-            - store (lugar del gasto)
-            - amount (cantidad)
-            - category (categoría)
-            """)
-            
-            archivo_csv = st.file_uploader(
-                "Seleccionar archivo CSV", 
-                type=['csv'],
-                help="El archivo debe estar en formato CSV"
-            )
-            
-            submitted = st.form_submit_button("Importar gastos")
-            if submitted and archivo_csv:
-                try:
-                    df = pd.read_csv(archivo_csv)
-                    gastos_importados = 0
-                    errores = 0
-                    
-                    # Obtener mapeo de categorías existentes
-                    conn = sqlite3.connect('finanzas.db')
-                    c = conn.cursor()
-                    c.execute("SELECT id, nombre FROM categorias WHERE cuenta_id = ?", 
-                            (st.session_state.cuenta_actual,))
-                    categorias = dict(c.fetchall())
-                    categorias_inv = {v.lower(): k for k, v in categorias.items()}
-                    
-                    for _, row in df.iterrows():
-                        try:
-                            # Buscar o crear la categoría
-                            categoria = row['category'].strip()
-                            categoria_id = categorias_inv.get(categoria.lower())
-                            
-                            if not categoria_id:
-                                # Crear nueva categoría
-                                c.execute("""
-                                    INSERT INTO categorias (nombre, cuenta_id) 
-                                    VALUES (?, ?)
-                                """, (categoria, st.session_state.cuenta_actual))
-                                categoria_id = c.lastrowid
-                                categorias_inv[categoria.lower()] = categoria_id
-                            
-                            # Convertir fecha
-                            fecha = datetime.strptime(row['date'], '%d/%m/%y').strftime('%Y-%m-%d')
-                            
-                            # Insertar gasto
-                            c.execute("""
-                                INSERT INTO gastos 
-                                (cuenta_id, categoria_id, cantidad, lugar, fecha, usuario_id)
-                                VALUES (?, ?, ?, ?, ?, ?)
-                            """, (
-                                st.session_state.cuenta_actual,
-                                categoria_id,
-                                float(row['amount']),
-                                row['store'],
-                                fecha,
-                                st.session_state.user_id
-                            ))
-                            gastos_importados += 1
-                            
-                        except Exception as e:
-                            errores += 1
-                            st.error(f"Error en fila {gastos_importados + errores}: {str(e)}")
-                    
-                    conn.commit()
-                    conn.close()
-                    
-                    if gastos_importados > 0:
-                        st.success(f"Se importaron {gastos_importados} gastos exitosamente. Errores: {errores}")
-                        st.rerun()
-                    else:
-                        st.error("No se pudo importar ningún gasto")
-                        
-                except Exception as e:
-                    st.error(f"Error al procesar el archivo: {str(e)}")
+        cuenta_id = st.session_state.cuenta_actual
+        # El trabajo sigue aunque se recargue la página: se recupera por cuenta
+        trabajo_id = st.session_state.get('trabajo_importacion')
+        trabajo = trabajos.obtener(trabajo_id) if trabajo_id else None
+        if trabajo is None or trabajo.cuenta_id != cuenta_id:
+            trabajo = trabajos.trabajo_activo(cuenta_id, TRABAJO_IMPORTAR)
+
+        if trabajo and trabajo.activo:
+            st.session_state.trabajo_importacion = trabajo.id
+            mostrar_progreso_importacion(trabajo.id)
+        else:
+            if trabajo:
+                # El resultado se muestra una vez
+                mostrar_resultado_importacion(trabajo)
+                st.session_state.pop('trabajo_importacion', None)
+
+            with st.form("importar_csv"):
+                st.info("""
+                El archivo CSV debe contener las siguientes columnas:
+                - date (DD/MM/YY)
+                - store (lugar del gasto)
+                - amount (cantidad)
+                - category (categoría)
+                """)
+                
+                archivo_csv = st.file_uploader(
+                    "Seleccionar archivo CSV", 
+                    type=['csv'],
+                    help="El archivo debe estar en formato CSV"
+                )
+                
+                submitted = st.form_submit_button("Importar gastos")
+                if submitted and archivo_csv:
+                    st.session_state.trabajo_importacion = importar_gastos_desde_csv(cuenta_id, archivo_csv)
+                    st.rerun()
 
 if __name__ == "__main__":
     mostrar_contenido_gastos() 
\ No newline at end of file
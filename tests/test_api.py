@@ -0,0 +1,155 @@
+import bcrypt
+import pytest
+from starlette.testclient import TestClient
+
+import api
+import database
+from utils.cache import vaciar_cache
+
+
+@pytest.fixture
+def bd(tmp_path):
+    """Base de datos SQLite nueva con Ana (admin de Casa y de Privada) y Bea (viewer de Casa)."""
+    database.configurar_db(str(tmp_path / 'api.db'))
+    database.initialize_db()
+    vaciar_cache()
+    database.create_user('Ana', 'ana@x.com', bcrypt.hashpw(b'secret1', bcrypt.gensalt()))
+    database.create_user('Bea', 'bea@x.com', bcrypt.hashpw(b'secret2', bcrypt.gensalt()))
+    ana = database.get_user_by_email('ana@x.com')['id']
+    bea = database.get_user_by_email('bea@x.com')['id']
+    casa = database.create_account('Casa', ana)
+    privada = database.create_account('Privada', ana)
+    with database.transaccion() as conn:
+        conn.execute(
+            "INSERT INTO usuarios_cuentas (usuario_id, cuenta_id, rol) VALUES (?, ?, 'viewer')", (bea, casa)
+        )
+    yield {'casa': casa, 'privada': privada}
+    database.cerrar_conexiones()
+
+
+@pytest.fixture
+def cliente(bd):
+    with TestClient(api.app) as cliente:
+        yield cliente
+
+
+def _cabeceras(cliente, email, password):
+    respuesta = cliente.post('/api/sesiones', json={'email': email, 'password': password})
+    assert respuesta.status_code == 201
+    return {'Authorization': f"Bearer {respuesta.json()['token']}"}
+
+
+def _lote(n):
+    return [
+        {
+            'fecha': f'2025-0{1 + i % 6}-{1 + i % 28:02d}',
+            'lugar': f'Tienda {i % 7}',
+            'cantidad': 10 + i * 0.37,
+            'categoria': ['Comida', 'Ocio'][i % 2],
+            'notas': 'ticket' if i % 5 == 0 else None,
+        }
+        for i in range(n)
+    ]
+
+
+def _num_gastos(cuenta_id):
+    return database.get_db_connection().execute(
+        "SELECT COUNT(*) FROM gastos WHERE cuenta_id = ?", (cuenta_id,)
+    ).fetchone()[0]
+
+
+def test_login(cliente):
+    assert cliente.post('/api/sesiones', json={'email': 'ana@x.com', 'password': 'mal'}).status_code == 401
+    assert cliente.get('/api/cuentas').status_code == 401
+
+    respuesta = cliente.post('/api/sesiones', json={'email': 'ana@x.com', 'password': 'secret1'})
+    assert respuesta.status_code == 201
+    assert respuesta.json()['usuario']['nombre'] == 'Ana'
+    cabeceras = {'Authorization': f"Bearer {respuesta.json()['token']}"}
+    cuentas = cliente.get('/api/cuentas', headers=cabeceras).json()['cuentas']
+    assert {(cuenta['nombre'], cuenta['rol']) for cuenta in cuentas} == {('Casa', 'admin'), ('Privada', 'admin')}
+
+    assert cliente.delete('/api/sesiones', headers=cabeceras).status_code == 204
+    assert cliente.get('/api/cuentas', headers=cabeceras).status_code == 401
+
+
+def test_roles(cliente, bd):
+    bea = _cabeceras(cliente, 'bea@x.com', 'secret2')
+    assert cliente.get(f"/api/cuentas/{bd['casa']}/gastos", headers=bea).status_code == 200
+    assert cliente.post(f"/api/cuentas/{bd['casa']}/gastos", json={'gastos': _lote(1)}, headers=bea).status_code == 403
+    assert cliente.get(f"/api/cuentas/{bd['privada']}/gastos", headers=bea).status_code == 404
+    assert cliente.post(f"/api/cuentas/{bd['privada']}/gastos", json={'gastos': _lote(1)}, headers=bea).status_code == 404
+    assert _num_gastos(bd['casa']) == 0
+
+
+def test_lote_invalido_no_inserta_nada(cliente, bd):
+    ana = _cabeceras(cliente, 'ana@x.com', 'secret1')
+    lote = _lote(3) + [
+        {'fecha': '2025-13-01', 'lugar': 'x', 'cantidad': 1, 'categoria': 'a'},
+        {'fecha': '2025-01-01', 'lugar': ' ', 'cantidad': 'nan', 'categoria': 'a'},
+    ]
+    respuesta = cliente.post(f"/api/cuentas/{bd['casa']}/gastos", json={'gastos': lote}, headers=ana)
+    assert respuesta.status_code == 422
+    assert [error['posicion'] for error in respuesta.json()['errores']] == [3, 4]
+    assert _num_gastos(bd['casa']) == 0
+
+
+def test_reenviar_lote_no_duplica(cliente, bd):
+    ana = _cabeceras(cliente, 'ana@x.com', 'secret1')
+    lote = _lote(120)
+    respuesta = cliente.post(f"/api/cuentas/{bd['casa']}/gastos", json={'gastos': lote}, headers=ana)
+    assert respuesta.status_code == 201
+    assert respuesta.json() == {'importados': 120, 'duplicados': 0}
+
+    respuesta = cliente.post(f"/api/cuentas/{bd['casa']}/gastos", json={'gastos': lote}, headers=ana)
+    assert respuesta.status_code == 200
+    assert respuesta.json() == {'importados': 0, 'duplicados': 120}
+    assert _num_gastos(bd['casa']) == 120
+
+
+def test_paginacion(cliente, bd):
+    ana = _cabeceras(cliente, 'ana@x.com', 'secret1')
+    cliente.post(f"/api/cuentas/{bd['casa']}/gastos", json={'gastos': _lote(150)}, headers=ana)
+
+    vistos, despues = [], None
+    while True:
+        parametros = {'limite': 40} | ({'despues': despues} if despues else {})
+        pagina = cliente.get(f"/api/cuentas/{bd['casa']}/gastos", params=parametros, headers=ana).json()
+        assert len(pagina['gastos']) <= 40
+        vistos += pagina['gastos']
+        despues = pagina['siguiente']
+        if despues is None:
+            break
+    assert len(vistos) == 150
+    assert len({gasto['id'] for gasto in vistos}) == 150
+    claves = [(gasto['fecha'], gasto['id']) for gasto in vistos]
+    assert claves == sorted(claves, reverse=True)
+
+    assert cliente.get(f"/api/cuentas/{bd['casa']}/gastos", params={'despues': 'x'}, headers=ana).status_code == 400
+    assert cliente.get(f"/api/cuentas/{bd['casa']}/gastos", params={'limite': 0}, headers=ana).status_code == 400
+    for fecha in ('2025-01-01xyz', '2025-02-30', '20250101', 'ayer'):
+        assert cliente.get(f"/api/cuentas/{bd['casa']}/gastos", params={'desde': fecha}, headers=ana).status_code == 400
+    marzo = cliente.get(
+        f"/api/cuentas/{bd['casa']}/gastos", params={'desde': '2025-03-01', 'hasta': '2025-04-01', 'limite': 500}, headers=ana
+    ).json()['gastos']
+    assert marzo and {gasto['fecha'][:7] for gasto in marzo} == {'2025-03'}
+
+
+def test_cuerpo_demasiado_grande(cliente, bd, monkeypatch):
+    monkeypatch.setattr(api, 'MAX_BYTES_CUERPO', 1000)
+    ana = _cabeceras(cliente, 'ana@x.com', 'secret1')
+    url = f"/api/cuentas/{bd['casa']}/gastos"
+
+    respuesta = cliente.post(url, content=b'{}', headers=ana | {'content-length': 'mucho'})
+    assert respuesta.status_code == 400
+
+    # Sin content-length (chunked): se corta al pasar del límite mientras se lee
+    def por_bloques():
+        yield b'{"gastos": ['
+        for _ in range(50):
+            yield b'{"fecha": "2025-01-01", "lugar": "x", "cantidad": 1, "categoria": "a"},'
+        yield b'{"fecha": "2025-01-01", "lugar": "x", "cantidad": 1, "categoria": "a"}]}'
+
+    respuesta = cliente.post(url, content=por_bloques(), headers=ana)
+    assert respuesta.status_code == 413
+    assert _num_gastos(bd['casa']) == 0
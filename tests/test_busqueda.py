@@ -0,0 +1,62 @@
+import pytest
+
+import database
+from utils.busqueda import buscar_gastos, totales_busqueda
+from utils.cache import vaciar_cache
+
+
+@pytest.fixture
+def cuenta(tmp_path):
+    """Cuenta con 600 gastos en 'Farmacia Núñez' y 100 en 'Mercado'."""
+    database.configurar_db(str(tmp_path / 'busqueda.db'))
+    database.initialize_db()
+    vaciar_cache()
+    database.create_user('Ana', 'ana@x.com', b'hash')
+    usuario_id = database.get_user_by_email('ana@x.com')['id']
+    cuenta_id = database.create_account('Casa', usuario_id)
+    with database.transaccion() as conn:
+        categoria_id = conn.execute(
+            "INSERT INTO categorias (nombre, cuenta_id) VALUES ('Salud', ?) RETURNING id", (cuenta_id,)
+        ).fetchone()[0]
+        conn.executemany('''
+            INSERT INTO gastos (cuenta_id, categoria_id, centimos, lugar, fecha, usuario_id, notas)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [
+            (cuenta_id, categoria_id, 100 + i, 'Farmacia Núñez' if i % 7 else 'Mercado',
+             f'20{20 + i // 120:02d}-{1 + i % 12:02d}-01', usuario_id, 'receta_urgente' if i == 3 else None)
+            for i in range(700)
+        ])
+    yield cuenta_id
+    database.cerrar_conexiones()
+
+
+def _todas(cuenta_id, texto, tamano, **filtros):
+    filas, despues_de = [], None
+    while True:
+        pagina, hay_mas = buscar_gastos(cuenta_id, texto, tamano, despues_de=despues_de, **filtros)
+        filas += pagina
+        if not hay_mas:
+            return filas
+        despues_de = pagina[-1]['id']
+
+
+def test_pagina_todas_las_coincidencias(cuenta):
+    filas = _todas(cuenta, 'farmacia nuñ', 50)
+    assert len(filas) == 600
+    ids = [fila['id'] for fila in filas]
+    assert ids == sorted(ids, reverse=True)
+    assert len(set(ids)) == 600
+
+    num_gastos, total = totales_busqueda(cuenta, 'farmacia nuñ')
+    assert num_gastos == 600
+    assert total == pytest.approx(sum(fila['cantidad'] for fila in filas))
+
+
+def test_filtros_y_busquedas_vacias(cuenta):
+    filas = _todas(cuenta, 'mercado', 30, desde='2020-01-01', hasta='2021-01-01')
+    assert {fila['fecha'][:4] for fila in filas} == {'2020'}
+    assert totales_busqueda(cuenta, 'mercado', '2020-01-01', '2021-01-01')[0] == len(filas)
+
+    assert buscar_gastos(cuenta, 'urgente', 10)[0][0]['notas'] == 'receta_urgente'
+    assert buscar_gastos(cuenta, '___', 10) == ([], False)
+    assert totales_busqueda(cuenta, '___') == (0, 0.0)
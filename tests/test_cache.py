@@ -0,0 +1,91 @@
+import sqlite3
+from datetime import date
+
+import pytest
+
+import database
+from utils.cache import cacheado, invalidar_cuenta, vaciar_cache
+
+
+@pytest.fixture
+def bd(tmp_path, monkeypatch):
+    """Base SQLite nueva con dos cuentas de Ana, cada una con una categoría."""
+    ruta = str(tmp_path / 'cache.db')
+    database.configurar_db(ruta)
+    database.initialize_db()
+    vaciar_cache()
+    monkeypatch.setattr(database, '_firmas_vistas', {})
+    database.create_user('Ana', 'ana@x.com', b'hash')
+    usuario_id = database.get_user_by_email('ana@x.com')['id']
+    cuentas = [database.create_account(nombre, usuario_id) for nombre in ('Casa', 'Viajes')]
+    with database.transaccion() as conn:
+        for cuenta_id in cuentas:
+            conn.execute("INSERT INTO categorias (nombre, cuenta_id) VALUES ('Comida', ?)", (cuenta_id,))
+    yield {'ruta': ruta, 'usuario_id': usuario_id, 'cuentas': cuentas}
+    database.cerrar_conexiones()
+
+
+def _insertar_gasto(conn, cuenta_id, usuario_id, centimos, fecha):
+    conn.execute('''
+        INSERT INTO gastos (cuenta_id, categoria_id, centimos, lugar, fecha, usuario_id)
+        SELECT ?, id, ?, 'x', ?, ? FROM categorias WHERE cuenta_id = ?
+    ''', (cuenta_id, centimos, fecha, usuario_id, cuenta_id))
+
+
+def test_invalidar_cuenta_solo_afecta_a_esa_cuenta(bd):
+    llamadas = []
+
+    @cacheado()
+    def leer(cuenta_id):
+        llamadas.append(cuenta_id)
+        return len(llamadas)
+
+    casa, viajes = bd['cuentas']
+    assert (leer(casa), leer(viajes)) == (1, 2)
+    assert (leer(casa), leer(viajes)) == (1, 2)
+
+    invalidar_cuenta(casa)
+    assert (leer(casa), leer(viajes)) == (3, 2)
+    assert llamadas == [casa, viajes, casa]
+
+
+def test_detectar_cambios_externos(bd, monkeypatch):
+    monkeypatch.setattr(database, 'CAMBIOS_EXTERNOS_TTL', 0)
+    casa, viajes = bd['cuentas']
+
+    @cacheado()
+    def total(cuenta_id):
+        return database.get_db_connection().execute(
+            "SELECT COALESCE(SUM(centimos), 0) FROM gastos WHERE cuenta_id = ?", (cuenta_id,)
+        ).fetchone()[0]
+
+    database.detectar_cambios_externos(casa)
+    database.detectar_cambios_externos(viajes)
+    assert (total(casa), total(viajes)) == (0, 0)
+
+    # Otro proceso escribe sin pasar por invalidar_cuenta()
+    externa = sqlite3.connect(bd['ruta'])
+    with externa:
+        _insertar_gasto(externa, casa, bd['usuario_id'], 500, '2025-01-10')
+    externa.close()
+    assert total(casa) == 0
+
+    database.detectar_cambios_externos(casa)
+    database.detectar_cambios_externos(viajes)
+    assert (total(casa), total(viajes)) == (500, 0)
+
+
+def test_totales_del_mes_dependen_del_dia(bd):
+    from pages.analisis import get_gastos_mes
+    from pages.categorias import get_categorias
+
+    casa = bd['cuentas'][0]
+    with database.transaccion() as conn:
+        _insertar_gasto(conn, casa, bd['usuario_id'], 1200, '2025-01-15')
+    invalidar_cuenta(casa)
+
+    # Sin escrituras entre medias: sólo cambia el día que se pasa
+    assert get_categorias(casa, date(2025, 1, 31))['gasto_actual'].tolist() == [12.0]
+    assert get_categorias(casa, date(2025, 2, 1))['gasto_actual'].tolist() == [0.0]
+    assert get_gastos_mes(casa, 1, 2025)['total_gastado'].tolist() == [12.0]
+    assert get_gastos_mes(casa, 2, 2025)['total_gastado'].tolist() == [0.0]
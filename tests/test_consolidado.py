@@ -0,0 +1,54 @@
+import pytest
+
+import database
+from pages.analisis import get_consolidado_mes, get_evolucion_consolidada, _etiquetas_cuentas
+from utils.cache import invalidar_cuenta, vaciar_cache, versiones_cuentas
+
+
+@pytest.fixture
+def cuentas(tmp_path):
+    """Ana con dos cuentas que se llaman igual, cada una con 10 € en enero."""
+    database.configurar_db(str(tmp_path / 'consolidado.db'))
+    database.initialize_db()
+    vaciar_cache()
+    database.create_user('Ana', 'ana@x.com', b'hash')
+    usuario_id = database.get_user_by_email('ana@x.com')['id']
+    ids = [database.create_account('Casa', usuario_id) for _ in range(2)]
+    with database.transaccion() as conn:
+        for cuenta_id in ids:
+            categoria_id = conn.execute(
+                "INSERT INTO categorias (nombre, cuenta_id) VALUES ('Comida', ?) RETURNING id", (cuenta_id,)
+            ).fetchone()[0]
+            conn.execute('''
+                INSERT INTO gastos (cuenta_id, categoria_id, centimos, lugar, fecha, usuario_id)
+                VALUES (?, ?, 1000, 'x', '2025-01-10', ?)
+            ''', (cuenta_id, categoria_id, usuario_id))
+    yield usuario_id, ids
+    database.cerrar_conexiones()
+
+
+def test_cuentas_con_el_mismo_nombre_no_se_suman(cuentas):
+    usuario_id, ids = cuentas
+    resumen = get_consolidado_mes(usuario_id, '2025-01', versiones_cuentas(ids))
+    assert sorted(resumen['cuenta_id']) == sorted(ids)
+    etiquetas = _etiquetas_cuentas(resumen.drop_duplicates('cuenta_id'))
+    assert len(set(etiquetas.values())) == 2
+    assert all(etiqueta.startswith('Casa (#') for etiqueta in etiquetas.values())
+
+    evolucion = get_evolucion_consolidada(usuario_id, 2025, versiones_cuentas(ids))
+    assert sorted(evolucion['total_centimos']) == [1000, 1000]
+
+
+def test_la_cache_sigue_las_versiones_de_cada_cuenta(cuentas):
+    usuario_id, ids = cuentas
+    antes = get_consolidado_mes(usuario_id, '2025-01', versiones_cuentas(ids))
+    assert antes['total_centimos'].sum() == 2000
+
+    with database.transaccion() as conn:
+        conn.execute("UPDATE gastos SET centimos = 5000 WHERE cuenta_id = ?", (ids[1],))
+    # Sin invalidar, la misma clave devuelve lo cacheado
+    assert get_consolidado_mes(usuario_id, '2025-01', versiones_cuentas(ids)) is antes
+
+    invalidar_cuenta(ids[1])
+    despues = get_consolidado_mes(usuario_id, '2025-01', versiones_cuentas(ids))
+    assert despues['total_centimos'].sum() == 6000
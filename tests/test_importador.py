@@ -0,0 +1,92 @@
+import io
+import sqlite3
+
+import pytest
+
+import database
+from utils.cache import vaciar_cache
+from utils.importador import importar_csv
+
+
+@pytest.fixture
+def cuenta(tmp_path):
+    ruta = str(tmp_path / 'importador.db')
+    database.configurar_db(ruta)
+    database.initialize_db()
+    vaciar_cache()
+    database.create_user('Ana', 'ana@x.com', b'hash')
+    usuario_id = database.get_user_by_email('ana@x.com')['id']
+    cuenta_id = database.create_account('Casa', usuario_id)
+    yield {'ruta': ruta, 'usuario_id': usuario_id, 'cuenta_id': cuenta_id}
+    database.cerrar_conexiones()
+
+
+def _csv(filas):
+    lineas = ['date,store,amount,category']
+    lineas += [f'{1 + i % 28:02d}/01/25,Tienda {i},{i}.50,Comida' for i in range(filas)]
+    return io.BytesIO('\n'.join(lineas).encode('utf-8'))
+
+
+def _num_gastos(cuenta_id):
+    return database.get_db_connection().execute(
+        "SELECT COUNT(*) FROM gastos WHERE cuenta_id = ?", (cuenta_id,)
+    ).fetchone()[0]
+
+
+def test_otros_escriben_entre_bloques(cuenta):
+    escrituras = []
+
+    def progreso(filas):
+        # Otra conexión que no espera al bloqueo: falla si la importación lo retiene
+        otra = sqlite3.connect(cuenta['ruta'], timeout=0)
+        with otra:
+            otra.execute("UPDATE cuentas SET nombre = ? WHERE id = ?", (f'Casa {filas}', cuenta['cuenta_id']))
+        otra.close()
+        escrituras.append(filas)
+
+    resultado = importar_csv(cuenta['cuenta_id'], cuenta['usuario_id'], _csv(250), tamano_bloque=100, progreso=progreso)
+    assert escrituras == [100, 200, 250]
+    assert (resultado.importados, resultado.duplicados, resultado.errores) == (250, 0, 0)
+    assert _num_gastos(cuenta['cuenta_id']) == 250
+
+
+def test_reimportar_tras_un_corte_no_duplica(cuenta):
+    def cortar(filas):
+        if filas == 200:
+            raise RuntimeError("corte")
+
+    with pytest.raises(RuntimeError):
+        importar_csv(cuenta['cuenta_id'], cuenta['usuario_id'], _csv(250), tamano_bloque=100, progreso=cortar)
+    # Los bloques confirmados se quedan
+    assert _num_gastos(cuenta['cuenta_id']) == 200
+
+    resultado = importar_csv(cuenta['cuenta_id'], cuenta['usuario_id'], _csv(250), tamano_bloque=100)
+    assert (resultado.importados, resultado.duplicados) == (50, 200)
+    assert _num_gastos(cuenta['cuenta_id']) == 250
+    estadisticas = database.get_db_connection().execute(
+        "SELECT n FROM estadisticas_gastos WHERE cuenta_id = ? AND ambito = 'categoria'", (cuenta['cuenta_id'],)
+    ).fetchone()[0]
+    assert estadisticas == 250
+
+
+def test_redondeo_de_importes(cuenta):
+    csv = io.BytesIO('\n'.join([
+        'date,store,amount,category',
+        '01/01/25,A,1.005,Comida',
+        '02/01/25,B, 0.29 ,Comida',
+        '03/01/25,C,1e2,Comida',
+        '04/01/25,D,0.125,Comida',
+        '05/01/25,E,doce,Comida',
+        '06/01/25,F,99999999999999999999,Comida',
+    ]).encode('utf-8'))
+    resultado = importar_csv(cuenta['cuenta_id'], cuenta['usuario_id'], csv)
+    assert (resultado.importados, resultado.errores) == (4, 2)
+    centimos = database.get_db_connection().execute(
+        "SELECT lugar, centimos FROM gastos WHERE cuenta_id = ? ORDER BY lugar", (cuenta['cuenta_id'],)
+    ).fetchall()
+    assert [tuple(fila) for fila in centimos] == [('A', 101), ('B', 29), ('C', 10000), ('D', 13)]
+
+
+def test_archivo_vacio(cuenta):
+    with pytest.raises(ValueError, match="vacío"):
+        importar_csv(cuenta['cuenta_id'], cuenta['usuario_id'], io.BytesIO(b''))
@@ -0,0 +1,194 @@
+"""Backend PostgreSQL contra un servidor temporal que arranca la propia prueba.
+
+Hace falta psycopg2, SQLAlchemy y los binarios initdb y pg_ctl, en el PATH o
+en el directorio de PG_BIN; sin ellos las pruebas se saltan. initdb no se
+puede ejecutar como root.
+"""
+import os
+import shutil
+import socket
+import subprocess
+
+import pytest
+
+import database
+from database.migrate import MIGRACIONES, migrar
+from utils.cache import vaciar_cache
+from utils.importador import normalizar_registros, importar_registros
+
+pytest.importorskip('psycopg2')
+pytest.importorskip('sqlalchemy')
+
+
+def _binario(nombre):
+    directorio = os.environ.get('PG_BIN')
+    if directorio:
+        ruta = os.path.join(directorio, nombre)
+        return ruta if os.access(ruta, os.X_OK) else None
+    return shutil.which(nombre)
+
+
+def _puerto_libre():
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture(scope='module')
+def servidor(tmp_path_factory):
+    """URL de un servidor PostgreSQL recién creado, que se para al terminar."""
+    initdb, pg_ctl = _binario('initdb'), _binario('pg_ctl')
+    if not initdb or not pg_ctl:
+        pytest.skip("Faltan initdb y pg_ctl (PATH o PG_BIN)")
+    if hasattr(os, 'geteuid') and os.geteuid() == 0:
+        pytest.skip("initdb no se puede ejecutar como root")
+
+    base = tmp_path_factory.mktemp('postgres')
+    datos, puerto = base / 'datos', _puerto_libre()
+    subprocess.run(
+        [initdb, '-D', str(datos), '-U', 'postgres', '-A', 'trust', '-E', 'UTF8', '--locale=C.UTF-8'],
+        check=True, capture_output=True,
+    )
+    subprocess.run([
+        pg_ctl, '-D', str(datos), '-l', str(base / 'postgres.log'), '-w',
+        '-o', f"-p {puerto} -k {base} -c listen_addresses=localhost", 'start',
+    ], check=True, capture_output=True)
+    try:
+        yield f"postgresql://postgres@localhost:{puerto}/postgres"
+    finally:
+        database.cerrar_conexiones()
+        subprocess.run([pg_ctl, '-D', str(datos), '-m', 'immediate', 'stop'], capture_output=True)
+
+
+@pytest.fixture(scope='module')
+def bd(servidor):
+    """Esquema migrado, con Ana y su cuenta Casa (categorías Comida y Ocio)."""
+    database.configurar_db(servidor)
+    vaciar_cache()
+    versiones = migrar(informar=lambda mensaje: None)
+    database.create_user('Ana', 'ana@x.com', b'hash')
+    usuario_id = database.get_user_by_email('ana@x.com')['id']
+    cuenta_id = database.create_account('Casa', usuario_id)
+    with database.transaccion() as conn:
+        categorias = [
+            conn.execute(
+                "INSERT INTO categorias (nombre, cuenta_id) VALUES (?, ?) RETURNING id", (nombre, cuenta_id)
+            ).fetchone()[0]
+            for nombre in ('Comida', 'Ocio')
+        ]
+    yield {'versiones': versiones, 'usuario_id': usuario_id, 'cuenta_id': cuenta_id, 'categorias': categorias}
+    database.cerrar_conexiones()
+
+
+def _resumen(cuenta_id):
+    filas = database.get_db_connection().execute('''
+        SELECT categoria_id, mes, total_centimos, num_gastos, minimo_centimos, maximo_centimos
+        FROM gastos_mensuales WHERE cuenta_id = ? ORDER BY categoria_id, mes
+    ''', (cuenta_id,)).fetchall()
+    return [tuple(fila) for fila in filas]
+
+
+def test_migrar(bd):
+    assert database.dialecto() == 'postgresql'
+    assert bd['versiones'] == [paso.version for paso in MIGRACIONES]
+    # Con el esquema al día no hace nada
+    assert migrar(informar=lambda mensaje: None) == []
+    conn = database.get_db_connection()
+    assert conn.execute("SELECT MAX(version) FROM schema_version").fetchone()[0] == MIGRACIONES[-1].version
+    assert database.get_backend().existe_indice(conn, 'idx_gastos_cuenta_huella')
+
+
+def test_triggers_gastos_mensuales(bd):
+    cuenta_id, (comida, ocio) = bd['cuenta_id'], bd['categorias']
+    with database.transaccion() as conn:
+        ids = [
+            conn.execute('''
+                INSERT INTO gastos (cuenta_id, categoria_id, centimos, lugar, fecha, usuario_id)
+                VALUES (?, ?, ?, 'x', ?, ?) RETURNING id
+            ''', (cuenta_id, comida, centimos, fecha, bd['usuario_id'])).fetchone()[0]
+            for centimos, fecha in ((1000, '2024-01-05'), (250, '2024-01-20'), (4000, '2024-02-01'))
+        ]
+    assert _resumen(cuenta_id) == [
+        (comida, '2024-01', 1250, 2, 250, 1000),
+        (comida, '2024-02', 4000, 1, 4000, 4000),
+    ]
+
+    with database.transaccion() as conn:
+        # Cambio de importe, de mes y de categoría, y un borrado
+        conn.execute("UPDATE gastos SET centimos = 300 WHERE id = ?", (ids[1],))
+        conn.execute("UPDATE gastos SET fecha = '2024-01-31', categoria_id = ? WHERE id = ?", (ocio, ids[2]))
+        conn.execute("DELETE FROM gastos WHERE id = ?", (ids[0],))
+    esperado = _resumen(cuenta_id)
+    assert esperado == [
+        (comida, '2024-01', 300, 1, 300, 300),
+        (ocio, '2024-01', 4000, 1, 4000, 4000),
+    ]
+    # Los triggers dejan lo mismo que recalcular desde gastos
+    database.reconstruir_resumen_mensual(cuenta_id)
+    assert _resumen(cuenta_id) == esperado
+
+    with database.transaccion() as conn:
+        conn.execute("DELETE FROM gastos WHERE cuenta_id = ?", (cuenta_id,))
+    assert _resumen(cuenta_id) == []
+
+
+def test_huella_descarta_duplicados(bd):
+    cuenta_id, usuario_id = bd['cuenta_id'], bd['usuario_id']
+    registros = [
+        {'fecha': '2024-03-01', 'lugar': 'Mercado', 'cantidad': '12.50', 'categoria': 'Comida'},
+        {'fecha': '2024-03-01', 'lugar': 'Mercado', 'cantidad': '12.50', 'categoria': 'Comida'},
+        {'fecha': '2024-03-02', 'lugar': 'Cine', 'cantidad': 8, 'categoria': 'Ocio', 'notas': 'estreno'},
+    ]
+    validos, errores = normalizar_registros(registros)
+    assert errores == []
+
+    primero = importar_registros(cuenta_id, usuario_id, validos)
+    assert (primero.importados, primero.duplicados) == (3, 0)
+    segundo = importar_registros(cuenta_id, usuario_id, validos)
+    assert (segundo.importados, segundo.duplicados) == (0, 3)
+
+    # El índice único responde también cuando la huella no se filtró antes
+    with database.transaccion() as conn:
+        huella = conn.execute(
+            "SELECT huella FROM gastos WHERE cuenta_id = ? AND lugar = 'Cine'", (cuenta_id,)
+        ).fetchone()[0]
+        cursor = conn.execute('''
+            INSERT INTO gastos (cuenta_id, categoria_id, centimos, lugar, fecha, usuario_id, huella)
+            VALUES (?, ?, 800, 'Cine', '2024-03-02', ?, ?)
+            ON CONFLICT (cuenta_id, huella) DO NOTHING
+        ''', (cuenta_id, bd['categorias'][1], usuario_id, huella))
+        assert cursor.rowcount == 0
+    assert database.get_db_connection().execute(
+        "SELECT COUNT(*) FROM gastos WHERE cuenta_id = ?", (cuenta_id,)
+    ).fetchone()[0] == 3
+
+    with database.transaccion() as conn:
+        conn.execute("DELETE FROM gastos WHERE cuenta_id = ?", (cuenta_id,))
+
+
+def test_paginacion_por_clave(bd):
+    cuenta_id, usuario_id = bd['cuenta_id'], bd['usuario_id']
+    with database.transaccion() as conn:
+        conn.executemany('''
+            INSERT INTO gastos (cuenta_id, categoria_id, centimos, lugar, fecha, usuario_id)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', [
+            (cuenta_id, bd['categorias'][i % 2], 100 + i, f'Tienda {i}', f'2024-05-{1 + i % 10:02d}', usuario_id)
+            for i in range(57)
+        ])
+
+    vistos, despues_de = [], None
+    while True:
+        filas, hay_mas = database.get_pagina_gastos(cuenta_id, 10, despues_de=despues_de)
+        vistos += [(fila['fecha'], fila['id']) for fila in filas]
+        if not hay_mas:
+            break
+        despues_de = vistos[-1]
+    assert len(vistos) == 57
+    assert vistos == sorted(vistos, reverse=True)
+    assert len(set(vistos)) == 57
+
+    filas, hay_mas = database.get_pagina_gastos(cuenta_id, 100, '2024-05-03', '2024-05-05')
+    assert not hay_mas
+    assert {fila['fecha'] for fila in filas} == {'2024-05-03', '2024-05-04'}
+    assert all(isinstance(fila['cantidad'], float) for fila in filas)
@@ -58,6 +58,10 @@ TRANSLATIONS = {
         'eliminar_gasto': 'Eliminar Gasto',
         'confirmar_eliminar': '¿Está seguro de eliminar este gasto?',
         'ingrese_lugar': 'Por favor ingrese el lugar del gasto',
+        'por_pagina': 'Gastos por página',
+        'pagina': 'Página',
+        'pagina_anterior': '⬅️ Anterior',
+        'pagina_siguiente': 'Siguiente ➡️',
         
         # Categorías
         'gestion_categorias': '📑 Gestión de Categorías',
@@ -87,6 +91,25 @@ TRANSLATIONS = {
         'comparativa_presupuesto': 'Comparativa con Presupuesto',
         'tendencia_gastos': 'Tendencia de Gastos',
         'sin_datos_tendencia': 'No hay suficientes datos para mostrar tendencias',
+        'periodo': 'Periodo',
+        'todo_historial': 'Todo el historial',
+        'meses': 'meses',
+        'agrupar_por': 'Agrupar por',
+        'por_mes': 'Mes',
+        'por_semana': 'Semana',
+        'semana': 'Semana',
+        'media_movil': 'Media móvil',
+        'gasto_acumulado': 'Gasto acumulado',
+        'cuota': 'Cuota',
+        'vs_anio_anterior': 'vs año anterior',
+        'consolidado': 'Todas mis cuentas',
+        'total_consolidado': 'Total en todas las cuentas',
+        'num_cuentas': 'Cuentas',
+        'desglose_cuentas': 'Por cuenta',
+        'desglose_categorias': 'Por categoría (todas las cuentas)',
+        'evolucion_consolidada': 'Gasto mensual del año por cuenta',
+        'rol': 'Rol',
+        'num_gastos': 'Gastos',
         
         # Mensajes comunes
         'seleccione_cuenta': 'Por favor seleccione una cuenta primero',
@@ -122,6 +145,7 @@ TRANSLATIONS = {
         'seleccionar_categoria': 'Seleccionar Categoría',
         'todas_categorias': 'Todas las categorías',
         'descargar_csv': 'Descargar como CSV',
+        'descargar_parquet': 'Descargar como Parquet',
         'total_registros': 'Total de registros',
         'dashboard': 'Dashboard',
         'total_mes': 'Total Gastado este Mes',
@@ -130,6 +154,19 @@ TRANSLATIONS = {
         'dias_restantes': 'días restantes',
         'usado': 'Usado',
         'vs_mes_anterior': 'vs mes anterior',
+        'prevision_fin_mes': 'Previsión fin de mes',
+        'supera_presupuesto': '⚠️ {categoria}: la previsión a fin de mes (${prevista:,.2f}) supera el presupuesto (${presupuesto:,.2f})',
+        'inusual': 'Inusual',
+        'solo_inusuales': 'Sólo gastos inusuales',
+        'gastos_inusuales': 'Gastos inusuales',
+        'gastos_inusuales_ayuda': 'Últimos 30 días: importes muy por encima de lo habitual en su categoría o comercio',
+        'buscar': 'Buscar',
+        'buscar_ayuda': 'Lugar o notas, p. ej. farmacia nuñ',
+        'sin_resultados': 'Ningún gasto coincide con la búsqueda',
+        'importando': 'Importando... {hechas:,} de unas {total:,} filas',
+        'importacion_en_cola': 'Importación en cola',
+        'importacion_fallida': 'La importación falló: {error}',
+        'importacion_interrumpida': 'La importación se interrumpió; vuelva a subir el archivo',
         'gastos_vs_presupuesto': 'Gastos vs Presupuesto por Categoría',
         'ultimos_gastos': 'Últimos Gastos',
         'no_hay_gastos': 'No hay gastos registrados',
@@ -216,6 +253,10 @@ TRANSLATIONS = {
         'eliminar_gasto': 'Delete Expense',
         'confirmar_eliminar': 'Are you sure you want to delete this expense?',
         'ingrese_lugar': 'Please enter the place of expense',
+        'por_pagina': 'Expenses per page',
+        'pagina': 'Page',
+        'pagina_anterior': '⬅️ Previous',
+        'pagina_siguiente': 'Next ➡️',
         
         # Categories
         'gestion_categorias': '📑 Category Management',
@@ -245,6 +286,25 @@ TRANSLATIONS = {
         'comparativa_presupuesto': 'Comparativa with Presupuesto',
         'tendencia_gastos': 'Tendencia of Expenses',
         'sin_datos_tendencia': 'No data available to show trends',
+        'periodo': 'Period',
+        'todo_historial': 'All history',
+        'meses': 'months',
+        'agrupar_por': 'Group by',
+        'por_mes': 'Month',
+        'por_semana': 'Week',
+        'semana': 'Week',
+        'media_movil': 'Moving average',
+        'gasto_acumulado': 'Cumulative spending',
+        'cuota': 'Share',
+        'vs_anio_anterior': 'vs previous year',
+        'consolidado': 'All my accounts',
+        'total_consolidado': 'Total across all accounts',
+        'num_cuentas': 'Accounts',
+        'desglose_cuentas': 'By account',
+        'desglose_categorias': 'By category (all accounts)',
+        'evolucion_consolidada': 'Monthly spending this year by account',
+        'rol': 'Role',
+        'num_gastos': 'Expenses',
         
         # Common messages
         'seleccione_cuenta': 'Please select an account first',
@@ -270,6 +330,21 @@ TRANSLATIONS = {
         'dias_restantes': 'días restantes',
         'usado': 'Usado',
         'vs_mes_anterior': 'vs mes anterior',
+        'prevision_fin_mes': 'Month-end forecast',
+        'supera_presupuesto': '⚠️ {categoria}: the month-end forecast (${prevista:,.2f}) exceeds the budget (${presupuesto:,.2f})',
+        'inusual': 'Unusual',
+        'solo_inusuales': 'Only unusual expenses',
+        'gastos_inusuales': 'Unusual expenses',
+        'gastos_inusuales_ayuda': 'Last 30 days: amounts far above what is usual for their category or merchant',
+        'buscar': 'Search',
+        'buscar_ayuda': 'Place or notes, e.g. pharmacy sm',
+        'sin_resultados': 'No expenses match the search',
+        'descargar_csv': 'Download as CSV',
+        'descargar_parquet': 'Download as Parquet',
+        'importando': 'Importing... {hechas:,} of about {total:,} rows',
+        'importacion_en_cola': 'Import queued',
+        'importacion_fallida': 'The import failed: {error}',
+        'importacion_interrumpida': 'The import was interrupted; please upload the file again',
         'gastos_vs_presupuesto': 'Gastos vs Presupuesto por Categoría',
         'ultimos_gastos': 'Últimos Gastos',
         'no_hay_gastos': 'No expenses registered',
@@ -356,6 +431,10 @@ TRANSLATIONS = {
         'eliminar_gasto': 'Ausgabe löschen',
         'confirmar_eliminar': 'Sind Sie sicher, dass Sie diese Ausgabe löschen möchten?',
         'ingrese_lugar': 'Bitte geben Sie den Ort der Ausgabe ein',
+        'por_pagina': 'Ausgaben pro Seite',
+        'pagina': 'Seite',
+        'pagina_anterior': '⬅️ Zurück',
+        'pagina_siguiente': 'Weiter ➡️',
         
         # Kategorien
         'gestion_categorias': '📑 Kategorieverwaltung',
@@ -385,6 +464,25 @@ TRANSLATIONS = {
         'comparativa_presupuesto': 'Vergleich mit Budget',
         'tendencia_gastos': 'Tendenz der Ausgaben',
         'sin_datos_tendencia': 'Keine Daten verfügbar, um Trends zu zeigen',
+        'periodo': 'Zeitraum',
+        'todo_historial': 'Gesamter Verlauf',
+        'meses': 'Monate',
+        'agrupar_por': 'Gruppieren nach',
+        'por_mes': 'Monat',
+        'por_semana': 'Woche',
+        'semana': 'Woche',
+        'media_movil': 'Gleitender Durchschnitt',
+        'gasto_acumulado': 'Kumulierte Ausgaben',
+        'cuota': 'Anteil',
+        'vs_anio_anterior': 'vs. Vorjahr',
+        'consolidado': 'Alle meine Konten',
+        'total_consolidado': 'Gesamt über alle Konten',
+        'num_cuentas': 'Konten',
+        'desglose_cuentas': 'Nach Konto',
+        'desglose_categorias': 'Nach Kategorie (alle Konten)',
+        'evolucion_consolidada': 'Monatliche Ausgaben des Jahres nach Konto',
+        'rol': 'Rolle',
+        'num_gastos': 'Ausgaben',
         
         # Allgemeine Nachrichten
         'seleccione_cuenta': 'Bitte wählen Sie zuerst ein Konto aus',
@@ -410,6 +508,21 @@ TRANSLATIONS = {
         'dias_restantes': 'días restantes',
         'usado': 'Usado',
         'vs_mes_anterior': 'vs mes anterior',
+        'prevision_fin_mes': 'Prognose Monatsende',
+        'supera_presupuesto': '⚠️ {categoria}: Die Prognose zum Monatsende (${prevista:,.2f}) überschreitet das Budget (${presupuesto:,.2f})',
+        'inusual': 'Ungewöhnlich',
+        'solo_inusuales': 'Nur ungewöhnliche Ausgaben',
+        'gastos_inusuales': 'Ungewöhnliche Ausgaben',
+        'gastos_inusuales_ayuda': 'Letzte 30 Tage: Beträge weit über dem Üblichen für ihre Kategorie oder ihr Geschäft',
+        'buscar': 'Suchen',
+        'buscar_ayuda': 'Ort oder Notizen, z. B. apotheke mü',
+        'sin_resultados': 'Keine Ausgaben entsprechen der Suche',
+        'descargar_csv': 'Als CSV herunterladen',
+        'descargar_parquet': 'Als Parquet herunterladen',
+        'importando': 'Importiere... {hechas:,} von etwa {total:,} Zeilen',
+        'importacion_en_cola': 'Import in der Warteschlange',
+        'importacion_fallida': 'Der Import ist fehlgeschlagen: {error}',
+        'importacion_interrumpida': 'Der Import wurde unterbrochen; bitte laden Sie die Datei erneut hoch',
         'gastos_vs_presupuesto': 'Gastos vs Presupuesto por Kategorie',
         'ultimos_gastos': 'Últimos Gastos',
         'no_hay_gastos': 'Keine Ausgaben registriert',
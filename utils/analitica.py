@@ -0,0 +1,247 @@
+"""Series temporales de gastos en arrays de NumPy.
+
+cargar_series() lee una vez los totales diarios de una cuenta por categoría
+y los guarda en una matriz densa (categorías x días, en céntimos). El resto
+de cálculos (remuestreo mensual y semanal, medias móviles, comparación
+interanual, curvas acumuladas y cuotas por categoría) trabajan sobre esa
+matriz, para cualquier ventana, sin volver a consultar la base de datos.
+
+Las ventanas son semiabiertas [desde, hasta), como rango_mes.
+"""
+from dataclasses import dataclass
+from datetime import date, timedelta
+
+import numpy as np
+
+from database import get_db_connection
+from utils.cache import cacheado
+from utils.instantaneas import obtener_instantanea
+
+@dataclass(frozen=True)
+class SeriesGastos:
+    inicio: np.datetime64          # primer día de la matriz
+    categoria_ids: np.ndarray      # (categorías,)
+    categorias: tuple              # nombres, en el mismo orden
+    centimos: np.ndarray           # (categorías, días), int64
+
+    @property
+    def vacia(self):
+        return self.centimos.shape[1] == 0
+
+    @property
+    def dias(self):
+        return self.inicio + np.arange(self.centimos.shape[1])
+
+    @property
+    def fin(self):
+        """Día siguiente al último de la matriz."""
+        return self.inicio + self.centimos.shape[1]
+
+    def _columnas(self, desde=None, hasta=None):
+        """Índices de columna de la ventana, recortados a los datos."""
+        n = self.centimos.shape[1]
+        i = 0 if desde is None else int((np.datetime64(desde, 'D') - self.inicio).astype(int))
+        j = n if hasta is None else int((np.datetime64(hasta, 'D') - self.inicio).astype(int))
+        return min(max(i, 0), n), min(max(j, 0), n)
+
+    def ventana(self, desde=None, hasta=None):
+        """(días, matriz) de la ventana; la matriz es una vista, no una copia."""
+        i, j = self._columnas(desde, hasta)
+        return self.dias[i:j], self.centimos[:, i:j]
+
+    def _agrupar(self, periodos, matriz):
+        if matriz.shape[1] == 0:
+            return periodos[:0], matriz
+        cortes = np.flatnonzero(np.r_[True, periodos[1:] != periodos[:-1]])
+        return periodos[cortes], np.add.reduceat(matriz, cortes, axis=1)
+
+    def por_mes(self, desde=None, hasta=None):
+        """Totales mensuales: (meses datetime64[M], matriz categorías x meses)."""
+        dias, matriz = self.ventana(desde, hasta)
+        return self._agrupar(dias.astype('datetime64[M]'), matriz)
+
+    def por_semana(self, desde=None, hasta=None):
+        """Totales por semana: (lunes de cada semana, matriz categorías x semanas)."""
+        dias, matriz = self.ventana(desde, hasta)
+        # El 1970-01-01 (día 0) fue jueves
+        lunes = dias - (dias.astype(np.int64) + 3) % 7
+        return self._agrupar(lunes, matriz)
+
+    def totales(self, desde=None, hasta=None):
+        """Total de cada categoría en la ventana."""
+        return self.ventana(desde, hasta)[1].sum(axis=1)
+
+    def cuotas(self, desde=None, hasta=None):
+        """(totales, fracción del total) de cada categoría en la ventana."""
+        totales = self.totales(desde, hasta)
+        suma = totales.sum()
+        return totales, totales / suma if suma else np.zeros(len(totales))
+
+    def acumulado(self, desde=None, hasta=None):
+        """Curva de gasto acumulado día a día: (días, matriz categorías x días)."""
+        dias, matriz = self.ventana(desde, hasta)
+        return dias, np.cumsum(matriz, axis=1)
+
+    def interanual(self, desde, hasta):
+        """(actual, año anterior) por categoría, comparando la misma ventana
+        desplazada un año."""
+        return self.totales(desde, hasta), self.totales(_un_anio_antes(desde), _un_anio_antes(hasta))
+
+def _un_anio_antes(dia):
+    try:
+        return dia.replace(year=dia.year - 1)
+    except ValueError:  # 29 de febrero
+        return dia.replace(year=dia.year - 1, day=28)
+
+def media_movil(matriz, ventana):
+    """Media móvil de `ventana` periodos sobre el último eje; NaN hasta
+    completar la primera ventana."""
+    matriz = np.asarray(matriz, dtype=float)
+    resultado = np.full(matriz.shape, np.nan)
+    if ventana <= 0 or matriz.shape[-1] < ventana:
+        return resultado
+    suma = np.cumsum(matriz, axis=-1)
+    resultado[..., ventana - 1] = suma[..., ventana - 1]
+    resultado[..., ventana:] = suma[..., ventana:] - suma[..., :-ventana]
+    resultado[..., ventana - 1:] /= ventana
+    return resultado
+
+def series_desde_filas(filas):
+    """Construye SeriesGastos a partir de filas (categoria_id, nombre, fecha, centimos)."""
+    if not filas:
+        return series_desde_columnas(np.zeros(0), np.zeros(0), np.zeros(0), {})
+    ids, nombres, fechas, centimos = zip(*filas)
+    return series_desde_columnas(
+        np.array(ids, dtype=np.int64), np.array(fechas, dtype='datetime64[D]'),
+        np.array(centimos, dtype=np.int64), dict(zip(ids, nombres))
+    )
+
+def series_desde_columnas(ids, fechas, centimos, nombre_por_id):
+    """Construye SeriesGastos a partir de columnas de gastos (o de totales).
+
+    `fechas` en datetime64[D] o en días desde 1970-01-01; `nombre_por_id`
+    da el nombre de cada categoria_id.
+    """
+    if len(ids) == 0:
+        vacio = np.zeros((0, 0), dtype=np.int64)
+        return SeriesGastos(np.datetime64(date.today(), 'D'), np.zeros(0, dtype=np.int64), (), vacio)
+
+    fechas = np.asarray(fechas).astype('datetime64[D]')
+    inicio = fechas.min()
+    dias = (fechas.max() - inicio).astype(int) + 1
+
+    categoria_ids, fila = np.unique(ids, return_inverse=True)
+    categoria_ids = categoria_ids.astype(np.int64)
+    matriz = np.zeros((len(categoria_ids), dias), dtype=np.int64)
+    np.add.at(matriz, (fila, (fechas - inicio).astype(int)), np.asarray(centimos, dtype=np.int64))
+
+    # El resultado se comparte entre sesiones a través de la caché
+    matriz.flags.writeable = False
+    categoria_ids.flags.writeable = False
+    return SeriesGastos(
+        inicio, categoria_ids, tuple(nombre_por_id[i] for i in categoria_ids.tolist()), matriz
+    )
+
+def _series_sql(conn, cuenta_id):
+    # Agrupar antes del JOIN y por (fecha, categoria_id) deja recorrer el
+    # índice (cuenta_id, fecha) en orden
+    filas = conn.execute('''
+        SELECT g.categoria_id, c.nombre, g.fecha, g.centimos
+        FROM (
+            SELECT categoria_id, fecha, SUM(centimos) AS centimos
+            FROM gastos
+            WHERE cuenta_id = ?
+            GROUP BY fecha, categoria_id
+        ) g
+        JOIN categorias c ON c.id = g.categoria_id
+    ''', (cuenta_id,)).fetchall()
+    return series_desde_filas([tuple(fila) for fila in filas])
+
+def _series_instantanea(conn, cuenta_id, instantanea):
+    nombres = dict(conn.execute(
+        "SELECT id, nombre FROM categorias WHERE cuenta_id = ?", (cuenta_id,)
+    ).fetchall())
+    return series_desde_columnas(
+        instantanea['categoria_id'], instantanea['fecha'], instantanea['centimos'], nombres
+    )
+
+@cacheado()
+def cargar_series(cuenta_id):
+    """Series diarias por categoría de la cuenta.
+
+    Salen de la instantánea en disco de la cuenta si está al día (ver
+    utils.instantaneas) y si no, de una consulta agregada.
+    """
+    conn = get_db_connection()
+    instantanea = obtener_instantanea(cuenta_id)
+    if instantanea is not None:
+        return _series_instantanea(conn, cuenta_id, instantanea)
+    return _series_sql(conn, cuenta_id)
+
+if __name__ == "__main__":
+    # Benchmark con datos sintéticos: python -m utils.analitica [años] [gastos]
+    import os
+    import sys
+    import tempfile
+    import time
+    import database
+    from utils import instantaneas
+
+    anios = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    num_gastos = int(sys.argv[2]) if len(sys.argv) > 2 else 200000
+    num_categorias = 30
+
+    database.configurar_db(os.path.join(tempfile.mkdtemp(), 'analitica.db'))
+    database.initialize_db()
+    with database.transaccion() as conn:
+        conn.execute("INSERT INTO usuarios (nombre, email, password) VALUES ('bench', 'bench@local', 'x')")
+        conn.execute("INSERT INTO cuentas (nombre, creador_id) VALUES ('bench', 1)")
+        conn.executemany(
+            "INSERT INTO categorias (nombre, cuenta_id) VALUES (?, 1)",
+            [(f"Categoría {i}",) for i in range(num_categorias)]
+        )
+        rng = np.random.default_rng(0)
+        hoy = np.datetime64(date.today(), 'D')
+        fechas = hoy - rng.integers(0, 365 * anios, num_gastos)
+        conn.executemany(
+            "INSERT INTO gastos (cuenta_id, categoria_id, centimos, lugar, fecha, usuario_id) VALUES (1, ?, ?, 'x', ?, 1)",
+            zip(
+                (rng.zipf(1.6, num_gastos) % num_categorias + 1).tolist(),
+                rng.lognormal(7, 1, num_gastos).astype(np.int64).tolist(),
+                fechas.astype(str).tolist(),
+            )
+        )
+
+    def medir(etiqueta, funcion, repeticiones):
+        inicio = time.perf_counter()
+        for _ in range(repeticiones):
+            funcion()
+        ms = (time.perf_counter() - inicio) * 1000 / repeticiones
+        print(f"{etiqueta:<45} {ms:9.3f} ms")
+
+    print(f"{num_gastos} gastos, {anios} años, {num_categorias} categorías")
+    conn = database.get_db_connection()
+    medir("Carga de series (consulta + matriz)", lambda: _series_sql(conn, 1), 3)
+    instantaneas.INSTANTANEAS_DIR = tempfile.mkdtemp()
+    medir("Escritura de la instantánea", lambda: instantaneas.reconstruir_instantanea(lambda *a: None, 1), 1)
+    medir("Carga de series (instantánea + matriz)",
+          lambda: _series_instantanea(conn, 1, instantaneas.obtener_instantanea(1)), 3)
+    series = cargar_series(1)
+    hoy = date.today()
+    desde = hoy - timedelta(days=365)
+    medir("Remuestreo mensual, todo el historial", lambda: series.por_mes(), 200)
+    medir("Remuestreo semanal, todo el historial", lambda: series.por_semana(), 200)
+    medir("Media móvil de 3 meses", lambda: media_movil(series.por_mes()[1], 3), 200)
+    medir("Interanual del último año", lambda: series.interanual(desde, hoy), 200)
+    medir("Cuotas por categoría del último año", lambda: series.cuotas(desde, hoy), 200)
+    medir("Curva acumulada del último año", lambda: series.acumulado(desde, hoy), 200)
+
+    # Lo mismo en SQL: una consulta agregada por cada ventana
+    medir("SQL: totales mensuales de un año", lambda: conn.execute(f'''
+        SELECT categoria_id, {database.sql_mes('fecha')}, SUM(centimos) FROM gastos
+        WHERE cuenta_id = 1 AND fecha >= ? AND fecha < ? GROUP BY 1, 2
+    ''', (desde.isoformat(), hoy.isoformat())).fetchall(), 20)
+    medir("SQL: totales semanales de todo el historial", lambda: conn.execute('''
+        SELECT categoria_id, date(fecha, 'weekday 0', '-6 days'), SUM(centimos) FROM gastos
+        WHERE cuenta_id = 1 GROUP BY 1, 2
+    ''').fetchall(), 5)
@@ -0,0 +1,174 @@
+"""Detección de gastos inusuales en streaming.
+
+Por cada cuenta se guardan acumuladores de Welford (n, media, m2) del
+logaritmo del importe, uno por categoría y otro por comercio. Cada gasto
+nuevo se puntúa con la z respecto a lo visto hasta entonces en su categoría
+y en su comercio (se queda la mayor) y después se suma a los acumuladores,
+así que puntuar cuesta O(1) y nunca recorre el historial. El logaritmo hace
+que un importe 3 veces mayor de lo normal pese lo mismo en un café que en el
+alquiler.
+
+Las puntuaciones se guardan en gastos.anomalia; a partir de UMBRAL_ANOMALIA
+el gasto se considera inusual.
+"""
+import math
+from dataclasses import dataclass
+
+from database import get_db_connection, transaccion, normalizar_lugar
+from database.models import UMBRAL_ANOMALIA
+from utils.cache import cacheado
+
+# Gastos que necesita un acumulador antes de puntuar con él
+MIN_MUESTRAS = 8
+# Desviación mínima en escala logarítmica (~10 %), para que una categoría de
+# importe siempre igual no marque cualquier cambio de céntimos
+DESVIACION_MINIMA = 0.1
+
+# Suma un acumulador (n, media, m2) al guardado: fórmula de combinación de
+# Chan, que con n = 1 es el paso de Welford
+_COMBINAR = '''
+    INSERT INTO estadisticas_gastos (cuenta_id, ambito, clave, n, media, m2)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (cuenta_id, ambito, clave) DO UPDATE SET
+        n = estadisticas_gastos.n + excluded.n,
+        media = estadisticas_gastos.media
+            + (excluded.media - estadisticas_gastos.media) * excluded.n
+              / (estadisticas_gastos.n + excluded.n),
+        m2 = estadisticas_gastos.m2 + excluded.m2
+            + (excluded.media - estadisticas_gastos.media) * (excluded.media - estadisticas_gastos.media)
+              * estadisticas_gastos.n * excluded.n / (estadisticas_gastos.n + excluded.n)
+'''
+
+# Paso de Welford inverso: retira un valor x (los parámetros son x, x, x, x)
+_RETIRAR = '''
+    UPDATE estadisticas_gastos SET
+        m2 = CASE WHEN n > 1 THEN m2 - (? - media) * (? - media) * n / (n - 1) ELSE 0 END,
+        media = CASE WHEN n > 1 THEN (media * n - ?) / (n - 1) ELSE 0 END,
+        n = n - 1
+    WHERE cuenta_id = ? AND ambito = ? AND clave = ? AND n > 0
+'''
+
+@dataclass
+class Acumulador:
+    n: int = 0
+    media: float = 0.0
+    m2: float = 0.0
+
+    def agregar(self, x):
+        self.n += 1
+        delta = x - self.media
+        self.media += delta / self.n
+        self.m2 += delta * (x - self.media)
+
+    def puntuar(self, x):
+        """z de x respecto a lo acumulado, o None si aún hay pocas muestras."""
+        if self.n < MIN_MUESTRAS:
+            return None
+        desviacion = math.sqrt(max(self.m2, 0.0) / (self.n - 1))
+        return (x - self.media) / max(desviacion, DESVIACION_MINIMA)
+
+def es_inusual(anomalia):
+    return anomalia is not None and anomalia >= UMBRAL_ANOMALIA
+
+def valor(centimos):
+    return math.log(max(int(centimos), 1))
+
+def claves(categoria_id, lugar):
+    return (('categoria', str(int(categoria_id))), ('lugar', normalizar_lugar(lugar)))
+
+def puntuacion(acumuladores, x):
+    """La mayor z entre los acumuladores que ya pueden puntuar, o None."""
+    zs = [z for z in (a.puntuar(x) for a in acumuladores) if z is not None]
+    return round(max(zs), 3) if zs else None
+
+def _leer(conn, cuenta_id, claves_gasto):
+    filtro = " OR ".join(["(ambito = ? AND clave = ?)"] * len(claves_gasto))
+    filas = conn.execute(
+        f"SELECT ambito, clave, n, media, m2 FROM estadisticas_gastos WHERE cuenta_id = ? AND ({filtro})",
+        [cuenta_id, *[parte for clave in claves_gasto for parte in clave]]
+    ).fetchall()
+    guardados = {(f['ambito'], f['clave']): Acumulador(f['n'], f['media'], f['m2']) for f in filas}
+    return [guardados.get(clave, Acumulador()) for clave in claves_gasto]
+
+def anotar(conn, cuenta_id, categoria_id, lugar, centimos):
+    """Puntúa un gasto nuevo y lo suma a las estadísticas; devuelve su puntuación.
+
+    Debe llamarse dentro de la transacción que inserta o modifica el gasto.
+    """
+    x = valor(centimos)
+    claves_gasto = claves(categoria_id, lugar)
+    z = puntuacion(_leer(conn, cuenta_id, claves_gasto), x)
+    conn.executemany(_COMBINAR, [(cuenta_id, ambito, clave, 1, x, 0.0) for ambito, clave in claves_gasto])
+    return z
+
+def retirar(conn, cuenta_id, categoria_id, lugar, centimos):
+    """Quita de las estadísticas un gasto que se borra o se va a modificar."""
+    x = valor(centimos)
+    conn.executemany(_RETIRAR, [(x, x, x, cuenta_id, ambito, clave) for ambito, clave in claves(categoria_id, lugar)])
+
+class AnotadorLote:
+    """Puntúa en orden los gastos de una importación.
+
+    Las estadísticas de la cuenta se leen una vez; lo que añade el lote se
+    acumula aparte y se combina con lo guardado en cada guardar(), en una
+    sola sentencia por clave.
+    """
+
+    def __init__(self, conn, cuenta_id):
+        self.conn = conn
+        self.cuenta_id = cuenta_id
+        self.acumuladores = {
+            (f['ambito'], f['clave']): Acumulador(f['n'], f['media'], f['m2'])
+            for f in conn.execute(
+                "SELECT ambito, clave, n, media, m2 FROM estadisticas_gastos WHERE cuenta_id = ?",
+                (cuenta_id,)
+            )
+        }
+        self.nuevos = {}
+
+    def anotar(self, categoria_id, lugar, centimos):
+        x = valor(centimos)
+        claves_gasto = claves(categoria_id, lugar)
+        z = puntuacion([self.acumuladores.setdefault(c, Acumulador()) for c in claves_gasto], x)
+        for clave in claves_gasto:
+            self.acumuladores[clave].agregar(x)
+            self.nuevos.setdefault(clave, Acumulador()).agregar(x)
+        return z
+
+    def guardar(self):
+        self.conn.executemany(_COMBINAR, [
+            (self.cuenta_id, ambito, clave, a.n, a.media, a.m2)
+            for (ambito, clave), a in self.nuevos.items()
+        ])
+        self.nuevos = {}
+
+def reconstruir_anomalias(cuenta_id):
+    """Recalcula desde cero las estadísticas y puntuaciones de una cuenta.
+
+    Recorre los gastos por id, puntuando cada uno con lo anterior a él, igual
+    que si hubieran llegado uno a uno.
+    """
+    with transaccion() as conn:
+        conn.execute("DELETE FROM estadisticas_gastos WHERE cuenta_id = ?", (cuenta_id,))
+        anotador = AnotadorLote(conn, cuenta_id)
+        filas = conn.execute(
+            "SELECT id, categoria_id, lugar, centimos FROM gastos WHERE cuenta_id = ? ORDER BY id",
+            (cuenta_id,)
+        ).fetchall()
+        conn.executemany(
+            "UPDATE gastos SET anomalia = ? WHERE id = ?",
+            [(anotador.anotar(f['categoria_id'], f['lugar'], f['centimos']), f['id']) for f in filas]
+        )
+        anotador.guardar()
+
+@cacheado()
+def get_gastos_inusuales(cuenta_id, desde, limite=10):
+    """Los gastos inusuales más recientes desde la fecha ISO `desde`."""
+    return tuple(get_db_connection().execute(f'''
+        SELECT g.id, g.fecha, g.centimos, g.lugar, c.nombre AS categoria, g.anomalia
+        FROM gastos g
+        JOIN categorias c ON g.categoria_id = c.id
+        WHERE g.cuenta_id = ? AND g.fecha >= ? AND g.anomalia >= {UMBRAL_ANOMALIA}
+        ORDER BY g.fecha DESC, g.id DESC
+        LIMIT ?
+    ''', (cuenta_id, desde, limite)).fetchall())
@@ -0,0 +1,58 @@
+"""Tiempos de arranque en frío y de rerun de la app.
+
+Streamlit vuelve a ejecutar app.py en cada interacción, pero los módulos
+importados viven todo el proceso: este módulo se importa el primero y guarda
+cuándo empezó la primera ejecución.
+"""
+import time
+from contextlib import contextmanager
+
+INICIO_PROCESO = time.perf_counter()
+
+# Presupuestos en milisegundos; si se superan se avisa por consola
+PRESUPUESTO_ARRANQUE_MS = 1500
+PRESUPUESTO_RERUN_MS = 150
+
+tiempos = {'arranque_ms': None, 'ultimo_rerun_ms': None}
+
+def _informar(etiqueta, ms, presupuesto, siempre=False):
+    if ms > presupuesto:
+        print(f"{etiqueta}: {ms:.0f} ms (supera el presupuesto de {presupuesto} ms)")
+    elif siempre:
+        print(f"{etiqueta}: {ms:.0f} ms")
+
+@contextmanager
+def medir_ejecucion():
+    """Mide una ejecución completa del script.
+
+    La primera del proceso cuenta desde la importación de este módulo
+    (arranque en frío hasta el primer render); las demás son reruns. Las
+    ejecuciones cortadas por st.rerun() o st.stop() no se miden.
+    """
+    inicio = time.perf_counter()
+    yield
+    fin = time.perf_counter()
+    if tiempos['arranque_ms'] is None:
+        tiempos['arranque_ms'] = (fin - INICIO_PROCESO) * 1000
+        _informar("Arranque en frío", tiempos['arranque_ms'], PRESUPUESTO_ARRANQUE_MS, siempre=True)
+    else:
+        tiempos['ultimo_rerun_ms'] = (fin - inicio) * 1000
+        _informar("Rerun", tiempos['ultimo_rerun_ms'], PRESUPUESTO_RERUN_MS)
+
+if __name__ == "__main__":
+    # Mide la pantalla de login con una base de datos vacía:
+    # python -m utils.arranque
+    # Este script corre como __main__, pero app.py mide con su propia copia de
+    # utils.arranque: se importa antes que nada para que su INICIO_PROCESO sea
+    # el del proceso, y los tiempos se leen de ella.
+    import utils.arranque as arranque_app
+    import os
+    import tempfile
+    from streamlit.testing.v1 import AppTest
+    import database
+
+    database.configurar_db(os.path.join(tempfile.mkdtemp(), 'arranque.db'))
+    app = AppTest.from_file("../app.py", default_timeout=30)
+    app.run()  # medir_ejecucion() ya informa del arranque en frío
+    app.run()
+    print(f"Rerun: {arranque_app.tiempos['ultimo_rerun_ms']:.0f} ms (presupuesto {PRESUPUESTO_RERUN_MS} ms)")
@@ -0,0 +1,100 @@
+"""Usuarios, sesiones y roles, sin Streamlit.
+
+Lo comparten la app (a través de utils.session, que añade las cookies) y la
+API HTTP, que usa los mismos tokens de sesión como tokens Bearer.
+"""
+import hashlib
+import secrets
+import time
+from datetime import timedelta
+
+from database import get_db_connection, transaccion
+from utils.cache import CacheLRU
+
+DURACION_SESION = timedelta(days=30)
+# Sin "mantener sesión" el token no va a la cookie y dura lo que la pestaña
+DURACION_SESION_TEMPORAL = timedelta(hours=12)
+
+# Segundos que una sesión verificada se da por buena sin volver a consultar.
+# Las revocaciones de este proceso se aplican al momento; con varias réplicas
+# las de las demás tardan como mucho esto en notarse.
+SESION_TTL = 300
+
+# Roles de usuarios_cuentas que pueden registrar y modificar gastos
+ROLES_ESCRITURA = ('admin', 'editor')
+
+_sesiones_verificadas = CacheLRU(maximo=1024, ttl=SESION_TTL)
+
+def verificar_usuario(email, password):
+    """Devuelve (usuario_id, nombre, email) si la contraseña es correcta, o None."""
+    # Import diferido: bcrypt no hace falta para arrancar la app
+    import bcrypt
+    fila = get_db_connection().execute(
+        "SELECT id, password, nombre, email FROM usuarios WHERE email = ?", (email,)
+    ).fetchone()
+    if fila and bcrypt.checkpw(password.encode('utf-8'), fila[1]):
+        return fila[0], fila[2], fila[3]
+
+def rol_en_cuenta(usuario_id, cuenta_id):
+    """Rol del usuario en la cuenta, o None si no tiene acceso."""
+    fila = get_db_connection().execute(
+        "SELECT rol FROM usuarios_cuentas WHERE usuario_id = ? AND cuenta_id = ?",
+        (usuario_id, cuenta_id)
+    ).fetchone()
+    return fila[0] if fila else None
+
+def _hash_token(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+def crear_sesion(usuario_id, duracion=DURACION_SESION):
+    """Registra una sesión nueva y devuelve su token."""
+    token = secrets.token_urlsafe(32)
+    ahora = time.time()
+    with transaccion() as conn:
+        conn.execute("DELETE FROM sesiones WHERE usuario_id = ? AND expira <= ?", (usuario_id, ahora))
+        conn.execute(
+            "INSERT INTO sesiones (token_hash, usuario_id, expira) VALUES (?, ?, ?)",
+            (_hash_token(token), usuario_id, ahora + duracion.total_seconds())
+        )
+    return token
+
+def verificar_sesion(token):
+    """Devuelve (usuario_id, nombre, email) si el token es válido, o None.
+
+    Los aciertos se sirven de la caché en memoria, sin tocar la base de datos.
+    """
+    if not token:
+        return None
+    token_hash = _hash_token(token)
+    encontrado, sesion = _sesiones_verificadas.obtener(token_hash)
+    if encontrado:
+        return sesion
+
+    ahora = time.time()
+    fila = get_db_connection().execute('''
+        SELECT s.usuario_id, u.nombre, u.email, s.expira
+        FROM sesiones s
+        JOIN usuarios u ON u.id = s.usuario_id
+        WHERE s.token_hash = ? AND s.expira > ?
+    ''', (token_hash, ahora)).fetchone()
+    if not fila:
+        return None
+    sesion = (fila[0], fila[1], fila[2])
+    _sesiones_verificadas.guardar(token_hash, sesion, ttl=min(SESION_TTL, fila[3] - ahora))
+    return sesion
+
+def revocar_sesion(token):
+    token_hash = _hash_token(token)
+    with transaccion() as conn:
+        conn.execute("DELETE FROM sesiones WHERE token_hash = ?", (token_hash,))
+    _sesiones_verificadas.descartar(token_hash)
+
+def revocar_sesiones_usuario(usuario_id, excepto=None):
+    """Cierra todas las sesiones del usuario, salvo opcionalmente el token `excepto`."""
+    conservar = _hash_token(excepto) if excepto else ''
+    with transaccion() as conn:
+        conn.execute(
+            "DELETE FROM sesiones WHERE usuario_id = ? AND token_hash != ?",
+            (usuario_id, conservar)
+        )
+    _sesiones_verificadas.descartar_si(lambda sesion: sesion[0] == usuario_id)
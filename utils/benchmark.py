@@ -0,0 +1,308 @@
+"""Benchmark de las funciones de datos sobre bases sintéticas.
+
+Para cada tamaño genera con utils.sintetico una base reproducible (o reutiliza
+la que ya generó otra vez), la copia y ejecuta cada caso varias veces sin
+caché, anotando la latencia p50/p95 y el pico de memoria de Python. El pico
+se mide con tracemalloc en una ejecución aparte, para que el rastreo no
+infle los tiempos, y no incluye la memoria interna de SQLite.
+
+Con --guardar se escribe el resultado como línea base; con --comparar se
+contrasta con una línea base y se sale con código 1 si algún caso ha
+empeorado más de la tolerancia.
+
+    python -m utils.benchmark --tamanos 10000,100000 --guardar bench_base.json
+    python -m utils.benchmark --tamanos 10000,100000 --comparar bench_base.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass, asdict
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+import database
+from database import get_db_connection, clave_mes, get_dashboard_snapshot, create_account
+from utils import instantaneas, sintetico
+from utils.analitica import _series_sql, _series_instantanea
+from utils.anomalias import get_gastos_inusuales
+from utils.busqueda import buscar_gastos, totales_busqueda
+from utils.exportacion import exportar_gastos
+from utils.importador import importar_csv
+from utils.prevision import prevision_mes
+from pages import analisis, categorias, gastos
+
+TAMANOS = (10000, 100000, 1000000)
+
+# Repeticiones medidas por caso, tras una de calentamiento; un caso lento
+# deja de repetirse al pasar MAX_SEGUNDOS_CASO (con un mínimo de 3)
+REPETICIONES = 15
+MIN_REPETICIONES = 3
+MAX_SEGUNDOS_CASO = 10
+
+# Un caso empeora si su p95 o su pico de memoria superan la línea base por
+# este factor y, además, por el margen absoluto (lo de debajo es ruido)
+TOLERANCIA = 1.25
+MARGEN_MS = 2.0
+MARGEN_MB = 1.0
+
+# Fecha final fija: la misma base todos los días, y "hoy" para los casos
+HASTA = date(2025, 6, 15)
+
+# Filas del CSV de los casos de importación
+FILAS_IMPORTACION = 10000
+
+DATOS_DIR = os.path.join(tempfile.gettempdir(), 'geldtrack-bench')
+
+@dataclass
+class Contexto:
+    """Lo que necesitan los casos: la cuenta más grande y su creador."""
+    cuenta_id: int
+    usuario_id: int
+    categoria_id: int
+    categoria: str
+    hoy: date
+    csv: bytes
+    cuenta_duplicados: int
+
+@dataclass(frozen=True)
+class Medida:
+    p50_ms: float
+    p95_ms: float
+    pico_mb: float
+    repeticiones: int
+
+def _sin_cache(funcion):
+    return getattr(funcion, 'sin_cache', funcion)
+
+def _importar(ctx, cuenta_id):
+    return importar_csv(cuenta_id, ctx.usuario_id, io.BytesIO(ctx.csv))
+
+def _importar_en_cuenta_nueva(ctx):
+    cuenta_id = create_account('Benchmark', ctx.usuario_id)
+    return lambda: _importar(ctx, cuenta_id)
+
+def _registrar_gasto(ctx):
+    return lambda: gastos.registrar_gasto(
+        ctx.cuenta_id, ctx.categoria_id, 12.5, 'Benchmark', ctx.hoy, ctx.usuario_id, None
+    )
+
+# (nombre, preparar): preparar(ctx) devuelve la llamada que se mide y se
+# ejecuta antes de cada repetición, fuera del tiempo medido. Los casos que
+# escriben van al final para no cambiar los datos de los de lectura.
+CASOS = (
+    ('dashboard.get_dashboard_snapshot',
+     lambda ctx: lambda: _sin_cache(get_dashboard_snapshot)(ctx.cuenta_id, ctx.hoy)),
+    ('categorias.get_categorias',
+     lambda ctx: lambda: _sin_cache(categorias.get_categorias)(ctx.cuenta_id, ctx.hoy)),
+    ('gastos.get_gastos_recientes (mes)',
+     lambda ctx: lambda: gastos.get_gastos_recientes(ctx.cuenta_id, ctx.hoy.month, ctx.hoy.year)),
+    ('gastos.get_pagina_gastos',
+     lambda ctx: lambda: gastos.get_pagina_gastos(ctx.cuenta_id, 50)),
+    ('gastos.get_pagina_gastos (inusuales)',
+     lambda ctx: lambda: gastos.get_pagina_gastos(ctx.cuenta_id, 50, solo_inusuales=True)),
+    ('gastos.get_totales_historial',
+     lambda ctx: lambda: _sin_cache(gastos.get_totales_historial)(ctx.cuenta_id)),
+    ('analisis.get_gastos_mes',
+     lambda ctx: lambda: _sin_cache(analisis.get_gastos_mes)(ctx.cuenta_id, ctx.hoy.month, ctx.hoy.year)),
+    ('analisis.get_gastos_detallados',
+     lambda ctx: lambda: _sin_cache(analisis.get_gastos_detallados)(ctx.cuenta_id, ctx.hoy.month, ctx.hoy.year)),
+    ('analisis.get_gastos_detallados (categoría)',
+     lambda ctx: lambda: _sin_cache(analisis.get_gastos_detallados)(
+         ctx.cuenta_id, ctx.hoy.month, ctx.hoy.year, ctx.categoria)),
+    ('analisis.get_anios_gastos',
+     lambda ctx: lambda: _sin_cache(analisis.get_anios_gastos)(ctx.cuenta_id)),
+    ('analisis.get_consolidado_mes',
+     lambda ctx: lambda: _sin_cache(analisis.get_consolidado_mes)(
+         ctx.usuario_id, clave_mes(ctx.hoy.year, ctx.hoy.month), ())),
+    ('analisis.get_evolucion_consolidada',
+     lambda ctx: lambda: _sin_cache(analisis.get_evolucion_consolidada)(ctx.usuario_id, ctx.hoy.year, ())),
+    ('anomalias.get_gastos_inusuales',
+     lambda ctx: lambda: _sin_cache(get_gastos_inusuales)(ctx.cuenta_id, ctx.hoy - timedelta(days=90))),
+    ('busqueda.buscar_gastos',
+     lambda ctx: lambda: buscar_gastos(ctx.cuenta_id, 'mercadona', 50)),
+    ('busqueda.totales_busqueda',
+     lambda ctx: lambda: _sin_cache(totales_busqueda)(ctx.cuenta_id, 'mercadona')),
+    ('analitica.cargar_series (SQL)',
+     lambda ctx: lambda: _series_sql(get_db_connection(), ctx.cuenta_id)),
+    ('analitica.cargar_series (instantánea)',
+     lambda ctx: lambda: _series_instantanea(
+         get_db_connection(), ctx.cuenta_id, instantaneas.obtener_instantanea(ctx.cuenta_id))),
+    ('prevision.prevision_mes',
+     lambda ctx: lambda: _sin_cache(prevision_mes)(ctx.cuenta_id, ctx.hoy)),
+    ('exportacion.exportar_gastos (csv)',
+     lambda ctx: lambda: exportar_gastos(ctx.cuenta_id, 'csv').close()),
+    ('exportacion.exportar_gastos (parquet)',
+     lambda ctx: lambda: exportar_gastos(ctx.cuenta_id, 'parquet').close()),
+    ('instantaneas.reconstruir_instantanea',
+     lambda ctx: lambda: instantaneas.reconstruir_instantanea(lambda *a: None, ctx.cuenta_id)),
+    (f'importador.importar_csv ({FILAS_IMPORTACION} nuevas)', _importar_en_cuenta_nueva),
+    (f'importador.importar_csv ({FILAS_IMPORTACION} duplicadas)',
+     lambda ctx: lambda: _importar(ctx, ctx.cuenta_duplicados)),
+    ('gastos.registrar_gasto', _registrar_gasto),
+)
+
+def preparar_base(gastos_totales, semilla=0, datos_dir=DATOS_DIR):
+    """Copia de trabajo de la base sintética del tamaño pedido.
+
+    La base original se genera una vez y se guarda en `datos_dir`; al ser
+    reproducible, sirve para todas las ejecuciones con la misma configuración.
+    """
+    config = sintetico.ConfigSintetica(gastos=gastos_totales, semilla=semilla, hasta=HASTA)
+    os.makedirs(datos_dir, exist_ok=True)
+    nombre = f"sintetico-{config.gastos}-{config.usuarios}-{config.cuentas}-{config.categorias}-" \
+             f"{config.anios}-{config.semilla}-{config.hasta.isoformat()}.db"
+    original = os.path.join(datos_dir, nombre)
+    if not os.path.exists(original):
+        temporal = original + '.tmp'
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        print(f"Generando {nombre}...")
+        database.configurar_db(temporal)
+        sintetico.generar(config)
+        database.cerrar_conexiones()
+        os.replace(temporal, original)
+    copia = os.path.join(tempfile.mkdtemp(), 'finanzas.db')
+    shutil.copy(original, copia)
+    return copia
+
+def crear_contexto():
+    conn = get_db_connection()
+    cuenta_id, usuario_id = conn.execute('''
+        SELECT c.id, c.creador_id FROM cuentas c
+        JOIN gastos g ON g.cuenta_id = c.id
+        GROUP BY c.id, c.creador_id
+        ORDER BY COUNT(*) DESC, c.id
+        LIMIT 1
+    ''').fetchone()
+    categoria_id, categoria = conn.execute('''
+        SELECT c.id, c.nombre FROM categorias c
+        JOIN gastos_mensuales gm ON gm.categoria_id = c.id
+        WHERE c.cuenta_id = ?
+        GROUP BY c.id, c.nombre
+        ORDER BY SUM(gm.num_gastos) DESC, c.id
+        LIMIT 1
+    ''', (cuenta_id,)).fetchone()
+    contenido = sintetico.csv_sintetico(FILAS_IMPORTACION, semilla=1, hasta=HASTA)
+    cuenta_duplicados = create_account('Benchmark duplicados', usuario_id)
+    importar_csv(cuenta_duplicados, usuario_id, io.BytesIO(contenido))
+    return Contexto(cuenta_id, usuario_id, categoria_id, categoria, HASTA, contenido, cuenta_duplicados)
+
+def medir(preparar, ctx, repeticiones=REPETICIONES):
+    preparar(ctx)()  # calentamiento
+    tiempos = []
+    inicio_caso = time.perf_counter()
+    while len(tiempos) < repeticiones:
+        llamada = preparar(ctx)
+        inicio = time.perf_counter()
+        llamada()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+        if len(tiempos) >= MIN_REPETICIONES and time.perf_counter() - inicio_caso > MAX_SEGUNDOS_CASO:
+            break
+
+    llamada = preparar(ctx)
+    tracemalloc.start()
+    try:
+        llamada()
+        pico = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return Medida(
+        p50_ms=round(float(np.percentile(tiempos, 50)), 3),
+        p95_ms=round(float(np.percentile(tiempos, 95)), 3),
+        pico_mb=round(pico / 2**20, 3),
+        repeticiones=len(tiempos),
+    )
+
+def ejecutar(tamanos=TAMANOS, repeticiones=REPETICIONES, semilla=0, filtro=None, datos_dir=DATOS_DIR):
+    """Mide todos los casos (o los que contienen `filtro`) en cada tamaño."""
+    resultados = {}
+    for tamano in tamanos:
+        database.configurar_db(preparar_base(tamano, semilla, datos_dir))
+        database.initialize_db()
+        instantaneas.INSTANTANEAS_DIR = tempfile.mkdtemp()
+        ctx = crear_contexto()
+        instantaneas.reconstruir_instantanea(lambda *a: None, ctx.cuenta_id)
+
+        print(f"\n{tamano} gastos")
+        resultados[str(tamano)] = {}
+        for nombre, preparar in CASOS:
+            if filtro and filtro not in nombre:
+                continue
+            medida = medir(preparar, ctx, repeticiones)
+            resultados[str(tamano)][nombre] = asdict(medida)
+            print(f"{nombre:<50} p50 {medida.p50_ms:10.3f} ms  p95 {medida.p95_ms:10.3f} ms  "
+                  f"pico {medida.pico_mb:8.2f} MB")
+        database.cerrar_conexiones()
+
+    return {
+        'metadatos': {
+            'fecha': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'plataforma': platform.platform(),
+            'semilla': semilla,
+            'repeticiones': repeticiones,
+        },
+        'resultados': resultados,
+    }
+
+def comparar(base, actual, tolerancia=TOLERANCIA):
+    """Casos que empeoran respecto a la línea base, como mensajes."""
+    regresiones = []
+    for tamano, casos in actual['resultados'].items():
+        for nombre, medida in casos.items():
+            anterior = base['resultados'].get(tamano, {}).get(nombre)
+            if anterior is None:
+                continue
+            for campo, margen, unidad in (('p95_ms', MARGEN_MS, 'ms'), ('pico_mb', MARGEN_MB, 'MB')):
+                antes, ahora = anterior[campo], medida[campo]
+                if ahora > antes * tolerancia and ahora - antes > margen:
+                    regresiones.append(
+                        f"{tamano} gastos, {nombre}: {campo} {antes:.2f} -> {ahora:.2f} {unidad} "
+                        f"(x{ahora / antes if antes else float('inf'):.2f})"
+                    )
+    return regresiones
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de la capa de datos de GeldTrack.")
+    parser.add_argument('--tamanos', default=','.join(map(str, TAMANOS)),
+                        help="número de gastos de cada base, separados por comas")
+    parser.add_argument('--repeticiones', type=int, default=REPETICIONES)
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--casos', help="mide sólo los casos cuyo nombre contiene este texto")
+    parser.add_argument('--datos', default=DATOS_DIR, help="carpeta donde se guardan las bases generadas")
+    parser.add_argument('--guardar', help="escribe el resultado como línea base en este JSON")
+    parser.add_argument('--comparar', help="compara con la línea base de este JSON")
+    parser.add_argument('--tolerancia', type=float, default=TOLERANCIA)
+    argumentos = parser.parse_args()
+
+    actual = ejecutar(
+        tamanos=[int(t) for t in argumentos.tamanos.split(',')],
+        repeticiones=argumentos.repeticiones,
+        semilla=argumentos.semilla,
+        filtro=argumentos.casos,
+        datos_dir=argumentos.datos,
+    )
+    if argumentos.guardar:
+        with open(argumentos.guardar, 'w') as f:
+            json.dump(actual, f, indent=2, ensure_ascii=False)
+        print(f"\nLínea base guardada en {argumentos.guardar}")
+    if argumentos.comparar:
+        with open(argumentos.comparar) as f:
+            regresiones = comparar(json.load(f), actual, argumentos.tolerancia)
+        if regresiones:
+            print(f"\n{len(regresiones)} regresiones respecto a {argumentos.comparar}:")
+            for regresion in regresiones:
+                print(f"  {regresion}")
+            sys.exit(1)
+        print(f"\nSin regresiones respecto a {argumentos.comparar}")
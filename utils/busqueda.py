@@ -0,0 +1,154 @@
+"""Búsqueda de texto en el lugar y las notas de los gastos.
+
+Se buscan gastos con todas las palabras, ignorando mayúsculas y acentos.
+La última palabra es un prefijo ('farmacia nuñ' encuentra Farmacia Núñez)
+para buscar mientras se escribe; las anteriores son palabras completas,
+porque un prefijo corto obliga al índice a unir las listas de todos los
+términos que empiezan por él. En SQLite la resuelve el
+índice FTS5 gastos_fts y en PostgreSQL el índice GIN idx_gastos_busqueda
+(ver database/models.py).
+
+Los resultados se recorren por páginas de la más reciente a la más antigua
+con paginación por clave sobre el id (el rowid del índice FTS5), así que
+cada página cuesta lo mismo sin importar cuántas coincidencias haya. El
+número de coincidencias y su total salen de una consulta agregada aparte
+sobre la misma búsqueda, que se cachea como los totales del historial.
+"""
+import logging
+import re
+import unicodedata
+from functools import lru_cache
+
+from database import get_db_connection, dialecto, desde_centimos, ErrorBaseDatos
+from database.models import UMBRAL_ANOMALIA, DOCUMENTO_BUSQUEDA
+from utils.cache import cacheado
+
+_log = logging.getLogger(__name__)
+
+# Palabras que se tienen en cuenta de cada búsqueda
+MAX_TERMINOS = 8
+
+# Mismas columnas que el historial
+_COLUMNAS = '''
+    g.id,
+    g.fecha,
+    g.lugar,
+    g.centimos / 100.0 as cantidad,
+    c.nombre as categoria,
+    g.notas,
+    u.nombre as usuario,
+    g.categoria_id,
+    g.anomalia
+'''
+
+# CROSS JOIN fija el orden en SQLite: primero el índice FTS (que ya filtra
+# por cuenta y entrega las filas por rowid) y luego gastos por id. Si no, el
+# planificador puede recorrer los gastos de la cuenta y lanzar una búsqueda
+# FTS por cada uno.
+_DESDE_SQLITE = '''
+    FROM gastos_fts f
+    CROSS JOIN gastos g ON g.id = f.rowid
+    {joins}
+    WHERE gastos_fts MATCH :consulta AND g.cuenta_id = :cuenta_id
+    {filtros}
+'''
+
+_DESDE_POSTGRES = f'''
+    FROM gastos g
+    {{joins}}
+    WHERE {DOCUMENTO_BUSQUEDA.format(g='g.')} @@ to_tsquery('simple', :consulta)
+    AND g.cuenta_id = :cuenta_id
+    {{filtros}}
+'''
+
+_JOINS_PAGINA = '''
+    JOIN categorias c ON g.categoria_id = c.id
+    JOIN usuarios u ON g.usuario_id = u.id
+'''
+
+@lru_cache(maxsize=4096)
+def terminos(texto):
+    """Palabras del texto en minúsculas y sin acentos."""
+    texto = unicodedata.normalize('NFKD', texto or '').lower()
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    # Como el tokenizador unicode61: '_' separa palabras igual que la puntuación
+    return tuple(re.findall(r'[^\W_]+', texto))
+
+def _consulta(cuenta_id, palabras):
+    """Expresión de búsqueda del motor: todas las palabras, la última como prefijo."""
+    *completas, ultima = palabras
+    if dialecto() == 'sqlite':
+        frases = ' '.join([f'"{p}"' for p in completas] + [f'"{ultima}"*'])
+        return f'cuenta_id : "{cuenta_id}" AND {{lugar notas}} : ({frases})'
+    return ' & '.join([f"'{p}'" for p in completas] + [f"'{ultima}':*"])
+
+def _busqueda(cuenta_id, texto, desde, hasta, solo_inusuales):
+    """(FROM ... WHERE con marcadores {joins} y {filtros}, filtros, columna
+    del id, parámetros) de la búsqueda, o None si no hay palabras."""
+    palabras = terminos(texto)[:MAX_TERMINOS]
+    if not palabras:
+        return None
+    filtros = ""
+    if desde and hasta:
+        filtros += " AND g.fecha >= :desde AND g.fecha < :hasta"
+    if solo_inusuales:
+        filtros += f" AND g.anomalia >= {UMBRAL_ANOMALIA}"
+    # En SQLite se ordena y se pagina por el rowid del índice: FTS5 recibe la
+    # cota y entrega las filas ya ordenadas
+    if dialecto() == 'sqlite':
+        desde_sql, columna_id = _DESDE_SQLITE, 'f.rowid'
+    else:
+        desde_sql, columna_id = _DESDE_POSTGRES, 'g.id'
+    return desde_sql, filtros, columna_id, {
+        'consulta': _consulta(cuenta_id, palabras),
+        'cuenta_id': cuenta_id,
+        'desde': desde,
+        'hasta': hasta,
+    }
+
+def buscar_gastos(cuenta_id, texto, tamano, desde=None, hasta=None, despues_de=None, solo_inusuales=False):
+    """Una página de los gastos de la cuenta que contienen todas las palabras
+    de `texto`, de la más reciente a la más antigua.
+
+    `desde`/`hasta` (fechas ISO) y `solo_inusuales` filtran como en el
+    historial; `despues_de` es el id de la última fila de la página
+    anterior. Devuelve (filas, hay_mas).
+    """
+    busqueda = _busqueda(cuenta_id, texto, desde, hasta, solo_inusuales)
+    if busqueda is None:
+        return [], False
+    desde_sql, filtros, columna_id, params = busqueda
+    if despues_de is not None:
+        filtros += f" AND {columna_id} < :despues_de"
+        params['despues_de'] = despues_de
+    # Una fila de más para saber si existe una página siguiente
+    params['limite'] = tamano + 1
+    query = f'''
+        SELECT {_COLUMNAS}
+        {desde_sql.format(joins=_JOINS_PAGINA, filtros=filtros)}
+        ORDER BY {columna_id} DESC
+        LIMIT :limite
+    '''
+
+    try:
+        filas = get_db_connection().execute(query, params).fetchall()
+    except ErrorBaseDatos as e:
+        # Una expresión que el motor no acepta no debe tumbar el historial
+        _log.warning("Error en la búsqueda %r: %s", texto, e)
+        return [], False
+    return filas[:tamano], len(filas) > tamano
+
+@cacheado()
+def totales_busqueda(cuenta_id, texto, desde=None, hasta=None, solo_inusuales=False):
+    """Número de gastos y total de todas las coincidencias de la búsqueda."""
+    busqueda = _busqueda(cuenta_id, texto, desde, hasta, solo_inusuales)
+    if busqueda is None:
+        return 0, 0.0
+    desde_sql, filtros, _, params = busqueda
+    query = f"SELECT COUNT(*), COALESCE(SUM(g.centimos), 0) {desde_sql.format(joins='', filtros=filtros)}"
+    try:
+        fila = get_db_connection().execute(query, params).fetchone()
+    except ErrorBaseDatos as e:
+        _log.warning("Error en la búsqueda %r: %s", texto, e)
+        return 0, 0.0
+    return fila[0], desde_centimos(fila[1])
@@ -0,0 +1,133 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+# Máximo de resultados guardados entre todas las funciones cacheadas
+CACHE_MAX_ENTRADAS = 512
+
+class CacheLRU:
+    """Diccionario acotado con desalojo LRU y contadores de aciertos/fallos.
+
+    Con `ttl` (segundos) las entradas además caducan pasado ese tiempo.
+    """
+
+    def __init__(self, maximo=CACHE_MAX_ENTRADAS, ttl=None):
+        self.maximo = maximo
+        self.ttl = ttl
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.desalojos = 0
+
+    def obtener(self, clave):
+        """Devuelve (True, valor) si la clave está en caché, (False, None) si no."""
+        with self._lock:
+            try:
+                valor, caduca = self._datos[clave]
+            except KeyError:
+                self.fallos += 1
+                return False, None
+            if caduca is not None and caduca <= time.monotonic():
+                del self._datos[clave]
+                self.fallos += 1
+                return False, None
+            self._datos.move_to_end(clave)
+            self.aciertos += 1
+            return True, valor
+
+    def guardar(self, clave, valor, ttl=None):
+        ttl = ttl if ttl is not None else self.ttl
+        caduca = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._datos[clave] = (valor, caduca)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.maximo:
+                self._datos.popitem(last=False)
+                self.desalojos += 1
+
+    def descartar(self, clave):
+        with self._lock:
+            self._datos.pop(clave, None)
+
+    def descartar_si(self, condicion):
+        """Elimina las entradas cuyo valor cumple la condición."""
+        with self._lock:
+            for clave in [c for c, (v, _) in self._datos.items() if condicion(v)]:
+                del self._datos[clave]
+
+    def vaciar(self):
+        with self._lock:
+            self._datos.clear()
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                'entradas': len(self._datos),
+                'maximo': self.maximo,
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'desalojos': self.desalojos,
+            }
+
+_cache = CacheLRU()
+
+# Versión de datos por cuenta, más una global para lo que no pertenece a una
+# sola cuenta (usuarios y membresías). Cada escritura incrementa la versión
+# correspondiente, así que las entradas viejas dejan de coincidir y el LRU
+# las termina desalojando.
+#
+# Las versiones viven en memoria del proceso: con varias réplicas cada una
+# sólo ve las escrituras que pasan por ella.
+_versiones = {}
+_version_global = 0
+_lock_versiones = threading.Lock()
+
+def version_cuenta(cuenta_id):
+    return _versiones.get(int(cuenta_id), 0)
+
+def versiones_cuentas(cuenta_ids):
+    """((cuenta_id, versión), ...) ordenado: clave de caché de las lecturas
+    que cruzan varias cuentas."""
+    return tuple((int(cuenta_id), version_cuenta(cuenta_id)) for cuenta_id in sorted(cuenta_ids))
+
+def invalidar_cuenta(cuenta_id):
+    """Marca como obsoletos los resultados cacheados de la cuenta."""
+    with _lock_versiones:
+        cuenta_id = int(cuenta_id)
+        _versiones[cuenta_id] = _versiones.get(cuenta_id, 0) + 1
+
+def invalidar_todo():
+    """Marca como obsoletos todos los resultados (cambios de usuarios o cuentas)."""
+    global _version_global
+    with _lock_versiones:
+        _version_global += 1
+
+def cacheado(por_cuenta=True):
+    """Cachea el resultado de una función de lectura.
+
+    Con por_cuenta=True el primer argumento es el cuenta_id y la clave
+    incluye su versión de datos; si no, sólo depende de la versión global.
+    Los resultados se comparten entre sesiones, así que no deben mutarse.
+    """
+    def decorador(func):
+        @wraps(func)
+        def envoltura(*args, **kwargs):
+            version = (_version_global, version_cuenta(args[0]) if por_cuenta else None)
+            clave = (func.__module__, func.__qualname__, args, tuple(sorted(kwargs.items())), version)
+            encontrado, valor = _cache.obtener(clave)
+            if encontrado:
+                return valor
+            valor = func(*args, **kwargs)
+            _cache.guardar(clave, valor)
+            return valor
+        envoltura.sin_cache = func
+        return envoltura
+    return decorador
+
+def estadisticas_cache():
+    return _cache.estadisticas()
+
+def vaciar_cache():
+    _cache.vaciar()
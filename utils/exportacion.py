@@ -0,0 +1,101 @@
+"""Exportación de gastos a CSV y Parquet.
+
+Las filas se leen de un cursor por bloques y se escriben según llegan, sin
+pasar por un DataFrame, a un archivo temporal que sólo se queda en memoria
+mientras es pequeño. Así la memoria de trabajo no depende del tamaño de la
+cuenta; el archivo se genera únicamente cuando alguien pide la descarga.
+"""
+import csv
+import io
+import tempfile
+from datetime import date
+from decimal import Decimal
+
+from database import leer_por_bloques, rango_mes
+
+# Tamaño a partir del cual el archivo temporal pasa de memoria a disco
+MAX_EXPORTACION_EN_MEMORIA = 8 * 1024 * 1024
+
+COLUMNAS = ('id', 'fecha', 'lugar', 'cantidad', 'categoria', 'notas', 'usuario')
+
+FORMATOS = {
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+_CONSULTA = """
+    SELECT g.id, g.fecha, g.lugar, g.centimos, c.nombre AS categoria, g.notas, u.nombre AS usuario
+    FROM gastos g
+    JOIN categorias c ON g.categoria_id = c.id
+    JOIN usuarios u ON g.usuario_id = u.id
+    WHERE g.cuenta_id = ?
+"""
+
+def _consulta(cuenta_id, desde=None, hasta=None, categoria=None):
+    query, params = _CONSULTA, [cuenta_id]
+    if desde and hasta:
+        query += " AND g.fecha >= ? AND g.fecha < ?"
+        params.extend([desde, hasta])
+    if categoria:
+        query += " AND c.nombre = ?"
+        params.append(categoria)
+    return query + " ORDER BY g.fecha DESC, g.id DESC", params
+
+def _csv(bloques, destino):
+    texto = io.TextIOWrapper(destino, encoding='utf-8', newline='', write_through=True)
+    escritor = csv.writer(texto, lineterminator='\n')
+    escritor.writerow(COLUMNAS)
+    for bloque in bloques:
+        escritor.writerows(
+            (id_, fecha, lugar, f"{centimos / 100:.2f}", categoria, notas, usuario)
+            for id_, fecha, lugar, centimos, categoria, notas, usuario in bloque
+        )
+    # El wrapper cerraría el archivo al recogerse
+    texto.detach()
+
+def _esquema_parquet(pa):
+    return pa.schema([
+        ('id', pa.int64()),
+        ('fecha', pa.date32()),
+        ('lugar', pa.string()),
+        ('cantidad', pa.decimal128(12, 2)),
+        ('categoria', pa.string()),
+        ('notas', pa.string()),
+        ('usuario', pa.string()),
+    ])
+
+def _parquet(bloques, destino):
+    # pyarrow sólo se carga al exportar a Parquet
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    esquema = _esquema_parquet(pa)
+    with pq.ParquetWriter(destino, esquema, compression='zstd') as escritor:
+        for bloque in bloques:
+            ids, fechas, lugares, centimos, categorias, notas, usuarios = zip(*bloque)
+            escritor.write_batch(pa.record_batch([
+                pa.array(ids, pa.int64()),
+                pa.array([f if isinstance(f, date) else date.fromisoformat(f) for f in fechas], pa.date32()),
+                pa.array(lugares, pa.string()),
+                pa.array([Decimal(c).scaleb(-2) for c in centimos], pa.decimal128(12, 2)),
+                pa.array(categorias, pa.string()),
+                pa.array(notas, pa.string()),
+                pa.array(usuarios, pa.string()),
+            ], schema=esquema))
+
+def exportar_gastos(cuenta_id, formato, desde=None, hasta=None, categoria=None):
+    """Gastos de la cuenta en `formato` ('csv' o 'parquet'), como archivo abierto.
+
+    Se puede acotar a un rango de fechas [desde, hasta) y a una categoría.
+    El archivo devuelto está posicionado al principio.
+    """
+    escribir = {'csv': _csv, 'parquet': _parquet}[formato]
+    destino = tempfile.SpooledTemporaryFile(max_size=MAX_EXPORTACION_EN_MEMORIA)
+    query, params = _consulta(cuenta_id, desde, hasta, categoria)
+    with leer_por_bloques(query, params) as (_, bloques):
+        escribir(bloques, destino)
+    destino.seek(0)
+    return destino
+
+def exportar_gastos_mes(cuenta_id, mes, anio, formato, categoria=None):
+    return exportar_gastos(cuenta_id, formato, *rango_mes(anio, mes), categoria=categoria)
@@ -0,0 +1,297 @@
+import io
+import time
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+from database import get_db_connection, transaccion, huella_base, a_centimos, fecha_iso
+from utils.cache import invalidar_cuenta
+from utils.anomalias import AnotadorLote
+
+# Columnas que debe traer el CSV de gastos
+COLUMNAS_CSV = ('date', 'store', 'amount', 'category')
+FORMATO_FECHA_CSV = '%d/%m/%y'
+
+# Filas que se leen y procesan a la vez; acota la memoria con archivos grandes
+TAMANO_BLOQUE = 10000
+
+# Errores que se detallan en el resultado; el resto sólo se cuenta
+MAX_MENSAJES_ERROR = 20
+
+# Importes que se pasan a céntimos con floats sin perder exactitud: como
+# mucho dos decimales y por debajo de 2**53 céntimos
+_IMPORTE_SIMPLE = r'[+-]?\d{1,13}(?:\.\d{0,2})?'
+
+@dataclass
+class ResultadoImportacion:
+    importados: int = 0
+    duplicados: int = 0
+    errores: int = 0
+    filas: int = 0
+    segundos: float = 0.0
+    mensajes_error: list = field(default_factory=list)
+
+    @property
+    def filas_por_segundo(self):
+        return self.filas / self.segundos if self.segundos > 0 else 0.0
+
+    def mensaje(self):
+        mensaje = f"Se importaron {self.importados} gastos nuevos."
+        if self.duplicados > 0:
+            mensaje += f" Se omitieron {self.duplicados} gastos duplicados."
+        if self.errores > 0:
+            mensaje += f" Errores: {self.errores}"
+        mensaje += f" ({self.filas_por_segundo:,.0f} filas/s)"
+        return mensaje
+
+def _centimos_o_none(texto):
+    try:
+        centimos = a_centimos(texto)
+    except (ArithmeticError, ValueError):
+        return None
+    # Fuera de un entero de 64 bits no cabe en la columna
+    return centimos if abs(centimos) < 2 ** 63 else None
+
+def normalizar_bloque(bloque):
+    """Valida y normaliza un bloque del CSV columna a columna.
+
+    Devuelve (validos, invalidos): el DataFrame con fecha ISO, lugar,
+    importe en céntimos y categoría ya limpios, y la serie booleana de filas
+    rechazadas.
+    """
+    fechas = pd.to_datetime(bloque['date'].str.strip(), format=FORMATO_FECHA_CSV, errors='coerce')
+    # Los importes normales se convierten de golpe; el resto (más decimales,
+    # notación científica, textos que no son números) pasa por a_centimos(),
+    # con el mismo redondeo que la app y la API: "1.005" son 101 céntimos en
+    # todas partes y el gasto tiene la misma huella
+    importes = bloque['amount'].str.strip()
+    simples = importes.str.fullmatch(_IMPORTE_SIMPLE).fillna(False).astype(bool)
+    centimos = (pd.to_numeric(importes.where(simples), errors='coerce') * 100).round().astype('Int64')
+    if not simples.all():
+        centimos[~simples] = importes[~simples].map(_centimos_o_none).astype('Int64')
+    lugares = bloque['store'].str.strip()
+    categorias = bloque['category'].str.strip()
+
+    invalidos = (
+        fechas.isna() | centimos.isna()
+        | lugares.isna() | (lugares == '')
+        | categorias.isna() | (categorias == '')
+    )
+    validos = pd.DataFrame({
+        'fecha': fechas.dt.strftime('%Y-%m-%d'),
+        'lugar': lugares,
+        'centimos': centimos,
+        'categoria': categorias,
+        'categoria_clave': categorias.str.casefold(),
+    })[~invalidos]
+    validos['centimos'] = validos['centimos'].astype('int64')
+    return validos, invalidos
+
+def _mapa_categorias(conn, cuenta_id):
+    filas = conn.execute(
+        "SELECT id, nombre FROM categorias WHERE cuenta_id = ?", (cuenta_id,)
+    ).fetchall()
+    mapa = {}
+    for fila in filas:
+        mapa.setdefault(fila['nombre'].strip().casefold(), fila['id'])
+    return mapa
+
+def _crear_categorias_faltantes(conn, cuenta_id, validos, mapa):
+    nuevas = validos.drop_duplicates('categoria_clave')
+    nuevas = nuevas[~nuevas['categoria_clave'].isin(list(mapa))]
+    if nuevas.empty:
+        return mapa
+    conn.executemany(
+        "INSERT INTO categorias (nombre, cuenta_id) VALUES (?, ?)",
+        [(nombre, cuenta_id) for nombre in nuevas['categoria']]
+    )
+    return _mapa_categorias(conn, cuenta_id)
+
+def _huellas(validos, ocurrencias):
+    """Huella de cada fila numerando las repeticiones dentro del archivo.
+
+    `ocurrencias` lleva la cuenta entre bloques para que la numeración no
+    dependa del tamaño de bloque.
+    """
+    bases = pd.Series(
+        [huella_base(f, l, c) for f, l, c in zip(validos['fecha'], validos['lugar'], validos['centimos'])],
+        index=validos.index
+    )
+    previas = bases.map(ocurrencias).fillna(0).astype(int)
+    numero = previas + bases.groupby(bases).cumcount() + 1
+    ocurrencias.update(numero.groupby(bases).max().to_dict())
+    return (bases + ':' + numero.astype(str)).tolist()
+
+def _huellas_existentes(conn, cuenta_id, huellas):
+    """Las huellas del bloque que ya están en la cuenta."""
+    marcadores = ', '.join('?' * len(huellas))
+    filas = conn.execute(
+        f"SELECT huella FROM gastos WHERE cuenta_id = ? AND huella IN ({marcadores})",
+        [cuenta_id, *huellas]
+    ).fetchall()
+    return {fila[0] for fila in filas}
+
+def _insertar_validos(conn, cuenta_id, usuario_id, validos, mapa, anotador, ocurrencias):
+    """Inserta las filas ya normalizadas que no estén en la cuenta.
+
+    Devuelve (insertados, mapa de categorías actualizado).
+    """
+    mapa = _crear_categorias_faltantes(conn, cuenta_id, validos, mapa)
+    validos = validos.assign(
+        categoria_id=validos['categoria_clave'].map(mapa),
+        huella=_huellas(validos, ocurrencias),
+    )
+    
+    # Sólo las filas que no estaban ya cuentan para las estadísticas
+    existentes = _huellas_existentes(conn, cuenta_id, validos['huella'].tolist())
+    nuevos = validos[~validos['huella'].isin(existentes)]
+    anomalias = [
+        anotador.anotar(categoria_id, lugar, centimos)
+        for categoria_id, lugar, centimos in zip(nuevos['categoria_id'], nuevos['lugar'], nuevos['centimos'])
+    ]
+    # Las notas vacías llegan como NaN de pandas, no como None
+    notas = [n if isinstance(n, str) else None for n in nuevos['notas']] if 'notas' in nuevos else [None] * len(nuevos)
+    cursor = conn.executemany("""
+        INSERT INTO gastos
+        (cuenta_id, categoria_id, centimos, lugar, fecha, usuario_id, notas, huella, anomalia)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (cuenta_id, huella) DO NOTHING
+    """, zip(
+        [cuenta_id] * len(nuevos),
+        nuevos['categoria_id'].tolist(),
+        nuevos['centimos'].tolist(),
+        nuevos['lugar'].tolist(),
+        nuevos['fecha'].tolist(),
+        [usuario_id] * len(nuevos),
+        notas,
+        nuevos['huella'].tolist(),
+        anomalias,
+    ))
+    return cursor.rowcount, mapa
+
+def importar_csv(cuenta_id, usuario_id, archivo, tamano_bloque=TAMANO_BLOQUE, progreso=None):
+    """Importa gastos desde un CSV (date, store, amount, category).
+
+    Lee el archivo por bloques y cada bloque va en su propia transacción:
+    crea las categorías que falten, inserta con executemany y confirma. Así
+    el bloqueo de escritura de SQLite se suelta entre bloques y la app y la
+    API pueden escribir mientras dura una importación grande. Si se corta a
+    medias, volver a importar el archivo no duplica nada: los gastos ya
+    importados se descartan por el índice único (cuenta_id, huella), sin
+    cargar el historial de la cuenta. Los nuevos se puntúan en orden con el
+    detector de gastos inusuales. Si se pasa `progreso`, se llama con las
+    filas leídas tras cada bloque.
+    """
+    resultado = ResultadoImportacion()
+    inicio = time.perf_counter()
+
+    try:
+        lector = pd.read_csv(archivo, dtype=str, chunksize=tamano_bloque)
+    except pd.errors.EmptyDataError:
+        raise ValueError("El archivo CSV está vacío")
+    anotador = AnotadorLote(get_db_connection(), cuenta_id)
+    ocurrencias = {}
+    for bloque in lector:
+        faltantes = [c for c in COLUMNAS_CSV if c not in bloque.columns]
+        if faltantes:
+            raise ValueError(f"Faltan columnas en el CSV: {', '.join(faltantes)}")
+
+        validos, invalidos = normalizar_bloque(bloque)
+        for indice in bloque.index[invalidos]:
+            if len(resultado.mensajes_error) < MAX_MENSAJES_ERROR:
+                resultado.mensajes_error.append(f"Fila {indice + 2}: fecha, lugar, cantidad o categoría inválidos")
+        resultado.errores += int(invalidos.sum())
+        resultado.filas += len(bloque)
+
+        if not validos.empty:
+            with transaccion() as conn:
+                # Las categorías se releen: entre bloques otros pueden crear alguna
+                insertados, _ = _insertar_validos(
+                    conn, cuenta_id, usuario_id, validos, _mapa_categorias(conn, cuenta_id), anotador, ocurrencias
+                )
+                anotador.guardar()
+            resultado.importados += insertados
+            resultado.duplicados += len(validos) - insertados
+            if insertados:
+                invalidar_cuenta(cuenta_id)
+        if progreso:
+            progreso(resultado.filas)
+
+    resultado.segundos = time.perf_counter() - inicio
+    return resultado
+
+def normalizar_registros(registros):
+    """Valida gastos recibidos como dicts (fecha, lugar, cantidad, categoria y,
+    opcionalmente, notas).
+
+    Devuelve (validos, errores): el DataFrame con las columnas de
+    normalizar_bloque() más notas, y una lista de (posición, mensaje) con las
+    filas rechazadas.
+    """
+    filas, errores = [], []
+    for posicion, registro in enumerate(registros):
+        if not isinstance(registro, dict):
+            errores.append((posicion, "Se esperaba un objeto"))
+            continue
+        try:
+            fecha = fecha_iso(registro.get('fecha'))
+        except (TypeError, ValueError):
+            errores.append((posicion, "fecha inválida (YYYY-MM-DD)"))
+            continue
+        cantidad = registro.get('cantidad')
+        try:
+            if isinstance(cantidad, bool) or not isinstance(cantidad, (int, float, str)):
+                raise ValueError(cantidad)
+            centimos = a_centimos(cantidad)
+        except (ArithmeticError, ValueError):
+            errores.append((posicion, "cantidad inválida"))
+            continue
+        lugar, categoria, notas = registro.get('lugar'), registro.get('categoria'), registro.get('notas')
+        if not isinstance(lugar, str) or not lugar.strip():
+            errores.append((posicion, "falta el lugar"))
+        elif not isinstance(categoria, str) or not categoria.strip():
+            errores.append((posicion, "falta la categoría"))
+        elif notas is not None and not isinstance(notas, str):
+            errores.append((posicion, "notas inválidas"))
+        else:
+            filas.append((fecha, lugar.strip(), centimos, categoria.strip(), categoria.strip().casefold(), notas or None))
+    validos = pd.DataFrame(filas, columns=['fecha', 'lugar', 'centimos', 'categoria', 'categoria_clave', 'notas'])
+    validos['centimos'] = validos['centimos'].astype('int64')
+    return validos, errores
+
+def importar_registros(cuenta_id, usuario_id, validos):
+    """Inserta en una transacción los gastos de normalizar_registros().
+
+    Igual que importar_csv(): crea las categorías que falten y descarta los
+    gastos que ya estén en la cuenta, así que repetir un envío no duplica nada.
+    """
+    resultado = ResultadoImportacion(filas=len(validos))
+    inicio = time.perf_counter()
+    if not validos.empty:
+        with transaccion() as conn:
+            anotador = AnotadorLote(conn, cuenta_id)
+            resultado.importados, _ = _insertar_validos(
+                conn, cuenta_id, usuario_id, validos, _mapa_categorias(conn, cuenta_id), anotador, {}
+            )
+            anotador.guardar()
+    resultado.duplicados = len(validos) - resultado.importados
+    resultado.segundos = time.perf_counter() - inicio
+    if resultado.importados:
+        invalidar_cuenta(cuenta_id)
+    return resultado
+
+def importar_en_segundo_plano(progreso, cuenta_id, usuario_id, datos):
+    """Trabajo de importación (ver utils.trabajos): importa el CSV de `datos`."""
+    # Estimación por líneas; basta para la barra de progreso
+    total = max(datos.count(b'\n') - 1, 1)
+    progreso(0, total)
+    resultado = importar_csv(
+        cuenta_id, usuario_id, io.BytesIO(datos),
+        progreso=lambda filas: progreso(filas, total)
+    )
+    return {
+        'mensaje': resultado.mensaje(),
+        'mensajes_error': resultado.mensajes_error,
+        'importados': resultado.importados,
+        'filas_por_segundo': round(resultado.filas_por_segundo),
+    }
@@ -0,0 +1,230 @@
+"""Instantáneas columnares en disco de los gastos de cada cuenta.
+
+Cada cuenta tiene un directorio con una columna por archivo (arrays de NumPy
+en binario, sin cabecera) y un manifiesto JSON con las filas válidas y la
+firma de los datos de los que salen. Las páginas de análisis las abren con
+np.memmap: todas las sesiones y procesos del servidor comparten las mismas
+páginas de la caché del sistema en vez de guardar cada uno su copia.
+
+La firma es (cambios, filas): `cambios` lo incrementan los triggers de
+versiones_cuentas en cada modificación o borrado y `filas` sale de
+gastos_mensuales, así que comprobarla son dos lecturas por clave. Si desde
+la instantánea sólo ha habido altas, se pone al día añadiendo al final de
+los archivos los gastos con id mayor que el último que tiene; si no, se
+reconstruye en segundo plano y mientras tanto se usa SQL.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from dataclasses import dataclass
+from contextlib import contextmanager
+
+import numpy as np
+
+import database
+from database import get_db_connection, get_backend, leer_por_bloques, firma_cuenta
+from utils import trabajos
+
+try:
+    import fcntl
+except ImportError:  # Windows: sólo se coordinan los hilos del proceso
+    fcntl = None
+
+_log = logging.getLogger(__name__)
+
+INSTANTANEAS_DIR = os.environ.get(
+    'INSTANTANEAS_DIR', os.path.join(tempfile.gettempdir(), 'geldtrack-instantaneas')
+)
+
+# Altas que se añaden a la instantánea en la propia petición; con más se
+# reconstruye en segundo plano
+MAX_FILAS_INCREMENTO = 20000
+
+TRABAJO_INSTANTANEA = 'instantanea'
+
+# Columnas y su tipo; fecha en días desde 1970-01-01
+COLUMNAS = {
+    'id': np.int64,
+    'fecha': np.int32,
+    'categoria_id': np.int32,
+    'centimos': np.int64,
+}
+
+_CONSULTA = "SELECT id, fecha, categoria_id, centimos FROM gastos WHERE cuenta_id = ?"
+
+@dataclass(frozen=True)
+class Instantanea:
+    filas: int
+    cambios: int
+    columnas: dict   # nombre -> array de sólo lectura (memmap)
+
+    def __getitem__(self, columna):
+        return self.columnas[columna]
+
+def _directorio(cuenta_id):
+    # Una carpeta por base de datos, para no mezclar cuentas con el mismo id
+    backend = get_backend()
+    destino = getattr(backend, 'url', None) or os.path.abspath(database.DB_PATH)
+    base = hashlib.sha1(destino.encode()).hexdigest()[:12]
+    return os.path.join(INSTANTANEAS_DIR, base, str(int(cuenta_id)))
+
+def _archivo(directorio, generacion, columna):
+    return os.path.join(directorio, f"{columna}.{generacion}.bin")
+
+def _leer_manifiesto(directorio):
+    try:
+        with open(os.path.join(directorio, 'manifiesto.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _escribir_manifiesto(directorio, manifiesto):
+    # os.replace es atómico: los lectores ven el manifiesto viejo o el nuevo
+    temporal = os.path.join(directorio, 'manifiesto.json.tmp')
+    with open(temporal, 'w') as f:
+        json.dump(manifiesto, f)
+    os.replace(temporal, os.path.join(directorio, 'manifiesto.json'))
+
+@contextmanager
+def _bloqueo(directorio, esperar):
+    """Exclusión entre procesos sobre la instantánea; da False si no se obtuvo."""
+    os.makedirs(directorio, exist_ok=True)
+    with open(os.path.join(directorio, '.bloqueo'), 'w') as f:
+        if fcntl is None:
+            yield True
+            return
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX if esperar else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def _a_columnas(bloque):
+    ids, fechas, categorias, centimos = zip(*bloque)
+    return {
+        'id': np.array(ids, dtype=np.int64),
+        'fecha': np.array(fechas, dtype='datetime64[D]').astype(np.int32),
+        'categoria_id': np.array(categorias, dtype=np.int32),
+        'centimos': np.array(centimos, dtype=np.int64),
+    }
+
+def _abrir(directorio, manifiesto):
+    filas = manifiesto['filas']
+    columnas = {}
+    for columna, tipo in COLUMNAS.items():
+        if filas == 0:
+            datos = np.zeros(0, dtype=tipo)
+            datos.flags.writeable = False
+        else:
+            datos = np.memmap(
+                _archivo(directorio, manifiesto['generacion'], columna), dtype=tipo, mode='r', shape=(filas,)
+            )
+        columnas[columna] = datos
+    return Instantanea(filas, manifiesto['cambios'], columnas)
+
+def reconstruir_instantanea(progreso, cuenta_id):
+    """Trabajo (ver utils.trabajos) que escribe desde cero la instantánea.
+
+    El contador de cambios se lee antes que los gastos: si algo cambia entre
+    medias, la instantánea queda con una firma vieja y se rehará, nunca al
+    revés.
+    """
+    directorio = _directorio(cuenta_id)
+    with _bloqueo(directorio, esperar=True):
+        anterior = _leer_manifiesto(directorio)
+        generacion = (anterior['generacion'] + 1) if anterior else 0
+        cambios, total = firma_cuenta(get_db_connection(), cuenta_id)
+        progreso(0, total)
+
+        filas, ultimo_id = 0, 0
+        archivos = {c: open(_archivo(directorio, generacion, c), 'wb') for c in COLUMNAS}
+        try:
+            with leer_por_bloques(_CONSULTA + " ORDER BY id", (cuenta_id,)) as (_, bloques):
+                for bloque in bloques:
+                    for columna, datos in _a_columnas(bloque).items():
+                        archivos[columna].write(datos.tobytes())
+                    filas += len(bloque)
+                    ultimo_id = bloque[-1][0]
+                    progreso(filas, total)
+        finally:
+            for archivo in archivos.values():
+                archivo.close()
+
+        _escribir_manifiesto(directorio, {
+            'generacion': generacion,
+            'cambios': cambios,
+            'filas': filas,
+            'ultimo_id': int(ultimo_id),
+        })
+        # Quien aún tenga abierta la generación anterior la sigue leyendo
+        # hasta cerrarla
+        if anterior:
+            for columna in COLUMNAS:
+                try:
+                    os.remove(_archivo(directorio, anterior['generacion'], columna))
+                except OSError:
+                    pass
+    return {'filas': filas}
+
+def _ampliar(directorio, manifiesto, cuenta_id, filas_esperadas):
+    """Añade las altas posteriores a la instantánea; None si no cuadran."""
+    nuevas = get_db_connection().execute(
+        _CONSULTA + " AND id > ? ORDER BY id", (cuenta_id, manifiesto['ultimo_id'])
+    ).fetchall()
+    # Con PostgreSQL una transacción puede confirmar un id menor después de
+    # otro mayor; si faltan o sobran filas, hay que reconstruir
+    if manifiesto['filas'] + len(nuevas) != filas_esperadas:
+        return None
+    for columna, datos in _a_columnas([tuple(f) for f in nuevas]).items():
+        with open(_archivo(directorio, manifiesto['generacion'], columna), 'r+b') as f:
+            # Descarta los restos de una ampliación que no llegó al manifiesto
+            f.truncate(manifiesto['filas'] * np.dtype(COLUMNAS[columna]).itemsize)
+            f.seek(0, os.SEEK_END)
+            f.write(datos.tobytes())
+    manifiesto = dict(manifiesto, filas=filas_esperadas, ultimo_id=int(nuevas[-1][0]))
+    _escribir_manifiesto(directorio, manifiesto)
+    return manifiesto
+
+def obtener_instantanea(cuenta_id):
+    """La instantánea al día de la cuenta, o None si hay que ir a SQL.
+
+    Si ha quedado vieja se amplía con las altas o se pide su reconstrucción
+    en segundo plano.
+    """
+    directorio = _directorio(cuenta_id)
+    try:
+        cambios, filas = firma_cuenta(get_db_connection(), cuenta_id)
+        manifiesto = _leer_manifiesto(directorio)
+        if manifiesto and (manifiesto['cambios'], manifiesto['filas']) == (cambios, filas):
+            return _abrir(directorio, manifiesto)
+
+        if (manifiesto and manifiesto['cambios'] == cambios
+                and 0 < filas - manifiesto['filas'] <= MAX_FILAS_INCREMENTO):
+            with _bloqueo(directorio, esperar=False) as obtenido:
+                if not obtenido:
+                    # Otro proceso la está escribiendo
+                    return None
+                # Puede que la ampliara otro mientras tanto
+                manifiesto = _leer_manifiesto(directorio)
+                if manifiesto and (manifiesto['cambios'], manifiesto['filas']) == (cambios, filas):
+                    return _abrir(directorio, manifiesto)
+                if manifiesto and manifiesto['cambios'] == cambios and manifiesto['filas'] < filas:
+                    manifiesto = _ampliar(directorio, manifiesto, cuenta_id, filas)
+                    if manifiesto:
+                        return _abrir(directorio, manifiesto)
+    except (OSError, ValueError) as e:
+        # Archivos borrados o truncados desde fuera (limpieza de /tmp...):
+        # se rehace
+        _log.warning("Instantánea de la cuenta %s no disponible: %s", cuenta_id, e)
+
+    # Consultar antes de enviar evita una escritura por petición mientras
+    # la reconstrucción está en cola
+    if trabajos.trabajo_activo(cuenta_id, TRABAJO_INSTANTANEA) is None:
+        trabajos.enviar(TRABAJO_INSTANTANEA, cuenta_id, None, reconstruir_instantanea, cuenta_id)
+    return None
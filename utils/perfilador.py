@@ -0,0 +1,152 @@
+"""Perfilador de reruns: en qué se va el tiempo de cada página.
+
+Cada rerun del menú principal se mide entero y se reparte en fases:
+
+- sql: lo que tardan las consultas (lo cuenta utils.trazas por hilo; con
+  SQL_TRAZAS=0 queda dentro de widgets);
+- menu, datos, graficos: los bloques marcados con `fase()` en app.py, las
+  páginas y database.leer_df (selector de cuenta y barra lateral, cálculos
+  con pandas/NumPy, construcción y serialización de las figuras de Plotly),
+  sin el SQL que hagan dentro;
+- widgets: el resto, es decir, la emisión de elementos de Streamlit.
+
+Es opcional (PERFILADOR=1 o el interruptor de Configuración); apagado,
+medir_rerun() y fase() no hacen nada. Las últimas MAX_MUESTRAS mediciones
+de cada página se guardan en memoria del proceso, compartidas entre
+sesiones. Los reruns cortados por st.rerun() o st.stop() no se cuentan.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+from utils import trazas
+
+ACTIVO = os.environ.get('PERFILADOR') == '1'
+
+# Reruns que se conservan por página
+MAX_MUESTRAS = 500
+
+FASES = ('menu', 'sql', 'datos', 'graficos', 'widgets')
+
+# Límites superiores (ms) de los intervalos de los histogramas; el último
+# intervalo no tiene límite
+LIMITES_MS = (10, 25, 50, 100, 250, 500, 1000, 2500)
+
+_muestras = {}  # página -> deque de {fase: ms, 'total': ms}
+_bloqueo = threading.Lock()
+_local = threading.local()
+
+class Medicion:
+    """El rerun en curso de un hilo."""
+
+    def __init__(self):
+        self.pagina = None
+        self.inicio = time.perf_counter()
+        self.sql_inicio = trazas.ms_en_hilo()
+        self.fases = dict.fromkeys(FASES, 0.0)
+        # Por cada fase abierta: (ms, sql) de sus fases hijas ya cerradas
+        self.pila = []
+
+def activar(activo):
+    global ACTIVO
+    ACTIVO = bool(activo)
+
+@contextmanager
+def medir_rerun():
+    """Mide el bloque como un rerun; asignar `pagina` a lo que devuelve."""
+    if not ACTIVO or getattr(_local, 'medicion', None) is not None:
+        yield Medicion()
+        return
+    medicion = _local.medicion = Medicion()
+    try:
+        yield medicion
+    except BaseException:
+        _local.medicion = None
+        raise
+    _local.medicion = None
+
+    total = (time.perf_counter() - medicion.inicio) * 1000
+    fases = dict(medicion.fases, sql=trazas.ms_en_hilo() - medicion.sql_inicio)
+    fases['widgets'] = max(total - sum(v for f, v in fases.items() if f != 'widgets'), 0.0)
+    fases['total'] = total
+    with _bloqueo:
+        _muestras.setdefault(medicion.pagina or '?', deque(maxlen=MAX_MUESTRAS)).append(fases)
+
+@contextmanager
+def fase(nombre):
+    """Suma la duración del bloque, sin su SQL ni sus fases anidadas, a `nombre`."""
+    medicion = getattr(_local, 'medicion', None)
+    if medicion is None:
+        yield
+        return
+    inicio, sql_inicio = time.perf_counter(), trazas.ms_en_hilo()
+    medicion.pila.append([0.0, 0.0])
+    try:
+        yield
+    finally:
+        hijas_ms, hijas_sql = medicion.pila.pop()
+        ms = (time.perf_counter() - inicio) * 1000
+        sql = trazas.ms_en_hilo() - sql_inicio
+        medicion.fases[nombre] += max(ms - hijas_ms - (sql - hijas_sql), 0.0)
+        if medicion.pila:
+            medicion.pila[-1][0] += ms
+            medicion.pila[-1][1] += sql
+
+def _copia():
+    with _bloqueo:
+        return {pagina: list(muestras) for pagina, muestras in _muestras.items()}
+
+def resumen():
+    """Por página y fase: muestras, media, p50, p95 y máximo en ms."""
+    filas = []
+    for pagina, muestras in sorted(_copia().items()):
+        for nombre in ('total',) + FASES:
+            valores = np.array([m[nombre] for m in muestras])
+            filas.append({
+                'pagina': pagina,
+                'fase': nombre,
+                'muestras': len(valores),
+                'media_ms': float(valores.mean()),
+                'p50_ms': float(np.percentile(valores, 50)),
+                'p95_ms': float(np.percentile(valores, 95)),
+                'maximo_ms': float(valores.max()),
+            })
+    return filas
+
+def etiquetas_histograma():
+    bordes = (0,) + LIMITES_MS
+    return [f"{a}-{b} ms" for a, b in zip(bordes, LIMITES_MS)] + [f">{LIMITES_MS[-1]} ms"]
+
+def histograma(pagina):
+    """Reruns de la página por intervalo de duración, para el total y cada fase.
+
+    Devuelve {fase: lista de cuentas}, alineada con etiquetas_histograma().
+    """
+    muestras = _copia().get(pagina, [])
+    return {
+        nombre: np.bincount(
+            np.searchsorted(LIMITES_MS, [m[nombre] for m in muestras], side='right'),
+            minlength=len(LIMITES_MS) + 1
+        ).tolist()
+        for nombre in ('total',) + FASES
+    }
+
+def paginas():
+    with _bloqueo:
+        return sorted(_muestras)
+
+def exportar():
+    """Resumen y muestras en JSON."""
+    return json.dumps({
+        'resumen': resumen(),
+        'muestras': _copia(),
+    }, ensure_ascii=False, indent=2)
+
+def reiniciar():
+    with _bloqueo:
+        _muestras.clear()
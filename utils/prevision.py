@@ -0,0 +1,135 @@
+"""Previsión del gasto a fin de mes por categoría.
+
+A lo gastado en lo que va de mes se le suma lo que cada categoría suele
+gastar en el resto del mes: en cada uno de los últimos meses se mira cuánto
+faltaba por gastar en el día equivalente (su perfil dentro del mes). La
+media de ese resto da la previsión y su dispersión entre meses el intervalo.
+
+Todas las categorías, y el total de la cuenta como una fila más, se calculan
+de una vez sobre la matriz diaria de utils.analitica.
+"""
+import calendar
+from dataclasses import dataclass
+from statistics import NormalDist
+
+import numpy as np
+
+from database import get_db_connection
+from utils.analitica import cargar_series
+from utils.cache import cacheado
+
+# Meses completos anteriores que se usan como historia
+HISTORIA_MESES = 12
+# Con menos meses de historia se extrapola el ritmo del mes actual
+MIN_MESES_HISTORIA = 2
+# Probabilidad que cubre el intervalo de previsión
+NIVEL_CONFIANZA = 0.8
+
+@dataclass(frozen=True)
+class PrevisionMes:
+    """Importes en céntimos; una posición por categoría de la cuenta."""
+    dia: int
+    dias_mes: int
+    meses_historia: int
+    categoria_ids: tuple
+    categorias: tuple
+    presupuesto: np.ndarray
+    gastado: np.ndarray
+    prevista: np.ndarray
+    minimo: np.ndarray
+    maximo: np.ndarray
+    total: tuple  # (gastado, prevista, minimo, maximo) de toda la cuenta
+
+    def de_categoria(self, categoria_id):
+        """(gastado, prevista, minimo, maximo) de una categoría, o None."""
+        try:
+            i = self.categoria_ids.index(int(categoria_id))
+        except ValueError:
+            return None
+        return int(self.gastado[i]), int(self.prevista[i]), int(self.minimo[i]), int(self.maximo[i])
+
+    def sobre_presupuesto(self):
+        """Índices de las categorías con presupuesto cuya previsión lo supera."""
+        return np.flatnonzero((self.presupuesto > 0) & (self.prevista > self.presupuesto))
+
+def prever_fin_de_mes(series, hoy):
+    """Previsión para el mes de `hoy` a partir de una SeriesGastos.
+
+    Devuelve (gastado, prevista, minimo, maximo, meses_historia): arrays con
+    una fila por categoría de la serie más una última con el total.
+    """
+    matriz = series.centimos
+    matriz = np.vstack([matriz, matriz.sum(axis=0, keepdims=True)])
+    # Sumas prefijas con un 0 delante: el gasto de [a, b) es P[:, b] - P[:, a]
+    prefijo = np.zeros((matriz.shape[0], matriz.shape[1] + 1), dtype=np.int64)
+    np.cumsum(matriz, axis=1, out=prefijo[:, 1:])
+
+    def indice(dias):
+        return np.clip((dias - series.inicio).astype(np.int64), 0, matriz.shape[1])
+
+    dia = hoy.day
+    dias_mes = calendar.monthrange(hoy.year, hoy.month)[1]
+    mes_actual = np.datetime64(hoy, 'M')
+    primero = indice(mes_actual.astype('datetime64[D]'))
+    gastado = prefijo[:, indice(np.datetime64(hoy, 'D') + 1)] - prefijo[:, primero]
+
+    # Meses de historia con datos y, en cada uno, el día equivalente a hoy
+    meses = mes_actual - np.arange(1, HISTORIA_MESES + 1)
+    meses = meses[meses >= series.inicio.astype('datetime64[M]')]
+    inicios = meses.astype('datetime64[D]')
+    largos = ((meses + 1).astype('datetime64[D]') - inicios).astype(np.int64)
+    equivalentes = np.clip(np.rint(dia * largos / dias_mes).astype(np.int64), 1, largos)
+    hasta_hoy = prefijo[:, indice(inicios + equivalentes)] - prefijo[:, indice(inicios)]
+    completos = prefijo[:, indice(inicios + largos)] - prefijo[:, indice(inicios)]
+    resto = completos - hasta_hoy
+
+    if len(meses) >= MIN_MESES_HISTORIA:
+        prevista = gastado + resto.mean(axis=1)
+        z = NormalDist().inv_cdf(0.5 + NIVEL_CONFIANZA / 2)
+        margen = z * resto.std(axis=1, ddof=1) * np.sqrt(1 + 1 / len(meses))
+        minimo = np.maximum(gastado, prevista - margen)
+        maximo = prevista + margen
+    else:
+        prevista = gastado * dias_mes / dia
+        minimo = gastado
+        maximo = 2 * prevista - gastado
+
+    redondear = lambda valores: np.rint(valores).astype(np.int64)
+    return redondear(gastado), redondear(prevista), redondear(minimo), redondear(maximo), len(meses)
+
+@cacheado()
+def prevision_mes(cuenta_id, hoy):
+    """Previsión de fin de mes de todas las categorías de la cuenta.
+
+    Se cachea por (cuenta, día) hasta la siguiente escritura en la cuenta.
+    """
+    categorias = get_db_connection().execute(
+        "SELECT id, nombre, presupuesto_mensual FROM categorias WHERE cuenta_id = ? ORDER BY nombre",
+        (cuenta_id,)
+    ).fetchall()
+    series = cargar_series(cuenta_id)
+    gastado, prevista, minimo, maximo, meses_historia = prever_fin_de_mes(series, hoy)
+
+    # Las categorías sin gastos no están en la serie: quedan a cero
+    fila_serie = {i: n for n, i in enumerate(series.categoria_ids.tolist())}
+    filas = np.array([fila_serie.get(c['id'], -1) for c in categorias], dtype=np.int64)
+    con_datos = filas >= 0
+
+    def por_categoria(valores):
+        resultado = np.zeros(len(categorias), dtype=np.int64)
+        resultado[con_datos] = valores[filas[con_datos]]
+        return resultado
+
+    return PrevisionMes(
+        dia=hoy.day,
+        dias_mes=calendar.monthrange(hoy.year, hoy.month)[1],
+        meses_historia=meses_historia,
+        categoria_ids=tuple(c['id'] for c in categorias),
+        categorias=tuple(c['nombre'] for c in categorias),
+        presupuesto=np.rint(np.array([c['presupuesto_mensual'] or 0 for c in categorias], dtype=float) * 100).astype(np.int64),
+        gastado=por_categoria(gastado),
+        prevista=por_categoria(prevista),
+        minimo=por_categoria(minimo),
+        maximo=por_categoria(maximo),
+        total=(int(gastado[-1]), int(prevista[-1]), int(minimo[-1]), int(maximo[-1])),
+    )
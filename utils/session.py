@@ -1,26 +1,48 @@
 import streamlit as st
 from datetime import datetime, timedelta
 import extra_streamlit_components as stx
+# Las sesiones en sí están en utils.autenticacion; aquí sólo las cookies
+from utils.autenticacion import revocar_sesion
+
+# Única cookie de login: un token opaco que se valida contra la tabla sesiones
+COOKIE_SESION = 'sesion'
+
+# Cookies que escribe la app (user_id, user_name y user_email son del
+# sistema anterior y sólo se borran)
+COOKIES_APP = (COOKIE_SESION, 'cuenta_actual', 'user_id', 'user_name', 'user_email')
+
+def preparar_cookie_manager():
+    """Crea el CookieManager de esta ejecución; llamar al principio de cada una.
+
+    Streamlit no admite dos componentes con la misma key en una ejecución, así
+    que el resto del código reutiliza este mediante get_cookie_manager().
+    """
+    st.session_state._cookie_manager = stx.CookieManager(key="cookies_manager")
+    return st.session_state._cookie_manager
 
 def get_cookie_manager():
-    return stx.CookieManager(key="cookies_manager")
+    return st.session_state.get('_cookie_manager') or preparar_cookie_manager()
 
 def set_current_account(cuenta_id):
     st.session_state.cuenta_actual = cuenta_id
     cookie_manager = get_cookie_manager()
     expiry = datetime.now() + timedelta(days=30)
-    cookie_manager.set('cuenta_actual', str(cuenta_id), expires_at=expiry)
+    cookie_manager.set('cuenta_actual', str(cuenta_id), key="set_cuenta_actual", expires_at=expiry)
 
 def clear_session():
+    token = st.session_state.get('sesion_token')
+    if token:
+        revocar_sesion(token)
+    cookie_manager = get_cookie_manager()
+
     # Primero limpiar el state
     for key in list(st.session_state.keys()):
         del st.session_state[key]
     
     # Luego limpiar cookies
-    cookie_manager = get_cookie_manager()
-    all_cookies = cookie_manager.get_all()
-    for cookie_name in all_cookies:
-        cookie_manager.delete(cookie_name)
+    for cookie_name in COOKIES_APP:
+        if cookie_manager.get(cookie_name) is not None:
+            cookie_manager.delete(cookie_name, key=f"delete_{cookie_name}")
     
     # Forzar rerun
-    st.rerun() 
\ No newline at end of file
+    st.rerun()
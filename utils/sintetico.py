@@ -0,0 +1,305 @@
+"""Bases de datos sintéticas y reproducibles para medir el rendimiento.
+
+Genera usuarios, cuentas (algunas compartidas), categorías y gastos con
+distribuciones parecidas a las de un extracto real: unos pocos comercios
+concentran la mayoría de los cargos (Zipf), hay más gastos en fin de semana,
+en diciembre y en verano, los recibos fijos caen a principios de mes y los
+importes siguen una lognormal propia de cada categoría. Con la misma
+configuración (semilla y fecha final incluidas) los datos salen idénticos.
+
+Los gastos se insertan como lo haría una importación: con su huella y su
+puntuación de anomalía, y con los triggers manteniendo gastos_mensuales,
+el índice de búsqueda y los contadores de versiones.
+
+    python -m utils.sintetico finanzas_bench.db --gastos 1000000 --cuentas 4
+"""
+import argparse
+import csv
+import io
+import time
+from dataclasses import dataclass, field
+from datetime import date
+
+import bcrypt
+import numpy as np
+
+import database
+from database import transaccion, huella_base
+from utils.anomalias import AnotadorLote
+
+# Contraseña de todos los usuarios generados
+PASSWORD_SINTETICA = 'sintetico'
+
+# Filas por executemany al insertar gastos
+TAMANO_LOTE = 50000
+
+# (nombre, peso en número de gastos, mediana en euros, dispersión de la
+# lognormal, presupuesto mensual, recibo de principio de mes, comercios)
+CATEGORIAS = (
+    ('Supermercado', 24, 38.0, 0.60, 450, False,
+     ('Mercadona', 'Lidl', 'Carrefour', 'Aldi', 'Dia', 'Eroski', 'Alcampo', 'Consum', 'Ahorramas')),
+    ('Restaurantes', 12, 24.0, 0.70, 200, False,
+     ('Telepizza', 'Foster\'s Hollywood', 'VIPS', 'Goiko', 'Casa Lucio', 'La Tagliatella', 'Taberna del Puerto')),
+    ('Cafeterías', 12, 3.2, 0.45, 60, False,
+     ('Starbucks', 'Café Comercial', 'Granier', 'Panaría', 'Bar Manolo', '100 Montaditos')),
+    ('Transporte', 11, 14.0, 0.80, 120, False,
+     ('Repsol', 'Cepsa', 'BP', 'Renfe', 'Metro', 'Cabify', 'Uber', 'EMT', 'BlaBlaCar')),
+    ('Ocio', 7, 18.0, 0.75, 100, False,
+     ('Cines Yelmo', 'Fnac', 'Steam', 'Ticketmaster', 'Bolera Chamartín', 'Parque Warner')),
+    ('Ropa', 5, 42.0, 0.65, 80, False,
+     ('Zara', 'Primark', 'H&M', 'Decathlon', 'Mango', 'El Corte Inglés', 'Pull&Bear')),
+    ('Hogar', 5, 30.0, 0.90, 70, False,
+     ('IKEA', 'Leroy Merlin', 'Amazon', 'Bricomart', 'MediaMarkt', 'Tiger')),
+    ('Salud', 4, 22.0, 0.70, 50, False,
+     ('Farmacia Central', 'Farmacia López', 'Clínica Dental Sonrisas', 'Óptica Universitaria', 'Sanitas')),
+    ('Suscripciones', 4, 11.0, 0.35, 40, True,
+     ('Netflix', 'Spotify', 'HBO Max', 'Amazon Prime', 'Disney+', 'iCloud')),
+    ('Suministros', 3, 65.0, 0.45, 180, True,
+     ('Iberdrola', 'Endesa', 'Naturgy', 'Canal de Isabel II', 'Movistar', 'Vodafone', 'Orange')),
+    ('Mascotas', 3, 26.0, 0.60, 40, False,
+     ('Tiendanimal', 'Kiwoko', 'Clínica Veterinaria Fauna')),
+    ('Educación', 2, 45.0, 0.80, 60, False,
+     ('Casa del Libro', 'Academia Idiomas Sol', 'Udemy', 'Papelería Goya')),
+    ('Regalos', 2, 35.0, 0.80, 40, False,
+     ('El Corte Inglés', 'Amazon', 'Floristería Lirio', 'Joyería Aurora')),
+    ('Viajes', 2, 140.0, 1.00, 150, False,
+     ('Iberia', 'Vueling', 'Ryanair', 'Booking.com', 'Airbnb', 'NH Hoteles')),
+    ('Vivienda', 1, 850.0, 0.08, 900, True,
+     ('Alquiler', 'Comunidad de propietarios', 'Mapfre Hogar')),
+)
+
+CIUDADES = (
+    'Madrid', 'Barcelona', 'Valencia', 'Sevilla', 'Zaragoza', 'Málaga',
+    'Bilbao', 'Alicante', 'Córdoba', 'Valladolid', 'Vigo', 'Granada',
+)
+
+NOTAS = (
+    'compra semanal', 'cena con amigos', 'reembolsable', 'pago compartido',
+    'regalo de cumpleaños', 'viaje de trabajo', 'con tarjeta de empresa',
+    'devolver la mitad', 'oferta', 'pedido online',
+)
+
+# Gastos con nota
+FRACCION_NOTAS = 0.08
+
+# Factor por día de la semana (lunes primero) y por mes
+FACTOR_DIA_SEMANA = np.array([0.90, 0.90, 0.95, 1.00, 1.25, 1.40, 0.75])
+FACTOR_MES = np.array([0.85, 0.90, 0.95, 1.00, 1.00, 1.05, 1.15, 1.20, 0.95, 1.00, 1.10, 1.35])
+
+# Crecimiento anual del gasto
+TENDENCIA_ANUAL = 0.03
+
+@dataclass(frozen=True)
+class ConfigSintetica:
+    usuarios: int = 3
+    cuentas: int = 4
+    categorias: int = 12
+    gastos: int = 100000
+    anios: int = 3
+    semilla: int = 0
+    # Último día con gastos; fijarla hace la base idéntica entre días
+    hasta: date = field(default_factory=date.today)
+
+def _categorias(n):
+    """Las n primeras categorías de CATEGORIAS, completadas con genéricas."""
+    categorias = list(CATEGORIAS[:n])
+    for i in range(len(categorias), n):
+        categorias.append((
+            f"Categoría {i + 1}", 1, 20.0, 0.8, 30, False,
+            tuple(f"Comercio {i + 1}-{j + 1}" for j in range(4))
+        ))
+    return categorias
+
+def _comercios(rng, comercios):
+    """Nombres de comercio con su sucursal y la probabilidad Zipf de cada uno."""
+    nombres = [f"{c} {ciudad}" for c in comercios for ciudad in rng.permutation(CIUDADES)[:3]]
+    nombres = [nombres[i] for i in rng.permutation(len(nombres))]
+    pesos = 1.0 / np.arange(1, len(nombres) + 1) ** 1.1
+    return nombres, pesos / pesos.sum()
+
+def _pesos_dias(dias, mensual, inicio):
+    """Probabilidad de cada día del periodo para una categoría."""
+    fechas = dias.astype('datetime64[D]')
+    dia_semana = (dias + 3) % 7  # 1970-01-01 fue jueves
+    meses = fechas.astype('datetime64[M]').astype(int) % 12
+    dia_mes = (fechas - fechas.astype('datetime64[M]')).astype(int) + 1
+    pesos = FACTOR_DIA_SEMANA[dia_semana] * FACTOR_MES[meses]
+    pesos *= (1 + TENDENCIA_ANUAL) ** ((dias - inicio) / 365.25)
+    if mensual:
+        # Los recibos se cargan entre el día 1 y el 5
+        pesos = np.where(dia_mes <= 5, 1.0, 0.0)
+    return pesos / pesos.sum()
+
+def _gastos_cuenta(rng, config, num_gastos, categorias):
+    """Columnas de los gastos de una cuenta, ordenadas por fecha.
+
+    `categorias` es una lista de (categoria_id, definición de CATEGORIAS).
+    """
+    fin = np.datetime64(config.hasta, 'D').astype(int)
+    inicio = fin - 365 * config.anios + 1
+    dias = np.arange(inicio, fin + 1)
+
+    pesos = np.array([definicion[1] for _, definicion in categorias], dtype=float)
+    por_categoria = rng.multinomial(num_gastos, pesos / pesos.sum())
+
+    fechas, ids, centimos, lugares = [], [], [], []
+    for (categoria_id, definicion), n in zip(categorias, por_categoria):
+        if n == 0:
+            continue
+        _, _, mediana, dispersion, _, mensual, comercios = definicion
+        nombres, probabilidades = _comercios(rng, comercios)
+        fechas.append(rng.choice(dias, size=n, p=_pesos_dias(dias, mensual, inicio)))
+        ids.append(np.full(n, categoria_id))
+        importes = rng.lognormal(np.log(mediana * 100), dispersion, n)
+        centimos.append(np.maximum(np.rint(importes), 1).astype(np.int64))
+        lugares.append(np.array(nombres, dtype=object)[rng.choice(len(nombres), size=n, p=probabilidades)])
+
+    fechas = np.concatenate(fechas)
+    orden = np.argsort(fechas, kind='stable')
+    notas = np.array(NOTAS, dtype=object)[rng.integers(0, len(NOTAS), num_gastos)]
+    notas[rng.random(num_gastos) >= FRACCION_NOTAS] = None
+    return (
+        fechas[orden].astype('datetime64[D]').astype(str).tolist(),
+        np.concatenate(ids)[orden].tolist(),
+        np.concatenate(centimos)[orden].tolist(),
+        np.concatenate(lugares)[orden].tolist(),
+        notas.tolist(),
+    )
+
+def _huellas(fechas, lugares, centimos):
+    # Misma numeración de repeticiones que el importador
+    ocurrencias = {}
+    huellas = []
+    for fecha, lugar, c in zip(fechas, lugares, centimos):
+        base = huella_base(fecha, lugar, c)
+        ocurrencias[base] = ocurrencias.get(base, 0) + 1
+        huellas.append(f"{base}:{ocurrencias[base]}")
+    return huellas
+
+def _insertar_gastos(conn, cuenta_id, autores, columnas, rng):
+    fechas, categoria_ids, centimos, lugares, notas = columnas
+    usuario_ids = np.array(autores)[rng.integers(0, len(autores), len(fechas))].tolist()
+    huellas = _huellas(fechas, lugares, centimos)
+    anotador = AnotadorLote(conn, cuenta_id)
+    for inicio in range(0, len(fechas), TAMANO_LOTE):
+        fin = inicio + TAMANO_LOTE
+        conn.executemany('''
+            INSERT INTO gastos
+                (cuenta_id, categoria_id, centimos, lugar, fecha, usuario_id, notas, huella, anomalia)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [
+            (cuenta_id, categoria_id, c, lugar, fecha, usuario_id, nota, huella,
+             anotador.anotar(categoria_id, lugar, c))
+            for fecha, categoria_id, c, lugar, usuario_id, nota, huella in zip(
+                fechas[inicio:fin], categoria_ids[inicio:fin], centimos[inicio:fin], lugares[inicio:fin],
+                usuario_ids[inicio:fin], notas[inicio:fin], huellas[inicio:fin]
+            )
+        ])
+    anotador.guardar()
+
+def generar(config, progreso=None):
+    """Llena la base de datos configurada con los datos de `config`.
+
+    La base de datos tiene que estar vacía. Devuelve un dict con los ids de
+    usuarios y cuentas y los gastos de cada cuenta. Si se pasa `progreso`, se
+    llama con (gastos insertados, total) tras cada cuenta.
+    """
+    rng = np.random.default_rng(config.semilla)
+    database.initialize_db()
+    with transaccion() as conn:
+        if conn.execute("SELECT COUNT(*) FROM usuarios").fetchone()[0]:
+            raise ValueError("La base de datos de destino no está vacía")
+        password = bcrypt.hashpw(PASSWORD_SINTETICA.encode('utf-8'), bcrypt.gensalt())
+        usuarios = [
+            conn.execute(
+                "INSERT INTO usuarios (nombre, email, password) VALUES (?, ?, ?) RETURNING id",
+                (f"Usuario {i + 1}", f"usuario{i + 1}@sintetico.local", password)
+            ).fetchone()[0]
+            for i in range(config.usuarios)
+        ]
+        # Cada cuenta es de un usuario y la mitad se comparten con otro
+        miembros = {}
+        for i in range(config.cuentas):
+            creador = usuarios[i % len(usuarios)]
+            cuenta_id = conn.execute(
+                "INSERT INTO cuentas (nombre, creador_id) VALUES (?, ?) RETURNING id",
+                (f"Cuenta {i + 1}", creador)
+            ).fetchone()[0]
+            miembros[cuenta_id] = {creador: 'admin'}
+            otros = [u for u in usuarios if u != creador]
+            if otros and rng.random() < 0.5:
+                miembros[cuenta_id][otros[rng.integers(len(otros))]] = rng.choice(['editor', 'viewer'])
+            conn.executemany(
+                "INSERT INTO usuarios_cuentas (usuario_id, cuenta_id, rol) VALUES (?, ?, ?)",
+                [(u, cuenta_id, str(rol)) for u, rol in miembros[cuenta_id].items()]
+            )
+
+    # Unas cuentas mucho más grandes que otras
+    pesos = 1.0 / np.arange(1, config.cuentas + 1)
+    por_cuenta = rng.multinomial(config.gastos, pesos / pesos.sum())
+    definiciones = _categorias(config.categorias)
+    insertados = 0
+    for (cuenta_id, roles), num_gastos in zip(miembros.items(), por_cuenta):
+        with transaccion() as conn:
+            categorias = [
+                (conn.execute(
+                    "INSERT INTO categorias (nombre, cuenta_id, presupuesto_mensual) VALUES (?, ?, ?) RETURNING id",
+                    (definicion[0], cuenta_id, definicion[4])
+                ).fetchone()[0], definicion)
+                for definicion in definiciones
+            ]
+            if num_gastos:
+                autores = [u for u, rol in roles.items() if rol != 'viewer']
+                columnas = _gastos_cuenta(rng, config, int(num_gastos), categorias)
+                _insertar_gastos(conn, cuenta_id, autores, columnas, rng)
+        insertados += int(num_gastos)
+        if progreso:
+            progreso(insertados, config.gastos)
+
+    return {
+        'usuarios': usuarios,
+        'cuentas': list(miembros),
+        'gastos_por_cuenta': dict(zip(miembros, por_cuenta.tolist())),
+    }
+
+def csv_sintetico(filas, semilla=0, hasta=None, anios=1, categorias=12):
+    """CSV en el formato del importador (date, store, amount, category)."""
+    config = ConfigSintetica(categorias=categorias, anios=anios, semilla=semilla, hasta=hasta or date.today())
+    rng = np.random.default_rng(semilla)
+    definiciones = _categorias(categorias)
+    fechas, indices, centimos, lugares, _ = _gastos_cuenta(rng, config, filas, list(enumerate(definiciones)))
+    salida = io.StringIO()
+    escritor = csv.writer(salida, lineterminator='\n')
+    escritor.writerow(('date', 'store', 'amount', 'category'))
+    escritor.writerows(
+        (date.fromisoformat(f).strftime('%d/%m/%y'), lugar, f"{c / 100:.2f}", definiciones[i][0])
+        for f, i, c, lugar in zip(fechas, indices, centimos, lugares)
+    )
+    return salida.getvalue().encode('utf-8')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genera una base de datos sintética de GeldTrack.")
+    parser.add_argument('destino', help="ruta del archivo SQLite o URL de PostgreSQL (vacía)")
+    parser.add_argument('--usuarios', type=int, default=ConfigSintetica.usuarios)
+    parser.add_argument('--cuentas', type=int, default=ConfigSintetica.cuentas)
+    parser.add_argument('--categorias', type=int, default=ConfigSintetica.categorias)
+    parser.add_argument('--gastos', type=int, default=ConfigSintetica.gastos)
+    parser.add_argument('--anios', type=int, default=ConfigSintetica.anios)
+    parser.add_argument('--semilla', type=int, default=ConfigSintetica.semilla)
+    parser.add_argument('--hasta', type=date.fromisoformat, default=date.today(),
+                        help="último día con gastos, YYYY-MM-DD (por defecto hoy)")
+    argumentos = parser.parse_args()
+
+    database.configurar_db(argumentos.destino)
+    inicio = time.perf_counter()
+    resumen = generar(
+        ConfigSintetica(
+            usuarios=argumentos.usuarios, cuentas=argumentos.cuentas, categorias=argumentos.categorias,
+            gastos=argumentos.gastos, anios=argumentos.anios, semilla=argumentos.semilla,
+            hasta=argumentos.hasta,
+        ),
+        progreso=lambda hechos, total: print(f"{hechos}/{total} gastos"),
+    )
+    print(f"{len(resumen['usuarios'])} usuarios, {len(resumen['cuentas'])} cuentas, "
+          f"{argumentos.gastos} gastos en {time.perf_counter() - inicio:.1f} s "
+          f"(contraseña '{PASSWORD_SINTETICA}')")
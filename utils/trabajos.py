@@ -0,0 +1,231 @@
+"""Trabajos en segundo plano para las operaciones largas (importaciones...).
+
+El script de Streamlit sólo envía el trabajo y consulta su estado; lo ejecuta
+un pool de hilos del proceso, así que sobrevive a los reruns y a que se
+recargue la pestaña. Estado, resultado y tiempos quedan en la tabla
+trabajos; el progreso se lleva en memoria, sin escribir en la base de datos
+por cada bloque de una importación.
+
+Sólo puede haber un trabajo activo de cada tipo por cuenta: volver a
+enviarlo devuelve el que ya está en marcha.
+"""
+import json
+import secrets
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+from database import get_db_connection, transaccion, ErrorIntegridad
+
+# Hilos que ejecutan trabajos a la vez; el resto espera en cola
+MAX_TRABAJADORES = 2
+
+# Segundos sin latido tras los que un trabajo activo de otro proceso se da
+# por perdido (el proceso que lo ejecutaba se reinició); hasta entonces
+# bloquea a los del mismo tipo de su cuenta
+TRABAJO_HUERFANO = 600
+
+# Cada cuántos segundos renueva un proceso el latido de sus trabajos activos.
+# Lo hace un hilo aparte, que en SQLite espera como mucho a que la
+# importación confirme el bloque en curso
+LATIDO = 30
+
+ACTIVOS = ('pendiente', 'en_curso')
+
+# Identifica a este proceso entre los que comparten la base de datos
+PROCESO = secrets.token_hex(4)
+
+_ejecutor = None
+_bloqueo = threading.Lock()
+# Progreso (hechas, total) de los trabajos activos de este proceso
+_progreso = {}
+
+@dataclass(frozen=True)
+class Trabajo:
+    id: str
+    tipo: str
+    cuenta_id: int
+    estado: str
+    hechas: int
+    total: Optional[int]
+    resultado: Optional[dict]
+    error: Optional[str]
+    creado: float
+    iniciado: Optional[float]
+    terminado: Optional[float]
+
+    @property
+    def activo(self):
+        return self.estado in ACTIVOS
+
+    @property
+    def fraccion(self):
+        """Parte completada entre 0 y 1, o None si no se conoce el total."""
+        if self.estado == 'terminado':
+            return 1.0
+        return min(self.hechas / self.total, 1.0) if self.total else None
+
+    @property
+    def espera(self):
+        """Segundos en cola hasta empezar."""
+        return (self.iniciado or time.time()) - self.creado
+
+    @property
+    def duracion(self):
+        """Segundos de ejecución (hasta ahora, si sigue en curso)."""
+        if self.iniciado is None:
+            return 0.0
+        return (self.terminado or time.time()) - self.iniciado
+
+def _desde_fila(fila):
+    hechas, total = _progreso.get(fila['id'], (fila['hechas'], fila['total']))
+    return Trabajo(
+        id=fila['id'],
+        tipo=fila['tipo'],
+        cuenta_id=fila['cuenta_id'],
+        estado=fila['estado'],
+        hechas=hechas,
+        total=total,
+        resultado=json.loads(fila['resultado']) if fila['resultado'] else None,
+        error=fila['error'],
+        creado=fila['creado'],
+        iniciado=fila['iniciado'],
+        terminado=fila['terminado'],
+    )
+
+def _get_ejecutor():
+    global _ejecutor
+    with _bloqueo:
+        if _ejecutor is None:
+            _ejecutor = ThreadPoolExecutor(max_workers=MAX_TRABAJADORES, thread_name_prefix='trabajo')
+            threading.Thread(target=_latir, name='trabajo-latido', daemon=True).start()
+        return _ejecutor
+
+def _latir():
+    """Renueva cada LATIDO segundos el latido de los trabajos de este proceso."""
+    while True:
+        time.sleep(LATIDO)
+        if not _progreso:
+            continue
+        try:
+            with transaccion() as conn:
+                conn.execute(
+                    f"UPDATE trabajos SET latido = ? WHERE proceso = ? AND estado IN {ACTIVOS}",
+                    (time.time(), PROCESO)
+                )
+        except Exception:
+            traceback.print_exc()
+
+def _marcar_huerfanos(conn, cuenta_id):
+    conn.execute(f'''
+        UPDATE trabajos SET estado = 'interrumpido', terminado = ?
+        WHERE cuenta_id = ? AND estado IN {ACTIVOS} AND proceso != ?
+        AND COALESCE(latido, creado) < ?
+    ''', (time.time(), cuenta_id, PROCESO, time.time() - TRABAJO_HUERFANO))
+
+def _buscar_activo(conn, cuenta_id, tipo):
+    fila = conn.execute(
+        f"SELECT id FROM trabajos WHERE cuenta_id = ? AND tipo = ? AND estado IN {ACTIVOS}",
+        (cuenta_id, tipo)
+    ).fetchone()
+    return fila['id'] if fila else None
+
+def enviar(tipo, cuenta_id, usuario_id, funcion, *argumentos):
+    """Encola funcion(progreso, *argumentos) y devuelve el id del trabajo.
+
+    `funcion` recibe un callable progreso(hechas, total=None) y devuelve un
+    dict serializable a JSON con el resultado. Si la cuenta ya tiene un
+    trabajo activo de ese tipo, no se encola nada y se devuelve su id.
+    """
+    trabajo_id = secrets.token_hex(8)
+    try:
+        with transaccion() as conn:
+            _marcar_huerfanos(conn, cuenta_id)
+            activo = _buscar_activo(conn, cuenta_id, tipo)
+            if activo:
+                return activo
+            conn.execute('''
+                INSERT INTO trabajos (id, tipo, cuenta_id, usuario_id, estado, proceso, creado)
+                VALUES (?, ?, ?, ?, 'pendiente', ?, ?)
+            ''', (trabajo_id, tipo, cuenta_id, usuario_id, PROCESO, time.time()))
+    except ErrorIntegridad:
+        # Otro proceso lo encoló a la vez
+        return _buscar_activo(get_db_connection(), cuenta_id, tipo)
+
+    _progreso[trabajo_id] = (0, None)
+    _get_ejecutor().submit(_ejecutar, trabajo_id, funcion, argumentos)
+    return trabajo_id
+
+def _ejecutar(trabajo_id, funcion, argumentos):
+    ahora = time.time()
+    with transaccion() as conn:
+        conn.execute(
+            "UPDATE trabajos SET estado = 'en_curso', iniciado = ?, latido = ? WHERE id = ?",
+            (ahora, ahora, trabajo_id)
+        )
+
+    def progreso(hechas, total=None):
+        _progreso[trabajo_id] = (hechas, total)
+
+    estado, resultado, error = 'terminado', None, None
+    try:
+        resultado = funcion(progreso, *argumentos)
+    except Exception as e:
+        traceback.print_exc()
+        estado, error = 'fallido', f"{type(e).__name__}: {e}"
+    finally:
+        hechas, total = _progreso.get(trabajo_id, (0, None))
+        try:
+            with transaccion() as conn:
+                conn.execute('''
+                    UPDATE trabajos
+                    SET estado = ?, hechas = ?, total = ?, resultado = ?, error = ?, terminado = ?
+                    WHERE id = ?
+                ''', (
+                    estado, hechas, total,
+                    json.dumps(resultado) if resultado is not None else None,
+                    error, time.time(), trabajo_id
+                ))
+        finally:
+            _progreso.pop(trabajo_id, None)
+
+def obtener(trabajo_id):
+    """El trabajo con ese id, o None."""
+    fila = get_db_connection().execute(
+        "SELECT * FROM trabajos WHERE id = ?", (trabajo_id,)
+    ).fetchone()
+    return _desde_fila(fila) if fila else None
+
+def trabajo_activo(cuenta_id, tipo):
+    """El trabajo de ese tipo en marcha en la cuenta, o None."""
+    fila = get_db_connection().execute(
+        f"SELECT * FROM trabajos WHERE cuenta_id = ? AND tipo = ? AND estado IN {ACTIVOS}",
+        (cuenta_id, tipo)
+    ).fetchone()
+    return _desde_fila(fila) if fila else None
+
+def metricas(desde=None):
+    """Tiempos de los trabajos terminados desde el timestamp `desde`, por tipo.
+
+    Devuelve filas (tipo, trabajos, fallidos, espera_media, duracion_media,
+    duracion_maxima), con los tiempos en segundos.
+    """
+    return get_db_connection().execute('''
+        SELECT tipo,
+               COUNT(*) AS trabajos,
+               SUM(CASE WHEN estado = 'terminado' THEN 0 ELSE 1 END) AS fallidos,
+               AVG(iniciado - creado) AS espera_media,
+               AVG(terminado - iniciado) AS duracion_media,
+               MAX(terminado - iniciado) AS duracion_maxima
+        FROM trabajos
+        WHERE terminado IS NOT NULL AND creado >= ?
+        GROUP BY tipo
+        ORDER BY tipo
+    ''', (desde or 0,)).fetchall()
+
+def en_este_proceso():
+    """Número de trabajos encolados o en curso en este proceso."""
+    return len(_progreso)
@@ -0,0 +1,177 @@
+"""Trazas de las consultas SQL: contadores por consulta y registro de las lentas.
+
+Los cursores de database pasan cada ejecución por aquí. Cada consulta se
+agrupa por su SQL normalizado (sin literales ni espacios sobrantes) y por
+el código de la aplicación que la lanzó, con llamadas, tiempo total y
+máximo, y filas. El tiempo incluye el de leer las filas, que se va sumando
+según se piden.
+
+La que pasa de UMBRAL_LENTA_MS se anota en el registro de consultas lentas
+junto con su plan (EXPLAIN QUERY PLAN en SQLite, EXPLAIN en PostgreSQL) en
+cuanto lo supera. Se guardan las últimas en memoria, donde tiempo y filas
+se siguen actualizando mientras se leen, y, si está definida
+SQL_REGISTRO_LENTAS, se añaden a ese archivo como líneas JSON con lo medido
+hasta entonces; si no, se avisa con logging. Los parámetros nunca se
+registran: llevan importes, comercios y notas.
+"""
+import json
+import logging
+import os
+import re
+import sys
+import threading
+from collections import deque
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from functools import lru_cache
+
+_log = logging.getLogger(__name__)
+
+# SQL_TRAZAS=0 desactiva las trazas
+ACTIVAS = os.environ.get('SQL_TRAZAS', '1') != '0'
+
+UMBRAL_LENTA_MS = float(os.environ.get('SQL_UMBRAL_LENTA_MS', 200))
+REGISTRO_LENTAS = os.environ.get('SQL_REGISTRO_LENTAS')
+
+# Consultas lentas que se conservan en memoria
+MAX_LENTAS = 200
+
+_RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Marcos que no cuentan como origen de la consulta
+_OMITIR = (
+    os.path.join(_RAIZ, 'database') + os.sep,
+    os.path.join(_RAIZ, 'utils', 'trazas.py'),
+    os.path.join(_RAIZ, 'utils', 'cache.py'),
+)
+
+# Sentencias de las que se puede pedir el plan sin ejecutarlas
+_CON_PLAN = re.compile(r"\s*(SELECT|WITH|INSERT|UPDATE|DELETE)\b", re.IGNORECASE)
+
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_LISTA = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+@dataclass
+class Contador:
+    llamadas: int = 0
+    total_ms: float = 0.0
+    maximo_ms: float = 0.0
+    filas: int = 0
+    lentas: int = 0
+
+_contadores = {}  # (sql normalizado, origen) -> Contador
+_lentas = deque(maxlen=MAX_LENTAS)
+_bloqueo = threading.Lock()
+# Milisegundos de SQL acumulados por cada hilo
+_hilo = threading.local()
+
+@lru_cache(maxsize=1024)
+def normalizar_sql(sql):
+    """SQL en una línea, con los literales como ? y las listas IN como (...)."""
+    sql = ' '.join(_LITERAL.sub('?', sql).split())
+    return _LISTA.sub('(...)', sql)
+
+@lru_cache(maxsize=256)
+def _relativa(archivo):
+    return os.path.relpath(archivo, _RAIZ).replace(os.sep, '/')
+
+def _origen():
+    """'archivo.py:funcion' del primer marco de la aplicación fuera de database."""
+    marco = sys._getframe(2)
+    while marco is not None:
+        archivo = marco.f_code.co_filename
+        if archivo.startswith(_RAIZ) and not archivo.startswith(_OMITIR):
+            return f"{_relativa(archivo)}:{marco.f_code.co_name}"
+        marco = marco.f_back
+    return '?'
+
+class Traza:
+    """Una ejecución de una consulta; acumula lo que tarda hasta leer sus filas.
+
+    `plan` es un callable sin argumentos que devuelve las líneas del plan, o
+    None si la sentencia no admite EXPLAIN.
+    """
+    __slots__ = ('sql', 'origen', 'plan', 'ms', 'filas', 'entrada', 'contador')
+
+    def __init__(self, sql, plan=None):
+        self.sql = normalizar_sql(sql)
+        self.origen = _origen()
+        self.plan = plan if plan is not None and _CON_PLAN.match(sql) else None
+        self.ms = 0.0
+        self.filas = 0
+        self.entrada = None  # su entrada del registro, si resulta lenta
+        with _bloqueo:
+            self.contador = _contadores.setdefault((self.sql, self.origen), Contador())
+            self.contador.llamadas += 1
+
+    def sumar(self, segundos, filas=0):
+        ms = segundos * 1000
+        self.ms += ms
+        self.filas += filas
+        _hilo.ms = getattr(_hilo, 'ms', 0.0) + ms
+        with _bloqueo:
+            self.contador.total_ms += ms
+            self.contador.filas += filas
+            self.contador.maximo_ms = max(self.contador.maximo_ms, self.ms)
+            if self.entrada is not None:
+                # Las filas que se leen después siguen sumando en memoria
+                self.entrada['ms'] = round(self.ms, 1)
+                self.entrada['filas'] = self.filas
+                return
+            lenta = self.ms >= UMBRAL_LENTA_MS
+            if lenta:
+                self.contador.lentas += 1
+        if lenta:
+            self.entrada = _registrar_lenta(self)
+
+def _registrar_lenta(traza):
+    try:
+        plan = traza.plan() if traza.plan else None
+    except Exception as e:
+        plan = [f"Sin plan: {type(e).__name__}: {e}"]
+    entrada = {
+        'momento': datetime.now().isoformat(timespec='seconds'),
+        'ms': round(traza.ms, 1),
+        'filas': traza.filas,
+        'origen': traza.origen,
+        'sql': traza.sql,
+        'plan': plan,
+    }
+    with _bloqueo:
+        _lentas.append(entrada)
+        if REGISTRO_LENTAS:
+            with open(REGISTRO_LENTAS, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entrada, ensure_ascii=False) + '\n')
+    if not REGISTRO_LENTAS:
+        _log.warning("Consulta lenta (%.0f ms) en %s: %s", entrada['ms'], traza.origen, traza.sql[:160])
+    return entrada
+
+def ms_en_hilo():
+    """Milisegundos de SQL del hilo actual desde que empezó; se usa por diferencias."""
+    return getattr(_hilo, 'ms', 0.0)
+
+def contadores():
+    """Contadores agregados, de más a menos tiempo total, como lista de dicts."""
+    with _bloqueo:
+        filas = [
+            dict(sql=sql, origen=origen, media_ms=c.total_ms / c.llamadas if c.llamadas else 0.0, **asdict(c))
+            for (sql, origen), c in _contadores.items()
+        ]
+    return sorted(filas, key=lambda f: f['total_ms'], reverse=True)
+
+def consultas_lentas():
+    """Las últimas consultas lentas, de la más reciente a la más antigua."""
+    with _bloqueo:
+        return [dict(entrada) for entrada in reversed(_lentas)]
+
+def exportar():
+    """Contadores y consultas lentas en JSON."""
+    return json.dumps({
+        'umbral_lenta_ms': UMBRAL_LENTA_MS,
+        'consultas': contadores(),
+        'lentas': consultas_lentas(),
+    }, ensure_ascii=False, indent=2)
+
+def reiniciar():
+    with _bloqueo:
+        _contadores.clear()
+        _lentas.clear()